@@ -32,6 +32,7 @@
 ##################################################################
 
 import os
+import sys
 import glob
 import datetime
 import urllib2 as ul
@@ -44,6 +45,30 @@ import csv
 import json
 from collections import deque
 
+# The columnar format of the inventory is shared with the web interface
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'wsgi'))
+import invformat
+import invdelta
+import invsqlite
+import invsegment
+import traveltime
+
+
+# End of the stations without end, used to compare them
+NEVER = invformat.toEpoch(datetime.datetime(2999, 1, 1))
+
+
+def internstr(value):
+    """Return the shared copy of a string repeated across the inventory.
+
+    Channel and location codes and datalogger descriptions are the same for
+    many streams. Unicode strings (non-ASCII descriptions) cannot be
+    interned and are returned as they are.
+
+    """
+    return intern(value) if isinstance(value, str) else value
+
 
 def makenetcode(net, year):
     if net[0] in '0123456789XYZ':
@@ -68,7 +93,7 @@ class ListChans(list):
 
     def append(self, cha):
         logging.debug('Try to add channel: %s' % (cha,))
-        if (cha[0], cha[1]) in self.keys:
+        if (cha.sensorLoc, cha.code) in self.keys:
             return
         # for ind, item in enumerate(self):
         #     # If network.station.location-year code is already in the list
@@ -77,7 +102,7 @@ class ListChans(list):
 
         # Add location if not present
         logging.debug('Added')
-        self.keys.add((cha[0], cha[1]))
+        self.keys.add((cha.sensorLoc, cha.code))
         super(ListChans, self).append(cha)
 
 
@@ -95,7 +120,7 @@ class ListLocs(list):
         logging.debug('Try to add location: %s' % loc)
         for ind, item in enumerate(self):
             # If network.station-year code is already in the list
-            if (item[0] == loc[0]) and (item[4] == loc[4]):
+            if (item.station == loc.station) and (item.code == loc.code):
                 return
 
         # Add location if not present
@@ -118,15 +143,15 @@ class ListStats(list):
         for ind, item in enumerate(self):
             # If network code is already in the list
             # And also if the station code is the same
-            if (item[0] == sta[0]) and (item[4] == sta[4]):
+            if (item.network == sta.network) and (item.code == sta.code):
                 # Check if it is a different network (temporary)
                 # end1 is the end of the station already on the list
-                end1 = item[9] if item[9] is not None else datetime.datetime(2999, 1, 1)
+                end1 = item.end if item.end is not None else NEVER
                 # end2 is the end of the station to be added
-                end2 = sta[9] if sta[9] is not None else datetime.datetime(2999, 1, 1)
+                end2 = sta.end if sta.end is not None else NEVER
 
                 # If there is no overlap skip to the next item
-                if max(sta[8], item[8]) > min(end1, end2):
+                if max(sta.start, item.start) > min(end1, end2):
                     continue
                 # overlap = range(max(sta[8].year, item[8].year), min(end1.year, end2.year)+1)
                 # # Find if there is an overlap in time between the two stations
@@ -162,15 +187,15 @@ class ListNets(list):
     def append(self, net):
         for ind, item in enumerate(self):
             # If network code is already in the list
-            if item[0] == net[0]:
+            if item.code == net.code:
                 # Check if it is a different network (temporary)
-                if (net[4] == item[4]) and (net[5] == item[5]):
+                if (net.start == item.start) and (net.end == item.end):
                     # Network is already inserted, but consider if the
                     # archive should be added
-                    if net[9] in item[9]:
+                    if net.archive in item.archive:
                         return
                     else:
-                        item[9] += ',%s' % net[9]
+                        item.archive += ',%s' % net.archive
                         return
 
         # Add network if not present
@@ -231,9 +256,9 @@ def parseStationXML(invfile, archive='N/A'):
         netClass = 't' if netw.get('code')[0] in '0123456789XYZ' else 'p'
         institutions = ''
 
-        ptNets.append([makenetcode(netw.get('code'), stnet), 0, None, None, stnet, etnet,
-                       description, restricted, netClass, archive,
-                       institutions])
+        ptNets.append(invformat.Network(makenetcode(netw.get('code'), stnet), 0, None, None,
+                                        stnet, etnet, description, restricted, netClass,
+                                        archive, institutions))
 
         for stat in netw.findall(namesp + 'Station'):
             # logging.debug(stat.attrib)
@@ -266,17 +291,18 @@ def parseStationXML(invfile, archive='N/A'):
             restricted = 2 if stat.get('restrictedStatus') == 'open' else 1
 
             try:
-                ptStats.append([makenetcode(netw.get('code'), stnet),
-                                0, None, None, makestationcode(stat.get('code'), st.year),
-                                lat, lon, description, st, et,
-                                elevation, restricted])
+                ptStats.append(invformat.Station(makenetcode(netw.get('code'), stnet),
+                                                 0, None, makestationcode(stat.get('code'), st.year),
+                                                 lat, lon, description, invformat.toEpoch(st),
+                                                 invformat.toEpoch(et), elevation, restricted))
             except ValueError:
                 continue
 
             for cha in stat.findall(namesp + 'Channel'):
                 # if stat.get('code').startswith('Y01'):
-                ptLocs.append(['%s.%s' % (makenetcode(netw.get('code'), stnet), makestationcode(stat.get('code'), st.year)),
-                               0, None, None, cha.get('locationCode')])
+                ptLocs.append(invformat.SensorLocation('%s.%s' % (makenetcode(netw.get('code'), stnet),
+                                                                  makestationcode(stat.get('code'), st.year)),
+                                                       0, None, internstr(cha.get('locationCode'))))
                 # SampleRateRatio: NumberSamples; NumberSeconds
                 try:
                     denom = float(cha.find(namesp + 'SampleRateRatio').find(namesp + 'NumberSamples').text)
@@ -292,14 +318,16 @@ def parseStationXML(invfile, archive='N/A'):
                 # Datalogger: Description
                 try:
                     datalogger = cha.find(namesp + 'DataLogger')
-                    description = datalogger.find(namesp + 'Description').text
+                    description = internstr(datalogger.find(namesp + 'Description').text)
                 except Exception:
                     description = ''
 
-                ptChans.append(['%s.%s.%s' % (makenetcode(netw.get('code'), stnet), makestationcode(stat.get('code'), st.year),
-                                                 cha.get('locationCode')),
-                                cha.get('code'), None, denom, numer, description,
-                                st, et, restricted])
+                ptChans.append(invformat.Stream('%s.%s.%s' % (makenetcode(netw.get('code'), stnet),
+                                                              makestationcode(stat.get('code'), st.year),
+                                                              cha.get('locationCode')),
+                                                internstr(cha.get('code')), None, denom, numer, description,
+                                                invformat.toEpoch(st), invformat.toEpoch(et),
+                                                restricted))
 
                 cha.clear()
             stat.clear()
@@ -359,18 +387,18 @@ def getstaID(strnet, strsta, strstart, nets, stats):
     logs.debug('Looking for %s.%s %s' % (strnet, strsta, start.year))
 
     for auxidnet, net in enumerate(nets):
-        if net[0] == strnet:
-            logs.debug('%s %s %s: %s' % (net[4], start.year, net[5], (net[4] <= start.year <= net[5])))
-            if (net[4] <= start.year) and (net[5] is None or start.year <= net[5]):
+        if net.code == strnet:
+            logs.debug('%s %s %s: %s' % (net.start, start.year, net.end, (net.start <= start.year <= net.end)))
+            if (net.start <= start.year) and (net.end is None or start.year <= net.end):
                 idnet = auxidnet
                 break
     else:
         raise Exception('Network %s not found!' % strnet)
 
     for auxidsta, sta in enumerate(stats):
-        if sta[0] == idnet:
+        if sta.network == idnet:
             logs.debug('%s %s' % (strsta, sta))
-            if sta[4] == strsta:
+            if sta.code == strsta:
                 idsta = auxidsta
                 break
     else:
@@ -399,11 +427,12 @@ def parseVirtualNets(vntable, nets, stats):
             except Exception as e:
                 logging.error(e)
                 continue
-            minyear = min(stats[idsta][8].year, minyear)
+            minyear = min(invformat.fromEpoch(stats[idsta].start).year, minyear)
             idstats.add(idsta)
 
         logging.info('Adding network %s' % vnnet)
-        nets.append([vnnet, None, None, list(idstats), minyear, None, '%s virtual network' % vnnet, False, 'p', '', ''])
+        nets.append(invformat.Network(vnnet, None, None, list(idstats), minyear, None,
+                                      '%s virtual network' % vnnet, False, 'p', '', ''))
 
     return
 
@@ -603,6 +632,12 @@ def main():
                         help='Do not parse the StationXML files downloaded from the endpoints.')
     parser.add_argument('--singlenode', default=None,
                         help='Get inventory from a single StationWS instead of a Routing Service.')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='Save also the inventory in a SQLite database for the sqlite backend of the web interface.')
+    parser.add_argument('--segmented', action='store_true',
+                        help='Save also the inventory with one segment per network for the segmented backend of the web interface.')
+    parser.add_argument('--traveltimes', action='store_true',
+                        help='Save also a grid of first arrivals of the phases used for the time windows related to events (requires SeisComP3).')
     args = parser.parse_args()
 
     logging.basicConfig(level=args.log)
@@ -650,10 +685,12 @@ def main():
                 ptLocs.extend(locs2add)
                 ptChans.extend(chans2add)
 
-        ptNets.sort()
-        ptStats.sort(key=lambda (s0, s1, s2, s3, s4, s5, s6, s7, s8, s9, s10, s11): (s0, s1, s2, s3, s4, s5, s6, s7, s8, s9 if s9 is not None else datetime.datetime.max, s10, s11))
-        ptLocs.sort()
-        ptChans.sort()
+        ptNets.sort(key=tuple)
+        ptStats.sort(key=lambda s: (s.network, s.first, s.last, s.code, s.latitude, s.longitude,
+                                    s.description, s.start, s.end if s.end is not None else NEVER,
+                                    s.elevation, s.restricted))
+        ptLocs.sort(key=tuple)
+        ptChans.sort(key=tuple)
 
         fixIndexes(ptNets, ptStats, ptLocs, ptChans)
 
@@ -729,13 +766,58 @@ def main():
         csvwriter.writerow([datetime.datetime.now(), len(ptNets), len(ptStats),
                             len(ptLocs), len(ptChans)])
 
-    # Save binary version of the inventory
     cachefile = 'webinterface-cache.bin'
+    colfile = 'webinterface-cache.col'
+    deltafile = 'webinterface-cache.delta'
+
+    # Keep the previous version to save the differences with the new one
+    previous, versions = readPrevious(cachefile, colfile)
+
+    # Save binary version of the inventory
     with open(cachefile, 'wb') as cache:
         os.chmod(cachefile, 0o0664)
         pickle.dump((list(ptNets), list(ptStats), list(ptLocs), list(ptChans), ptStreamIdx),
                     cache)
 
+    # Save the columnar version, which is mapped in memory by the web interface
+    logging.info('Writing columnar version of the inventory')
+    invformat.write(colfile, ptNets, ptStats, ptLocs, ptChans)
+
+    # Save the database queried by the web interface with the sqlite backend
+    if args.sqlite:
+        logging.info('Writing SQLite version of the inventory')
+        invsqlite.write('webinterface-cache.sqlite', ptNets, ptStats, ptLocs, ptChans)
+
+    # Save the segments read on demand by the web interface with the
+    # segmented backend
+    if args.segmented:
+        logging.info('Writing segmented version of the inventory')
+        invsegment.write('webinterface-cache.seg', ptNets, ptStats, ptLocs, ptChans)
+
+    # Save the travel times interpolated by the web interface
+    if args.traveltimes:
+        logging.info('Writing grid of travel times')
+        import seiscomp3.Seismology
+        traveltime.writeGrid(traveltime.GRIDFILE,
+                             seiscomp3.Seismology.TravelTimeTable())
+
+    # Save the differences with the previous version, so that the web
+    # interface can update its indexes instead of building them again
+    if previous is not None:
+        logging.info('Writing differences with the previous inventory')
+        delta = invdelta.diff(previous, (ptNets, ptStats, ptLocs, ptChans))
+        for filename, base in versions.items():
+            delta.versions[filename] = (base, invformat.fileHash(filename))
+        invdelta.write(deltafile, delta)
+
+        for name in ('networks', 'stations', 'streams'):
+            table = getattr(delta, name)
+            logging.info('%s: %d added, %d removed, %d changed' %
+                         (name, len(table.added), len(table.removed),
+                          len(table.changed)))
+    elif os.path.exists(deltafile):
+        os.remove(deltafile)
+
     for net in ptNets[:10]:
         logging.debug(net)
 
@@ -759,21 +841,55 @@ def main():
     return
 
 
+def readPrevious(cachefile, colfile):
+    """Read the inventory saved by the previous run.
+
+    Returns the tables of the inventory and the hashes of the cache files
+    by name, or (None, None) if there is no previous version.
+
+    """
+
+    versions = dict((filename, invformat.fileHash(filename))
+                    for filename in (cachefile, colfile)
+                    if os.path.exists(filename))
+
+    try:
+        if colfile in versions:
+            inv = invformat.load(colfile)
+            return ((inv.networks, inv.stations, inv.sensorsLoc, inv.streams),
+                    versions)
+
+        if cachefile in versions:
+            with open(cachefile) as cache:
+                networks, stations, sensorsLoc, streams, streamidx = pickle.load(cache)
+
+            # Caches written by old versions of this script have lists
+            if networks and isinstance(networks[0], list):
+                return (invformat.fromLegacy(networks, stations, sensorsLoc, streams),
+                        versions)
+
+            return ((networks, stations, sensorsLoc, streams), versions)
+    except Exception as e:
+        logging.error('Error reading the previous inventory: %s' % e)
+
+    return (None, None)
+
+
 def indexStreams(networks, stations, sensorsLoc, streams):
     streamidx = {}
 
     for stream in streams:
         try:
-            sensorLoc = sensorsLoc[stream[0]]
+            sensorLoc = sensorsLoc[stream.sensorLoc]
         except Exception:
             logging.error('Problem with stream: %s' % stream)
             return
 
-        station = stations[sensorLoc[0]]
-        network = networks[station[0]]
+        station = stations[sensorLoc.station]
+        network = networks[station.network]
 
         # (net,sta,cha,loc)
-        key = (network[0], station[4], stream[1], sensorLoc[4])
+        key = (network.code, station.code, stream.code, sensorLoc.code)
 
         try:
             obj = streamidx[key]
@@ -795,50 +911,50 @@ def fixIndexes(ptNets, ptStats, ptLocs, ptChans):
 
     while idxnet < len(ptNets):
         net = ptNets[idxnet]
-        net[1] = idxsta
+        net.first = idxsta
 
         while idxsta < len(ptStats):
             sta = ptStats[idxsta]
-            # logging.debug('%s ... %s' % (sta[0], net[0] + '-' + str(net[4])))
-            # if sta[0] != net[0] + '-' + str(net[4]):
-            logging.debug('%s ... %s' % (sta[0], net[0]))
-            if sta[0] != net[0]:
+            # logging.debug('%s ... %s' % (sta.network, net.code + '-' + str(net.start)))
+            # if sta.network != net.code + '-' + str(net.start):
+            logging.debug('%s ... %s' % (sta.network, net.code))
+            if sta.network != net.code:
                     break
-            sta[0] = idxnet
-            sta[1] = idxloc
+            sta.network = idxnet
+            sta.first = idxloc
 
             while idxloc < len(ptLocs):
                 loc = ptLocs[idxloc]
-                netcode, year = net[0], str(sta[8].year)
-                logging.debug('%s ... %s' % (loc[0], netcode + '.' + sta[4]))
-                if loc[0] != netcode + '.' + sta[4]:
+                netcode = net.code
+                logging.debug('%s ... %s' % (loc.station, netcode + '.' + sta.code))
+                if loc.station != netcode + '.' + sta.code:
                     break
-                loc[0] = idxsta
-                loc[1] = idxcha
+                loc.station = idxsta
+                loc.first = idxcha
 
                 while idxcha < len(ptChans):
                     cha = ptChans[idxcha]
-                    netsta = net[0] + '.' + sta[4]
-                    logging.debug('%s ... %s' % (cha[0], netsta + '.' + loc[4]))
-                    if cha[0] != netsta + '.' + loc[4]:
+                    netsta = net.code + '.' + sta.code
+                    logging.debug('%s ... %s' % (cha.sensorLoc, netsta + '.' + loc.code))
+                    if cha.sensorLoc != netsta + '.' + loc.code:
                         break
-                    cha[0] = idxloc
+                    cha.sensorLoc = idxloc
                     idxcha += 1
 
-                loc[2] = idxcha
+                loc.last = idxcha
                 idxloc += 1
 
-            sta[2] = idxloc
+            sta.last = idxloc
             # Remove the year from station code
-            if '_' in sta[4]:
-                sta[4] = sta[4].split('_')[0]
+            if '_' in sta.code:
+                sta.code = sta.code.split('_')[0]
 
             idxsta += 1
 
-        net[2] = idxsta
+        net.last = idxsta
         # Remove the year from temporary networks
-        if '_' in net[0]:
-            net[0] = net[0].split('_')[0]
+        if '_' in net.code:
+            net.code = net.code.split('_')[0]
 
         idxnet += 1
 
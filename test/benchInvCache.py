@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""Benchmark of the InventoryCache with a synthetic inventory
+
+An inventory generated by invgen.py (or the cache files in a directory) is
+loaded and the main methods of the InventoryCache are called repeatedly:
+getNetworks, getStations, getStreams, getQuery with its three modes
+(codes, region and events), getStreamInfo and the time windows of the
+metadata module. For every measurement, the minimum, median and mean time
+are reported together with the peak resident memory of the process at that
+moment. The results are printed in JSON format.
+
+The SeisComP modules used by the web interface must be available.
+
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import datetime
+import platform
+import resource
+import tempfile
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'wsgi'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'wsgi', 'modules'))
+
+import invgen
+import invsqlite
+import invsegment
+import inventorycache
+
+# Backend of the InventoryCache used with every format of the cache
+BACKENDS = {'sqlite': 'sqlite', 'seg': 'segmented'}
+
+
+def peakRSS():
+    """Peak resident memory of the process in kB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, but Mac OS reports bytes
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def measure(func, repeat):
+    """Call func repeatedly and summarise the times of the calls."""
+    times = []
+    for i in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+
+    times.sort()
+    return {'repeat': repeat,
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'mean': sum(times) / len(times),
+            'size': len(result) if hasattr(result, '__len__') else None,
+            'peakRSS': peakRSS()}
+
+
+class BenchInterface(object):
+    """The minimum of the WebInterface needed by the metadata module."""
+
+    def __init__(self, ic):
+        self.ic = ic
+
+    def registerAction(self, name, func, *multipar):
+        pass
+
+    def getConfigInt(self, option, default=None):
+        return default
+
+
+class InvCacheBenchmark(object):
+    def __init__(self, directory, repeat, seed, backend='columnar'):
+        self.directory = directory
+        self.backend = backend
+        self.repeat = repeat
+        self.rnd = random.Random(seed)
+        self.results = {}
+        self.ic = None
+
+    def run(self, name, func, repeat=None):
+        self.results[name] = measure(func, repeat or self.repeat)
+        sys.stderr.write('%-20s %10.4f s\n' % (name,
+                                                self.results[name]['median']))
+
+    def load(self):
+        inventory = os.path.join(self.directory, 'Arclink-inventory.xml')
+
+        def build():
+            self.ic = inventorycache.InventoryCache(inventory, self.backend)
+            return self.ic.stations
+
+        # The indexes are built when the first requests need them
+        self.run('load', build, 1)
+        self.run('prepare', lambda: self.ic.snapshot.prepare() or (), 1)
+
+    def menus(self):
+        ic = self.ic
+        self.run('getNetworks', lambda: ic.getNetworks({}))
+        self.run('getNetworks.period',
+                 lambda: ic.getNetworks({'start': '2000', 'end': '2005'}))
+
+        networks = [key for (key, desc) in ic.getNetworks({})[1:]]
+        network = self.rnd.choice(networks)
+        self.run('getStations', lambda: ic.getStations({}))
+        self.run('getStations.network',
+                 lambda: ic.getStations({'network': network}))
+        self.run('getStreams', lambda: ic.getStreams({}))
+        self.run('getStreams.network',
+                 lambda: ic.getStreams({'network': network}))
+
+    def query(self):
+        ic = self.ic
+        self.run('getQuery.code',
+                 lambda: ic.getQuery({'network': 'all', 'station': 'all',
+                                      'streams': 'BH,HH'}))
+
+        self.run('getQuery.region',
+                 lambda: ic.getQuery({'minlat': '30', 'maxlat': '60',
+                                      'minlon': '-10', 'maxlon': '40'}))
+
+        events = [[self.rnd.uniform(-60.0, 60.0),
+                   self.rnd.uniform(-180.0, 180.0)] for i in xrange(100)]
+        self.run('getQuery.events',
+                 lambda: ic.getQuery({'events': json.dumps(events),
+                                      'minradius': '0', 'maxradius': '10',
+                                      'minazimuth': '0',
+                                      'maxazimuth': '360'}))
+
+    def streams(self, count):
+        """Random streams as lists of [net, sta, cha, loc] codes."""
+        snap = self.ic.snapshot
+        result = []
+        for i in xrange(count):
+            stream = snap.streams[self.rnd.randrange(len(snap.streams))]
+            loc = snap.sensorsLoc[stream.sensorLoc]
+            stat = snap.stations[loc.station]
+            netw = snap.networks[stat.network]
+            result.append([netw.code, stat.code, stream.code, loc.code])
+        return result
+
+    def streamInfo(self, count):
+        ic = self.ic
+        start = datetime.datetime(2010, 1, 1)
+        end = datetime.datetime(2010, 1, 2)
+        streams = self.streams(count)
+
+        def info():
+            return [ic.getStreamInfo(start, end, *nscl) for nscl in streams]
+
+        self.run('getStreamInfo', info)
+
+    def timewindows(self, count):
+        import metadata
+
+        mod = metadata.WI_Module(BenchInterface(self.ic))
+        streams = json.dumps(self.streams(count))
+
+        self.run('timewindows.tw',
+                 lambda: mod.timewindows({}, {
+                     'streams': streams,
+                     'start': '2010-01-01T00:00:00Z',
+                     'end': '2010-01-02T00:00:00Z'}))
+
+        events = json.dumps([[self.rnd.uniform(-60.0, 60.0),
+                              self.rnd.uniform(-180.0, 180.0),
+                              self.rnd.uniform(0.0, 100.0),
+                              '2010-01-01T%02d:00:00Z' % i]
+                             for i in xrange(10)])
+        self.run('timewindows.ev',
+                 lambda: mod.timewindows({}, {
+                     'streams': streams, 'events': events,
+                     'startphase': 'P', 'startoffset': '-1',
+                     'endphase': 'S', 'endoffset': '5'}))
+
+
+def main():
+    desc = 'Benchmark of the InventoryCache with a synthetic inventory'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-s', '--stations', default='small',
+                        help='Number of stations or one of %s.' %
+                        ', '.join(sorted(invgen.SCALES)))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random numbers.')
+    parser.add_argument('--format', choices=('col', 'bin', 'sqlite', 'seg'),
+                        default='col',
+                        help='Format of the cache which is loaded.')
+    parser.add_argument('-d', '--data', default=None,
+                        help='Directory with the cache files to load, '
+                        'instead of a synthetic inventory.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of times every method is called.')
+    parser.add_argument('-n', '--streams', type=int, default=500,
+                        help='Number of streams of getStreamInfo and '
+                        'timewindows.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='File where the results are saved.')
+    args = parser.parse_args()
+
+    stations = invgen.SCALES.get(args.stations)
+    if stations is None and args.data is None:
+        stations = int(args.stations)
+
+    directory = args.data
+    if directory is None:
+        directory = tempfile.mkdtemp()
+        start = time.time()
+        inventory = invgen.generate(stations, args.seed)
+        invgen.save(directory, inventory, pickled=args.format == 'bin',
+                    columnar=args.format == 'col')
+        if args.format == 'sqlite':
+            invsqlite.write(os.path.join(directory,
+                                         'webinterface-cache.sqlite'),
+                            *inventory)
+        if args.format == 'seg':
+            invsegment.write(os.path.join(directory,
+                                          'webinterface-cache.seg'),
+                             *inventory)
+        del inventory
+        sys.stderr.write('Inventory generated in %.1f s\n' %
+                         (time.time() - start))
+
+    try:
+        bench = InvCacheBenchmark(directory, args.repeat, args.seed,
+                                  BACKENDS.get(args.format, 'columnar'))
+        bench.load()
+        bench.menus()
+        bench.query()
+        bench.streamInfo(args.streams)
+        bench.timewindows(args.streams)
+
+    finally:
+        if args.data is None:
+            shutil.rmtree(directory)
+
+    snap = bench.ic.snapshot
+    report = {'date': datetime.datetime.utcnow().isoformat(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'data': args.data,
+              'stations': stations,
+              'seed': args.seed,
+              'format': args.format if args.data is None else
+              os.path.basename(snap.filename),
+              'size': {'networks': len(snap.networks),
+                       'stations': len(snap.stations),
+                       'sensorsLoc': len(snap.sensorsLoc),
+                       'streams': len(snap.streams)},
+              'results': bench.results}
+
+    text = json.dumps(report, indent=4, sort_keys=True)
+    if args.output is None:
+        print text
+    else:
+        with open(args.output, 'w') as fout:
+            fout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
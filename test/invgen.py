@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""Synthetic inventory for the tests and benchmarks of the web interface
+
+Networks, stations, sensor locations and streams are generated from a
+seed, so that the same inventory is obtained in every run. The records
+follow the order and conventions of update-metadata.py: networks sorted by
+code and start, stations by code and start within every network, one
+sensor location per code, streams with the epoch of their station and
+virtual networks at the end. The result is saved as webinterface-cache.bin
+(pickle) and webinterface-cache.col (columnar), exactly as
+update-metadata.py does.
+
+"""
+
+import os
+import sys
+import random
+import datetime
+import argparse
+import pickle
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'wsgi'))
+
+import invformat
+
+
+# Number of stations of the predefined scales
+SCALES = {'small': 1000,
+          'medium': 30000,
+          'large': 200000}
+
+# Band codes with their sampling rates
+BANDS = [('HH', 100.0), ('BH', 20.0), ('LH', 1.0), ('SH', 50.0),
+         ('HN', 100.0), ('EH', 100.0), ('VH', 0.1)]
+
+ARCHIVES = ['GFZ', 'ODC', 'RESIF', 'INGV', 'ETH', 'NIEP', 'KOERI', 'BGR',
+            'LMU', 'NOA']
+
+DATALOGGERS = ['Q330', 'Centaur', 'PEGASUS', 'EDL', 'GURALP DM24']
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ALPHANUM = LETTERS + '0123456789'
+
+
+def epoch(year, day=0):
+    """Seconds since 1970 of a day of a year."""
+    return invformat.toEpoch(datetime.datetime(year, 1, 1) +
+                             datetime.timedelta(days=day))
+
+
+def generate(stations=1000, seed=0, bands=3, virtual=None):
+    """Generate a synthetic inventory.
+
+    Inputs:
+      stations: approximate number of stations (epochs)
+      seed: seed of the random numbers
+      bands: maximum number of band codes (with three components) of every
+             sensor location
+      virtual: number of virtual networks, by default one for every 5000
+               stations
+
+    Returns a tuple (networks, stations, sensorsLoc, streams) with lists of
+    records, as saved by update-metadata.py.
+
+    """
+
+    rnd = random.Random(seed)
+    thisYear = datetime.date.today().year
+
+    if virtual is None:
+        virtual = stations // 5000 + 1
+
+    # Networks as (sort key, code, start, end, temporary)
+    netDefs = []
+    permCodes = set()
+    total = 0
+    while total < stations:
+        size = min(rnd.randint(5, 120), stations - total)
+        total += size
+
+        if rnd.random() < 0.7:
+            # Permanent network with a code starting with a letter
+            while True:
+                code = rnd.choice(LETTERS[:23]) + rnd.choice(ALPHANUM)
+                if code not in permCodes:
+                    break
+            permCodes.add(code)
+            start = rnd.randint(1980, 2012)
+            netDefs.append(((code, start), code, start, None, False, size))
+        else:
+            # Temporary networks share codes in different years
+            code = rnd.choice('0123456789XYZ') + rnd.choice(ALPHANUM)
+            start = rnd.randint(1990, thisYear - 1)
+            end = min(start + rnd.randint(1, 4), thisYear + 1)
+            netDefs.append(((code, start), code, start, end, True, size))
+
+    netDefs.sort()
+
+    ptNets = []
+    ptStats = []
+    ptLocs = []
+    ptChans = []
+
+    for (key, code, netStart, netEnd, temporary, size) in netDefs:
+        netidx = len(ptNets)
+        restricted = 1 if temporary and rnd.random() < 0.5 else 2
+        ptNets.append(invformat.Network(
+            code, len(ptStats), None, None, netStart, netEnd,
+            'Synthetic network %s' % code, restricted,
+            't' if temporary else 'p', rnd.choice(ARCHIVES), ''))
+
+        # Stations around the centre of the network
+        lat0 = rnd.uniform(-60.0, 75.0)
+        lon0 = rnd.uniform(-180.0, 180.0)
+
+        # Station codes with one or two epochs
+        epochs = []
+        for s in xrange(size):
+            staCode = '%s%03d' % (code[0], s)
+            first = epoch(netStart, rnd.randint(0, 300))
+            last = epoch(netEnd, -1) if netEnd is not None else None
+            if rnd.random() < 0.2 and (last is None or
+                                       last - first > 2 * 86400):
+                middle = rnd.randint(first + 86400,
+                                     (last or epoch(thisYear)) - 86400)
+                epochs.append((staCode, first, middle))
+                epochs.append((staCode, middle, last))
+            else:
+                epochs.append((staCode, first, last))
+
+        # Two epochs of one code count as two stations
+        for (staCode, start, end) in sorted(epochs[:size]):
+            lat = max(-90.0, min(90.0, lat0 + rnd.uniform(-5.0, 5.0)))
+            lon = (lon0 + rnd.uniform(-5.0, 5.0) + 180.0) % 360.0 - 180.0
+            staidx = len(ptStats)
+            stat = invformat.Station(
+                netidx, len(ptLocs), None, staCode, round(lat, 4),
+                round(lon, 4), 'Synthetic station %s' % staCode, start, end,
+                float(rnd.randint(0, 3000)), restricted)
+            ptStats.append(stat)
+
+            locCodes = ['']
+            if rnd.random() < 0.2:
+                locCodes.append(rnd.choice(['00', '10']))
+
+            for locCode in locCodes:
+                locidx = len(ptLocs)
+                ptLocs.append(invformat.SensorLocation(staidx, len(ptChans),
+                                                       None, locCode))
+
+                datalogger = rnd.choice(DATALOGGERS)
+                chosen = rnd.sample(BANDS, rnd.randint(1, bands))
+                for (band, sps) in sorted(chosen):
+                    for comp in 'ENZ':
+                        ptChans.append(invformat.Stream(
+                            locidx, band + comp, None, sps, 1, datalogger,
+                            start, end, restricted))
+
+                ptLocs[-1].last = len(ptChans)
+
+            stat.last = len(ptLocs)
+
+        ptNets[netidx].last = len(ptStats)
+
+    # Virtual networks are added at the end, with a set of stations
+    for v in xrange(virtual):
+        children = set(rnd.sample(xrange(len(ptStats)),
+                                  min(len(ptStats), rnd.randint(10, 200))))
+        ptNets.append(invformat.Network(
+            '_V%d' % v, None, None, sorted(children), 0, None,
+            '_V%d virtual network' % v, False, 'p', '', ''))
+
+    return (ptNets, ptStats, ptLocs, ptChans)
+
+
+def streamIndex(networks, stations, sensorsLoc, streams):
+    """Streams by (network, station, channel, location) codes, as saved in
+    the pickled cache.
+
+    """
+
+    streamidx = {}
+    for stream in streams:
+        sensorLoc = sensorsLoc[stream.sensorLoc]
+        station = stations[sensorLoc.station]
+        network = networks[station.network]
+        key = (network.code, station.code, stream.code, sensorLoc.code)
+        streamidx.setdefault(key, []).append(stream)
+    return streamidx
+
+
+def save(directory, inventory, pickled=True, columnar=True):
+    """Save an inventory with the files and names of update-metadata.py."""
+    if pickled:
+        cachefile = os.path.join(directory, 'webinterface-cache.bin')
+        with open(cachefile, 'wb') as cache:
+            pickle.dump(tuple(list(table) for table in inventory) +
+                        (streamIndex(*inventory),), cache)
+
+    if columnar:
+        invformat.write(os.path.join(directory, 'webinterface-cache.col'),
+                        *inventory)
+
+
+def main():
+    desc = 'Generate a synthetic inventory for the web interface'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-s', '--stations', default='small',
+                        help='Number of stations or one of %s.' %
+                        ', '.join(sorted(SCALES)))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random numbers.')
+    parser.add_argument('--bands', type=int, default=3,
+                        help='Maximum number of band codes per location.')
+    parser.add_argument('--no-pickle', action='store_true',
+                        help='Do not save the pickled version of the cache.')
+    parser.add_argument('-o', '--output', default='.',
+                        help='Directory where the cache files are saved.')
+    args = parser.parse_args()
+
+    stations = SCALES.get(args.stations)
+    if stations is None:
+        stations = int(args.stations)
+
+    inventory = generate(stations, args.seed, args.bands)
+    save(args.output, inventory, pickled=not args.no_pickle)
+
+    print '%d networks, %d stations, %d locations, %d streams' % \
+        tuple(len(table) for table in inventory)
+
+
+if __name__ == '__main__':
+    main()
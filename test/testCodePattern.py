@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the patterns of stream codes.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import fnmatch
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import codepattern
+
+
+class CodePatternTests(unittest.TestCase):
+    """Test the functionality of codepattern.py
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.codes = ['APE', 'APEZ', 'BKB', 'GE', 'GEX', 'IU', 'KMBO', 'MATE',
+                      'XA', 'APE', 'GE', '']
+        self.table = codepattern.CodeTable(self.codes)
+
+    def testMatch(self):
+        "wildcards and lists of codes"
+        cases = [('APE', 'APE', True), ('APE', 'APEZ', False),
+                 ('AP?', 'APE', True), ('AP?', 'AP', False),
+                 ('A*', 'A', True), ('*E', 'MATE', True),
+                 ('*', '', True), ('--', '', True), ('--', '00', False),
+                 ('GE,IU', 'IU', True), ('GE, I*', 'IX', True),
+                 ('B?B,K*', 'KMBO', True), ('B?B,K*', 'BKX', False)]
+        for (text, code, expected) in cases:
+            self.assertEqual(codepattern.CodePattern(text).match(code),
+                             expected, 'Wrong match of %s with %s' %
+                             (code, text))
+
+        self.assertRaises(ValueError, codepattern.CodePattern, 'A.B')
+        self.assertRaises(ValueError, codepattern.NSLCPattern, 'A.B.C.D.E')
+
+    def testSelect(self):
+        "rows selected with the sorted codes"
+        for text in ('APE', 'AP*', '*E', '?E*', 'G*,K*', '*', 'X', '--',
+                     '*A*'):
+            pattern = codepattern.CodePattern(text)
+            expected = [i for (i, code) in enumerate(self.codes)
+                        if any(fnmatch.fnmatchcase(code, '' if p == '--'
+                                                   else p)
+                               for p in text.split(','))]
+            self.assertEqual(pattern.select(self.table), expected,
+                             'Wrong rows selected with %s' % text)
+
+    def testNSLC(self):
+        "patterns of the four codes"
+        nslc = codepattern.NSLCPattern('G*.*.00.BH?')
+        self.assertTrue(nslc.network.match('GE'))
+        self.assertTrue(nslc.station.match('APE'))
+        self.assertTrue(nslc.matchStream('00.BHZ'))
+        self.assertFalse(nslc.matchStream('.BHZ'))
+        self.assertFalse(nslc.matchStream('00.HHZ'))
+
+        nslc = codepattern.NSLCPattern('GE.APE')
+        self.assertTrue(nslc.matchStream('.HHZ'), 'Missing codes not any')
+        self.assertTrue(codepattern.isPattern('BH?'))
+        self.assertTrue(codepattern.isPattern('GE,IU'))
+        self.assertFalse(codepattern.isPattern('--'))
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testCodePattern [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
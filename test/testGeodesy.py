@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the distance and azimuth calculations.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import geodesy
+
+
+class GeodesyTests(unittest.TestCase):
+    """Test the functionality of geodesy.py
+
+    """
+
+    def testKnownValues(self):
+        "distances and azimuths between known points"
+        (dist, azi, baz) = geodesy.delazi([0.0, 90.0], [0.0, 0.0],
+                                          [0.0, 0.0, 0.0], [90.0, 180.0, 0.0])
+        expected = [[90.0, 180.0, 0.0], [90.0, 90.0, 90.0]]
+        for i in range(2):
+            for j in range(3):
+                self.assertAlmostEqual(dist[i][j], expected[i][j], 6,
+                                       'Wrong distance (%d, %d)' % (i, j))
+
+        self.assertAlmostEqual(azi[0][0], 90.0, 6, 'Wrong azimuth')
+        self.assertAlmostEqual(baz[0][0], 270.0, 6, 'Wrong backazimuth')
+        self.assertAlmostEqual(azi[1][2], 180.0, 6, 'Wrong azimuth')
+
+    def testSymmetry(self):
+        "azimuth and backazimuth are swapped with the points"
+        lats = [52.38, -33.9, 35.7]
+        lons = [13.06, 18.4, 139.7]
+        (dist, azi, baz) = geodesy.delazi(lats, lons, lats, lons)
+        for i in range(3):
+            self.assertAlmostEqual(dist[i][i], 0.0, 6, 'Distance is not zero')
+            for j in range(3):
+                self.assertAlmostEqual(dist[i][j], dist[j][i], 6,
+                                       'Distance is not symmetric')
+                if i != j:
+                    self.assertAlmostEqual(azi[i][j], baz[j][i], 6,
+                                           'Azimuths do not match')
+
+    def testPurePython(self):
+        "same results with and without NumPy"
+        lats = [0.0, 45.0, -80.0]
+        lons = [0.0, -170.0, 60.0]
+        numpyResult = geodesy.delazi(lats, lons, lons, lats)
+        pyResult = geodesy._delaziPython(lats, lons, lons, lats)
+        for k in range(3):
+            for i in range(3):
+                for j in range(3):
+                    self.assertAlmostEqual(numpyResult[k][i][j],
+                                           pyResult[k][i][j], 6,
+                                           'Results are different')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testGeodesy [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
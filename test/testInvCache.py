@@ -18,6 +18,17 @@ sys.path.append(os.path.join('..', 'wsgi'))  # for wsgicomm
 sys.path.append(os.path.join('..', 'wsgi', 'modules'))
 
 import inventorycache
+import invformat
+
+
+def year(epoch):
+    "Year of an epoch in seconds since 1970"
+    return invformat.fromEpoch(epoch).year
+
+
+def now():
+    "Current time in seconds since 1970"
+    return invformat.toEpoch(datetime.datetime.utcnow())
 
 
 class InvCacheTests(unittest.TestCase):
@@ -107,58 +118,58 @@ class InvCacheTests(unittest.TestCase):
 
     def testNetworksType(self):
         "type of networks attribute"
-        self.assertEqual(type(self.__class__.ic.networks), type([]), 'Attribute networks is not a list.')
+        self.assertTrue(isinstance(self.__class__.ic.networks, invformat.Table), 'Attribute networks is not a columnar table.')
 
 
     def testNetworksCols(self):
         "number of columns of networks"
         if hasattr(self.__class__.ic, 'networks'):
             for idx, netw in enumerate(self.__class__.ic.networks):
-                self.assertEqual(len(netw), 11, 'An instance of networks does not have 11 columns. (Index: %d)' % idx)
+                self.assertTrue(isinstance(netw, invformat.Network), 'An instance of networks is not a Network record. (Index: %d)' % idx)
 
 
     def testNetworksCol1(self):
         "type of columns in every network"
         if hasattr(self.__class__.ic, 'networks'):
             for idx, netw in enumerate(self.__class__.ic.networks):
-                self.assertEqual(type(netw[0]), type(''), 'First column of networks is not a string. (Index: %d)' % idx)
+                self.assertEqual(type(netw.code), type(''), 'First column of networks is not a string. (Index: %d)' % idx)
 
-                if netw[1] is not None:
-                    self.assertEqual(type(netw[1]), type(1), 'Second column of networks is not an integer. (Index: %d)' % idx)
+                if netw.first is not None:
+                    self.assertEqual(type(netw.first), type(1), 'Second column of networks is not an integer. (Index: %d)' % idx)
 
-                if netw[2] is not None:
-                    self.assertEqual(type(netw[2]), type(1), 'Third column of networks is not an integer. (Index: %d)' % idx)
+                if netw.last is not None:
+                    self.assertEqual(type(netw.last), type(1), 'Third column of networks is not an integer. (Index: %d)' % idx)
 
-                if netw[3] is not None:
-                    self.assertEqual(type(netw[3]), type([]), 'Fourth column of networks is not a list. (Index: %d)' % idx)
-                    self.assertEqual(type(netw[1]), type(None), 'Second column should be "None" in a virtual network. (Index: %d)' % idx)
-                    self.assertEqual(type(netw[2]), type(None), 'Third column should be "None" in a virtual network. (Index: %d)' % idx)
+                if netw.children is not None:
+                    self.assertEqual(type(netw.children), type([]), 'Fourth column of networks is not a list. (Index: %d)' % idx)
+                    self.assertEqual(type(netw.first), type(None), 'Second column should be "None" in a virtual network. (Index: %d)' % idx)
+                    self.assertEqual(type(netw.last), type(None), 'Third column should be "None" in a virtual network. (Index: %d)' % idx)
                     # Check the stations in the virtual network
-                    for statidx, stat in enumerate(netw[3]):
+                    for statidx, stat in enumerate(netw.children):
                         self.assertEqual(type(stat), type(1), 'Pointer to station (Idx: %d) in virtual network (Idx: %d) is not an integer.' % (statidx, idx) )
                 else:
-                    self.assertNotEqual(type(netw[1]), type(None), 'Second column cannot be "None" in a non-virtual network. (Index: %d)' % idx)
-                    self.assertNotEqual(type(netw[2]), type(None), 'Third column cannot be "None" in a non-virtual network. (Index: %d)' % idx)
+                    self.assertNotEqual(type(netw.first), type(None), 'Second column cannot be "None" in a non-virtual network. (Index: %d)' % idx)
+                    self.assertNotEqual(type(netw.last), type(None), 'Third column cannot be "None" in a non-virtual network. (Index: %d)' % idx)
 
-                self.assertEqual(type(netw[1]), type(netw[2]), 'Second and third columns of networks should be of the same type. (Index: %d)' % idx)
+                self.assertEqual(type(netw.first), type(netw.last), 'Second and third columns of networks should be of the same type. (Index: %d)' % idx)
 
-                self.assertEqual(type(netw[4]), type(1), 'Fifth column of networks is not an integer. (Index: %d)' % idx)
+                self.assertEqual(type(netw.start), type(1), 'Fifth column of networks is not an integer. (Index: %d)' % idx)
 
-                if netw[5] is not None:
-                    self.assertEqual(type(netw[5]), type(1), 'Sixth column of networks is not an integer. (Index: %d)' % idx)
+                if netw.end is not None:
+                    self.assertEqual(type(netw.end), type(1), 'Sixth column of networks is not an integer. (Index: %d)' % idx)
 
-                self.assertEqual(type(netw[6]), type(''), 'Seventh column of networks is not a string. (Index: %d)' % idx)
+                self.assertEqual(type(netw.description), type(''), 'Seventh column of networks is not a string. (Index: %d)' % idx)
 
-                if netw[7] is not None:
-                    self.assertEqual(type(netw[7]), type(1), 'Eight column of networks is not an integer. (Index: %d)' % idx)
+                if netw.restricted is not None:
+                    self.assertEqual(type(netw.restricted), type(1), 'Eight column of networks is not an integer. (Index: %d)' % idx)
 
-                if netw[8] is not None:
-                    self.assertEqual(type(netw[8]), type(''), 'Ninth column of networks is not a string. (Index: %d)' % idx)
+                if netw.netclass is not None:
+                    self.assertEqual(type(netw.netclass), type(''), 'Ninth column of networks is not a string. (Index: %d)' % idx)
 
-                self.assertEqual(type(netw[9]), type(''), 'Tenth column of networks is not a string. (Index: %d)' % idx)
+                self.assertEqual(type(netw.archive), type(''), 'Tenth column of networks is not a string. (Index: %d)' % idx)
 
-                if netw[10] is not None:
-                    self.assertEqual(type(netw[10]), type(''), 'Eleventh column of networks is not a string. (Index: %d)' % idx)
+                if netw.institutions is not None:
+                    self.assertEqual(type(netw.institutions), type(''), 'Eleventh column of networks is not a string. (Index: %d)' % idx)
 
 
 
@@ -168,10 +179,10 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'networks'):
             for netw in self.__class__.ic.networks:
-                if netw[3] is None:
-                    if (netw[1] >= netw[2]) or (netw[1] >= len(self.__class__.ic.stations)) \
-                       or (netw[2] > len(self.__class__.ic.stations)):
-                        errors.add(netw[9] + '.' + netw[0])
+                if netw.children is None:
+                    if (netw.first >= netw.last) or (netw.first >= len(self.__class__.ic.stations)) \
+                       or (netw.last > len(self.__class__.ic.stations)):
+                        errors.add(netw.archive + '.' + netw.code)
         self.assertTrue( len(errors) == 0, 'Wrong values in pointers to stations. Code(s): %s' % sorted(list(errors)))
 
 
@@ -181,8 +192,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'networks'):
             for netw in self.__class__.ic.networks:
-                if (netw[4] < 1980) or (netw[4] > datetime.datetime.now().year):
-                    errors.add(netw[9] + '.' + netw[0])
+                if (netw.start < 1980) or (netw.start > datetime.datetime.now().year):
+                    errors.add(netw.archive + '.' + netw.code)
         self.assertTrue( len(errors) == 0, 'Start years with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -192,9 +203,9 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'networks'):
             for netw in self.__class__.ic.networks:
-                if (netw[5] is not None) and ((netw[5] < 1980) or \
-                    (netw[4] > netw[5])):
-                    errors.add(netw[9] + '.' + netw[0])
+                if (netw.end is not None) and ((netw.end < 1980) or \
+                    (netw.start > netw.end)):
+                    errors.add(netw.archive + '.' + netw.code)
         self.assertTrue( len(errors) == 0, 'End years with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -204,8 +215,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'networks'):
             for netw in self.__class__.ic.networks:
-                if not (netw[7] in [1, 2]):
-                    errors.add(netw[9] + '.' + netw[0])
+                if not (netw.restricted in [1, 2]):
+                    errors.add(netw.archive + '.' + netw.code)
         self.assertTrue( len(errors) == 0, 'Restricted attribute without information. Code(s): %s' % sorted(list(errors)))
 
 
@@ -215,8 +226,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'networks'):
             for netw in self.__class__.ic.networks:
-                if not (netw[8] in ['p', 't']):
-                    errors.add(netw[9] + '.' + netw[0])
+                if not (netw.netclass in ['p', 't']):
+                    errors.add(netw.archive + '.' + netw.code)
         self.assertTrue( len(errors) == 0, 'Netclass attribute without information. Code(s): %s' % sorted(list(errors)))
 
 
@@ -226,8 +237,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'networks'):
             for netw in self.__class__.ic.networks:
-                if(netw[9] is None) or (len(netw[9]) == 0):
-                    errors.add(netw[0])
+                if(netw.archive is None) or (len(netw.archive) == 0):
+                    errors.add(netw.code)
         self.assertTrue( len(errors) == 0, 'Archive attribute without information. Code(s): %s' % sorted(list(errors)))
 
 
@@ -250,14 +261,14 @@ class InvCacheTests(unittest.TestCase):
 
         if hasattr(self.__class__.ic, 'senstypes'):
             for sens in self.__class__.ic.senstypes:
-                self.assertEqual(type(sens[0]), type(''), 'First column of senstype is not a string.')
-                self.assertEqual(type(sens[1]), type(''), 'Second column of senstype is not a string.')
+                self.assertEqual(type(sens.station), type(''), 'First column of senstype is not a string.')
+                self.assertEqual(type(sens.first), type(''), 'Second column of senstype is not a string.')
 
 
     def testStationsType(self):
         "type of stations attribute"
 
-        self.assertEqual(type(self.__class__.ic.stations), type([]), 'Attribute stations is not a list.')
+        self.assertTrue(isinstance(self.__class__.ic.stations, invformat.Table), 'Attribute stations is not a columnar table.')
 
 
     def testStationsCols(self):
@@ -265,7 +276,7 @@ class InvCacheTests(unittest.TestCase):
 
         if hasattr(self.__class__.ic, 'stations'):
             for stat in self.__class__.ic.stations:
-                self.assertEqual(len(stat), 12, 'An instance of stations does not have 12 columns.')
+                self.assertTrue(isinstance(stat, invformat.Station), 'An instance of stations is not a Station record.')
 
 
     def testStationsCol1(self):
@@ -273,21 +284,20 @@ class InvCacheTests(unittest.TestCase):
 
         if hasattr(self.__class__.ic, 'stations'):
             for idx, stat in enumerate(self.__class__.ic.stations):
-                self.assertEqual(type(stat[0]), type(1), 'First column of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[1]), type(1), 'Second column of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[2]), type(1), 'Third column of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[3]), type(None), 'Fourth column of stations should be an unused, reserved column. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[4]), type(''), 'Fifth column of stations is not a string. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[5]), type(1.1), 'Sixth column of stations is not a float. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[6]), type(1.1), 'Seventh column of stations is not a float. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[7]), type(''), 'Eighth column of stations is not a string. (Index: %d; Code: %s)' % (idx, stat[4]))
-                self.assertEqual(type(stat[8]), type(datetime.datetime.now()), 'Ninth column of stations is not a datetime. (Index: %d; Code: %s)' % (idx, stat[4]))
+                self.assertEqual(type(stat.network), type(1), 'First column of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertEqual(type(stat.first), type(1), 'Second column of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertEqual(type(stat.last), type(1), 'Third column of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertEqual(type(stat.code), type(''), 'Fifth column of stations is not a string. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertEqual(type(stat.latitude), type(1.1), 'Sixth column of stations is not a float. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertEqual(type(stat.longitude), type(1.1), 'Seventh column of stations is not a float. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertEqual(type(stat.description), type(''), 'Eighth column of stations is not a string. (Index: %d; Code: %s)' % (idx, stat.code))
+                self.assertTrue(isinstance(stat.start, (int, long)), 'Start of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat.code))
 
-                if stat[9] is not None:
-                    self.assertEqual( type(stat[9]), type(datetime.datetime.now()), 'Tenth column of stations has is not a datetime. (Index: %d; Code: %s)' % (idx, stat[4]))
+                if stat.end is not None:
+                    self.assertTrue(isinstance(stat.end, (int, long)), 'End of stations is not an integer. (Index: %d; Code: %s)' % (idx, stat.code))
 
-                if stat[10] is not None:
-                    self.assertEqual(type(stat[10]), type(1.1), 'Eleventh column of stations is not a float. (Index: %d; Code: %s)' % (idx, stat[4]))
+                if stat.elevation is not None:
+                    self.assertEqual(type(stat.elevation), type(1.1), 'Eleventh column of stations is not a float. (Index: %d; Code: %s)' % (idx, stat.code))
 
 
     def testStationPointerToNetwork(self):
@@ -296,8 +306,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations'):
             for idx, stat in enumerate(self.__class__.ic.stations):
-                if (stat[0] >= len(self.__class__.ic.networks)):
-                    errors.add('%d/%s' % (idx, stat[4]))
+                if (stat.network >= len(self.__class__.ic.networks)):
+                    errors.add('%d/%s' % (idx, stat.code))
         # Check there are no errors
         self.assertTrue( len(errors) == 0, 'Wrong pointer to parent network. Code(s): %s' % sorted(list(errors)))
 
@@ -308,10 +318,10 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations'):
             for stat in self.__class__.ic.stations:
-                if (stat[1] >= stat[2]) or (stat[1] >= len(self.__class__.ic.sensorsLoc)) \
-                   or (stat[2] > len(self.__class__.ic.sensorsLoc)):
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
+                if (stat.first >= stat.last) or (stat.first >= len(self.__class__.ic.sensorsLoc)) \
+                   or (stat.last > len(self.__class__.ic.sensorsLoc)):
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
         # Check there are no errors
         self.assertTrue( len(errors) == 0, 'Wrong values in pointers to sensors. Code(s): %s' % sorted(list(errors)))
 
@@ -322,9 +332,9 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations'):
             for stat in self.__class__.ic.stations:
-                if (stat[5] < -90.0) or (stat[5] > 90.0):
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
+                if (stat.latitude < -90.0) or (stat.latitude > 90.0):
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
         self.assertTrue( len(errors) == 0, 'Latitude with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -334,9 +344,9 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations'):
             for stat in self.__class__.ic.stations:
-                if (stat[6] < -180.0) or (stat[6] > 180.0):
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
+                if (stat.longitude < -180.0) or (stat.longitude > 180.0):
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
         self.assertTrue( len(errors) == 0, 'Longitude with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -346,9 +356,9 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations'):
             for stat in self.__class__.ic.stations:
-                if (stat[8].year < 1980) or (stat[8] > datetime.datetime.now()):
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
+                if (year(stat.start) < 1980) or (stat.start > now()):
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
         self.assertTrue( len(errors) == 0, 'Start dates with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -358,10 +368,10 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations'):
             for stat in self.__class__.ic.stations:
-                if (stat[9] is not None) and ((stat[9].year < 1980) or \
-                    (stat[8] >= stat[9])):
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
+                if (stat.end is not None) and ((year(stat.end) < 1980) or \
+                    (stat.start >= stat.end)):
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
         self.assertTrue( len(errors) == 0, 'End dates with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -371,37 +381,36 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'stations') and hasattr(self.__class__.ic, 'networks'):
             for stat in self.__class__.ic.stations:
-                netw = self.__class__.ic.networks[stat[0]]
-                if (stat[8].year < netw[4]) or ((netw[5] is not None) and (stat[8].year > netw[5])):
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
-                if netw[5] is not None:
-                    if (stat[9] is None) or (stat[9].year > netw[5]):
-                        errors.add(netw[9] + '.' + netw[0] + '.' + stat[4])
+                netw = self.__class__.ic.networks[stat.network]
+                if (year(stat.start) < netw.start) or ((netw.end is not None) and (year(stat.start) > netw.end)):
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
+                if netw.end is not None:
+                    if (stat.end is None) or (year(stat.end) > netw.end):
+                        errors.add(netw.archive + '.' + netw.code + '.' + stat.code)
         self.assertTrue( len(errors) == 0, 'Station operational timespan is not coherent with the network. Code(s): %s' % sorted(list(errors)))
 
 
 
     def testSensorsType(self):
         "type of sensorsLoc attribute"
-        self.assertEqual(type(self.__class__.ic.sensorsLoc), type([]), 'Attribute sensorsLoc is not a list.')
+        self.assertTrue(isinstance(self.__class__.ic.sensorsLoc, invformat.Table), 'Attribute sensorsLoc is not a columnar table.')
 
 
     def testSensorsCols(self):
         "number of columns in every sensor"
         if hasattr(self.__class__.ic, 'sensorsLoc'):
             for sens in self.__class__.ic.sensorsLoc:
-                self.assertEqual(len(sens), 5, 'An instance of sensorsLoc does not have 5 columns.')
+                self.assertTrue(isinstance(sens, invformat.SensorLocation), 'An instance of sensorsLoc is not a SensorLocation record.')
 
 
     def testSensorsLocCol1(self):
         "type of columns in every sensor"
         if hasattr(self.__class__.ic, 'sensorsLoc'):
             for idx, sens in enumerate(self.__class__.ic.sensorsLoc):
-                self.assertEqual(type(sens[0]), type(1), 'First column of sensors is not an integer. (Index: %d)' % idx)
-                self.assertEqual(type(sens[1]), type(1), 'Second column of sensors is not an integer. (Index: %d)' % idx)
-                self.assertEqual(type(sens[2]), type(1), 'Third column of sensors is not an integer. (Index: %d)' % idx)
-                self.assertEqual(type(sens[3]), type(None), 'Fourth column of sensors should be an unused, reserved column. (Index: %d)' % idx)
-                self.assertEqual(type(sens[4]), type(''), 'Fifth column of sensors is not a string. (Index: %d)' % idx)
+                self.assertEqual(type(sens.station), type(1), 'First column of sensors is not an integer. (Index: %d)' % idx)
+                self.assertEqual(type(sens.first), type(1), 'Second column of sensors is not an integer. (Index: %d)' % idx)
+                self.assertEqual(type(sens.last), type(1), 'Third column of sensors is not an integer. (Index: %d)' % idx)
+                self.assertEqual(type(sens.code), type(''), 'Fifth column of sensors is not a string. (Index: %d)' % idx)
 
 
     def testSensorPointerToStation(self):
@@ -410,8 +419,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'sensorsLoc'):
             for idx, sens in enumerate(self.__class__.ic.sensorsLoc):
-                if (sens[0] >= len(self.__class__.ic.stations)):
-                    errors.add('%d/%s' % (idx, sens[4]))
+                if (sens.station >= len(self.__class__.ic.stations)):
+                    errors.add('%d/%s' % (idx, sens.code))
         # Check there are no errors
         self.assertTrue( len(errors) == 0, 'Wrong pointer to parent station. Index(es)/Code(s): %s' % sorted(list(errors)))
 
@@ -422,11 +431,11 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'sensorsLoc'):
             for sens in self.__class__.ic.sensorsLoc:
-                if (sens[1] >= sens[2]) or (sens[1] >= len(self.__class__.ic.streams)) \
-                   or (sens[2] > len(self.__class__.ic.streams)):
-                        stat = self.__class__.ic.stations[sens[0]]
-                        netw = self.__class__.ic.networks[stat[0]]
-                        errors.add(netw[9] + '.' + netw[0] + '.' + stat[4] + '.' + sens[4])
+                if (sens.first >= sens.last) or (sens.first >= len(self.__class__.ic.streams)) \
+                   or (sens.last > len(self.__class__.ic.streams)):
+                        stat = self.__class__.ic.stations[sens.station]
+                        netw = self.__class__.ic.networks[stat.network]
+                        errors.add(netw.archive + '.' + netw.code + '.' + stat.code + '.' + sens.code)
         # Check there are no errors
         self.assertTrue( len(errors) == 0, 'Wrong values in pointers to streams. Code(s): %s' % sorted(list(errors)))
 
@@ -435,40 +444,40 @@ class InvCacheTests(unittest.TestCase):
 
     def testStreamsType(self):
         "type of streams attribute"
-        self.assertEqual(type(self.__class__.ic.streams), type([]), 'Attribute streams is not a list.')
+        self.assertTrue(isinstance(self.__class__.ic.streams, invformat.Table), 'Attribute streams is not a columnar table.')
 
 
     def testStreamsCols(self):
         "number of columns in every stream"
         if hasattr(self.__class__.ic, 'streams'):
             for stre in self.__class__.ic.streams:
-                self.assertEqual(len(stre), 9, 'An instance of streams does not have 9 columns.')
+                self.assertTrue(isinstance(stre, invformat.Stream), 'An instance of streams is not a Stream record.')
 
 
     def testStreamsCol1(self):
         "type of columns in every stream"
         if hasattr(self.__class__.ic, 'streams'):
             for idx, stre in enumerate(self.__class__.ic.streams):
-                self.assertEqual(type(stre[0]), type(1), 'First column of stream is not an integer. (Index: %d)' % idx)
-                self.assertEqual(type(stre[1]), type(''), 'Second column of stream is not a string. (Index: %d)' % idx)
+                self.assertEqual(type(stre.sensorLoc), type(1), 'First column of stream is not an integer. (Index: %d)' % idx)
+                self.assertEqual(type(stre.code), type(''), 'Second column of stream is not a string. (Index: %d)' % idx)
 
-                if stre[2] is not None:
-                    self.assertEqual( type(stre[2]), type(''), 'Third column of stream is not a string. (Index: %d)' % idx)
+                if stre.sensortype is not None:
+                    self.assertEqual( type(stre.sensortype), type(''), 'Third column of stream is not a string. (Index: %d)' % idx)
 
-                if stre[3] is not None:
-                    self.assertEqual( type(stre[3]), type(1.1), 'Fourth column of stream is not a float. (Index: %d)' % idx)
-                    self.assertNotEqual( stre[3], 0.0, 'Sample Rate is undefined because denominator=0. (Index: %d)' % idx)
+                if stre.denominator is not None:
+                    self.assertEqual( type(stre.denominator), type(1.1), 'Fourth column of stream is not a float. (Index: %d)' % idx)
+                    self.assertNotEqual( stre.denominator, 0.0, 'Sample Rate is undefined because denominator=0. (Index: %d)' % idx)
 
-                if stre[4] is not None:
-                    self.assertEqual( type(stre[4]), type(1.1), 'Fifth column of stream is not a float. (Index: %d)' % idx)
+                if stre.numerator is not None:
+                    self.assertEqual( type(stre.numerator), type(1.1), 'Fifth column of stream is not a float. (Index: %d)' % idx)
 
-                if stre[5] is not None:
-                    self.assertEqual( type(stre[5]), type(''), 'Sixth column of stream is not a string. (Index: %d)' % idx)
+                if stre.datalogger is not None:
+                    self.assertEqual( type(stre.datalogger), type(''), 'Sixth column of stream is not a string. (Index: %d)' % idx)
 
-                self.assertEqual(type(stre[6]), type(datetime.datetime.now()), 'Seventh column of stream is not a datetime. (Index: %d)' % idx)
+                self.assertTrue(isinstance(stre.start, (int, long)), 'Start of stream is not an integer. (Index: %d)' % idx)
 
-                if stre[7] is not None:
-                    self.assertEqual(type(stre[7]), type(datetime.datetime.now()), 'Eighth column of stream is not a datetime. (Index: %d)' % idx)
+                if stre.end is not None:
+                    self.assertTrue(isinstance(stre.end, (int, long)), 'End of stream is not an integer. (Index: %d)' % idx)
 
 
     def testStreamPointerToSensor(self):
@@ -477,8 +486,8 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'streams'):
             for idx, stre in enumerate(self.__class__.ic.streams):
-                if (stre[0] >= len(self.__class__.ic.sensorsLoc)):
-                    errors.add('%d/%s' % (idx, stre[4]))
+                if (stre.sensorLoc >= len(self.__class__.ic.sensorsLoc)):
+                    errors.add('%d/%s' % (idx, stre.numerator))
         # Check there are no errors
         self.assertTrue( len(errors) == 0, 'Wrong pointer to parent sensor. Index(es)/Code(s): %s' % sorted(list(errors)))
 
@@ -489,11 +498,11 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'streams'):
             for stre in self.__class__.ic.streams:
-                if (stre[6].year < 1980) or (stre[6] > datetime.datetime.now()):
-                    sens = self.__class__.ic.sensorsLoc[stre[0]]
-                    stat = self.__class__.ic.stations[sens[0]]
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4] + '.' + sens[4] + '.' + stre[1] + '(' + str(stre[6].year) + ')')
+                if (year(stre.start) < 1980) or (stre.start > now()):
+                    sens = self.__class__.ic.sensorsLoc[stre.sensorLoc]
+                    stat = self.__class__.ic.stations[sens.station]
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code + '.' + sens.code + '.' + stre.code + '(' + str(year(stre.start)) + ')')
         self.assertTrue( len(errors) == 0, 'Start dates with anomalous values. Code(s): %s' % sorted(list(errors)))
 
 
@@ -503,12 +512,12 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'streams'):
             for stre in self.__class__.ic.streams:
-                if (stre[7] is not None) and ((stre[7].year < 1980) or \
-                    (stre[6] >= stre[7])):
-                    sens = self.__class__.ic.sensorsLoc[stre[0]]
-                    stat = self.__class__.ic.stations[sens[0]]
-                    netw = self.__class__.ic.networks[stat[0]]
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4] + '.' + sens[4] + '.' + stre[1] + '(' + str(stre[6].year) + ')')
+                if (stre.end is not None) and ((year(stre.end) < 1980) or \
+                    (stre.start >= stre.end)):
+                    sens = self.__class__.ic.sensorsLoc[stre.sensorLoc]
+                    stat = self.__class__.ic.stations[sens.station]
+                    netw = self.__class__.ic.networks[stat.network]
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code + '.' + sens.code + '.' + stre.code + '(' + str(year(stre.start)) + ')')
         self.assertTrue( len(errors) == 0, 'End dates with anomalous values. Code(s): %s' % sorted(list(errors)))
 
     def testStreamDatesInStat(self):
@@ -517,18 +526,45 @@ class InvCacheTests(unittest.TestCase):
         errors = set()
         if hasattr(self.__class__.ic, 'streams') and hasattr(self.__class__.ic, 'sensorsLoc') and hasattr(self.__class__.ic, 'stations'):
             for stre in self.__class__.ic.streams:
-                sens = self.__class__.ic.sensorsLoc[stre[0]]
-                stat = self.__class__.ic.stations[sens[0]]
-                netw = self.__class__.ic.networks[stat[0]]
-                if (stre[6] < stat[8]):
-                    errors.add(netw[9] + '.' + netw[0] + '.' + stat[4] + '.' + sens[4] + '.' + stre[1])
-                if stat[9] is not None:
-                    if (stre[7] is not None) and (stre[7] > stat[9]):
-                        errors.add(netw[9] + '.' + netw[0] + '.' + stat[4] + '.' + sens[4] + '.' + stre[1])
-                    if (stre[6] > stat[9]):
-                        errors.add(netw[9] + '.' + netw[0] + '.' + stat[4] + '.' + sens[4] + '.' + stre[1])
+                sens = self.__class__.ic.sensorsLoc[stre.sensorLoc]
+                stat = self.__class__.ic.stations[sens.station]
+                netw = self.__class__.ic.networks[stat.network]
+                if (stre.start < stat.start):
+                    errors.add(netw.archive + '.' + netw.code + '.' + stat.code + '.' + sens.code + '.' + stre.code)
+                if stat.end is not None:
+                    if (stre.end is not None) and (stre.end > stat.end):
+                        errors.add(netw.archive + '.' + netw.code + '.' + stat.code + '.' + sens.code + '.' + stre.code)
+                    if (stre.start > stat.end):
+                        errors.add(netw.archive + '.' + netw.code + '.' + stat.code + '.' + sens.code + '.' + stre.code)
         self.assertTrue( len(errors) == 0, 'Stream operational timespan is not coherent with the station. Code(s): %s' % sorted(list(errors)))
 
+    def testStreamInfoMany(self):
+        "information of many streams at once"
+
+        ic = self.__class__.ic
+        windows = []
+        keys = []
+        for stre in list(ic.streams)[:500]:
+            sens = ic.sensorsLoc[stre.sensorLoc]
+            stat = ic.stations[sens.station]
+            netw = ic.networks[stat.network]
+            start = invformat.fromEpoch(stre.start)
+            windows.append((start, start + datetime.timedelta(days=1)))
+            keys.append((netw.code, stat.code, stre.code, sens.code))
+
+        windows.append(windows[0])
+        keys.append(('XX', 'NONE', 'BHZ', ''))
+
+        infos = ic.getStreamInfoMany(windows, keys)
+        self.assertEqual(infos[-1], None, 'Information of a missing stream')
+        for ((start, end), key, info) in zip(windows, keys, infos):
+            self.assertEqual(info, ic.getStreamInfo(start, end, *key),
+                             'Wrong information of %s' % (key,))
+
+        self.assertEqual(inventorycache.estimateSizes([86400, 3600, 0],
+                                                      [20.0, 0.1, 100.0]),
+                         [1728000, 512, 0], 'Wrong sizes')
+
 
 
 
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the differences between versions of the inventory.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import datetime
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import invformat
+import invdelta
+
+
+class InvDeltaTests(unittest.TestCase):
+    """Test the functionality of invdelta.py
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        start = invformat.toEpoch(datetime.datetime(2001, 2, 3))
+        end = invformat.toEpoch(datetime.datetime(2010, 1, 1))
+
+        Network = invformat.Network
+        Station = invformat.Station
+        SensorLocation = invformat.SensorLocation
+        Stream = invformat.Stream
+
+        self.old = ([Network('GE', 0, 2, None, 1993, None, 'GEOFON', 2, 'p',
+                             'GFZ', ''),
+                     Network('_V', None, None, [1], 0, None, '_V virtual',
+                             False, 'p', '', '')],
+                    [Station(0, 0, 1, 'APE', 37.07, 25.53, 'Apirathos',
+                             start, None, 620.0, 2),
+                     Station(0, 1, 2, 'MATE', 40.65, 16.70, 'Matera',
+                             start, None, 490.0, 2)],
+                    [SensorLocation(0, 0, 2, ''),
+                     SensorLocation(1, 2, 3, '')],
+                    [Stream(0, 'BHN', None, 20.0, 1.0, 'Q330', start, None,
+                            2),
+                     Stream(0, 'BHZ', None, 20.0, 1.0, 'Q330', start, None,
+                            2),
+                     Stream(1, 'BHZ', None, 20.0, 1.0, 'Q330', start, None,
+                            2)])
+
+        # A station is added before MATE, APE.BHN is removed and the epoch
+        # of APE.BHZ is closed
+        self.new = ([Network('GE', 0, 3, None, 1993, None, 'GEOFON', 2, 'p',
+                             'GFZ', ''),
+                     Network('_V', None, None, [2], 0, None, '_V virtual',
+                             False, 'p', '', '')],
+                    [Station(0, 0, 1, 'APE', 37.07, 25.53, 'Apirathos',
+                             start, None, 620.0, 2),
+                     Station(0, 1, 2, 'KTHA', 36.26, 23.06, 'Kythira',
+                             start, None, 360.0, 2),
+                     Station(0, 2, 3, 'MATE', 40.65, 16.70, 'Matera',
+                             start, None, 490.0, 2)],
+                    [SensorLocation(0, 0, 1, ''),
+                     SensorLocation(1, 1, 2, ''),
+                     SensorLocation(2, 2, 3, '')],
+                    [Stream(0, 'BHZ', None, 20.0, 1.0, 'Q330', start, end,
+                            2),
+                     Stream(1, 'BHZ', None, 20.0, 1.0, 'Q330', start, None,
+                            2),
+                     Stream(2, 'BHZ', None, 20.0, 1.0, 'Q330', start, None,
+                            2)])
+
+    def testDiff(self):
+        "rows added, removed and changed"
+        delta = invdelta.diff(self.old, self.new)
+
+        # The virtual network still contains the same station
+        self.assertTrue(delta.networks.unchanged(), 'Networks changed')
+
+        self.assertEqual(list(delta.stations.mapping), [0, 2],
+                         'Wrong new positions of the stations')
+        self.assertEqual(delta.stations.added, [1], 'Wrong stations added')
+        self.assertEqual(delta.stations.removed, [],
+                         'Wrong stations removed')
+
+        self.assertEqual(list(delta.streams.mapping), [-1, 0, 2],
+                         'Wrong new positions of the streams')
+        self.assertEqual(delta.streams.added, [1], 'Wrong streams added')
+        self.assertEqual(delta.streams.removed, [0], 'Wrong streams removed')
+        self.assertEqual(delta.streams.changed, [0], 'Wrong streams changed')
+        self.assertEqual(list(delta.streams.kept()), [-1, -1, 2],
+                         'Wrong streams kept')
+        self.assertEqual(delta.streams.renewed(), [0, 1],
+                         'Wrong streams renewed')
+
+    def testColumnar(self):
+        "columnar tables are compared as the records"
+        inv = invformat.ColumnarInventory(invformat.pack(*self.old))
+        delta = invdelta.diff((inv.networks, inv.stations, inv.sensorsLoc,
+                               inv.streams), self.old)
+        for name in ('networks', 'stations', 'sensorsLoc', 'streams'):
+            self.assertTrue(getattr(delta, name).unchanged(),
+                            'Table %s changed' % name)
+
+    def testVirtual(self):
+        "members of a virtual network compared by their keys"
+        new = list(self.new)
+        new[0] = [self.new[0][0], invformat.Network(
+            '_V', None, None, [0, 2], 0, None, '_V virtual', False, 'p', '',
+            '')]
+        delta = invdelta.diff(self.old, new)
+        self.assertEqual(delta.networks.changed, [1],
+                         'Virtual network not changed')
+
+    def testFile(self):
+        "delta saved and read with the versions of the files"
+        delta = invdelta.diff(self.old, self.new)
+        delta.versions['webinterface-cache.col'] = ('abc', 'def')
+
+        filename = 'test-delta.tmp'
+        try:
+            invdelta.write(filename, delta)
+            loaded = invdelta.load(filename)
+        finally:
+            os.remove(filename)
+
+        self.assertEqual(list(loaded.streams.mapping), [-1, 0, 2],
+                         'Wrong new positions of the streams')
+        self.assertEqual(loaded.streams.changed, [0], 'Wrong streams changed')
+        self.assertTrue(loaded.applies('/data/webinterface-cache.col', 'abc',
+                                       'def'), 'Delta not applied')
+        self.assertFalse(loaded.applies('/data/webinterface-cache.col',
+                                        'xyz', 'def'),
+                         'Delta applied to another version')
+        self.assertFalse(loaded.applies('/data/webinterface-cache.bin', 'abc',
+                                        'def'),
+                         'Delta applied to another file')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testInvDelta [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the columnar format of the inventory cache.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import datetime
+import pickle
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import invformat
+
+
+class InvFormatTests(unittest.TestCase):
+    """Test the functionality of invformat.py
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        start = invformat.toEpoch(datetime.datetime(2001, 2, 3, 4, 5, 6))
+        end = invformat.toEpoch(datetime.datetime(2010, 1, 1))
+
+        Network = invformat.Network
+        Station = invformat.Station
+        SensorLocation = invformat.SensorLocation
+        Stream = invformat.Stream
+
+        self.networks = [Network('GE', 0, 2, None, 1993, None, 'GEOFON', 2,
+                                 'p', 'GFZ', ''),
+                         Network('_V', None, None, [1], 0, None,
+                                 '_V virtual', False, 'p', '', '')]
+        self.stations = [Station(0, 0, 1, 'APE', 37.07, 25.53, 'Apirathos',
+                                 start, end, 620.0, 2),
+                         Station(0, 1, 2, 'APE', 37.07, 25.53, 'Apirathos',
+                                 end, None, None, 1)]
+        self.sensorsLoc = [SensorLocation(0, 0, 2, ''),
+                           SensorLocation(1, 2, 3, '00')]
+        self.streams = [Stream(0, 'BHZ', None, 20.0, 1.0, 'Q330', start, end,
+                               2),
+                        Stream(0, 'BHN', None, 20.0, 1.0, 'Q330', start, end,
+                               2),
+                        Stream(1, 'BHZ', None, 40.0, 1.0, u'Q330\xe9', end,
+                               None, 1)]
+
+        self.inv = invformat.ColumnarInventory(invformat.pack(
+            self.networks, self.stations, self.sensorsLoc, self.streams))
+
+    def testRows(self):
+        "rows are the same as the original records"
+        for name in ('networks', 'stations', 'sensorsLoc'):
+            table = getattr(self.inv, name)
+            self.assertEqual(len(table), len(getattr(self, name)))
+            for row, orig in zip(table, getattr(self, name)):
+                self.assertEqual(row, orig)
+
+        self.assertEqual(self.inv.streams[2].datalogger,
+                         u'Q330\xe9'.encode('utf-8'))
+        self.assertEqual(self.inv.streams[0], self.streams[0])
+
+    def testLegacy(self):
+        "lists of old pickled caches are converted to records"
+        start = datetime.datetime(2001, 2, 3, 4, 5, 6)
+        end = datetime.datetime(2010, 1, 1)
+        (networks, stations, sensorsLoc, streams) = invformat.fromLegacy(
+            [['GE', 0, 2, None, 1993, None, 'GEOFON', 2, 'p', 'GFZ', '']],
+            [[0, 0, 1, None, 'APE', 37.07, 25.53, 'Apirathos', start, end,
+              620.0, 2]],
+            [[0, 0, 2, None, '']],
+            [[0, 'BHZ', None, 20.0, 1.0, 'Q330', start, end, 2]])
+
+        self.assertEqual(networks, self.networks[:1])
+        self.assertEqual(stations, self.stations[:1])
+        self.assertEqual(sensorsLoc, self.sensorsLoc[:1])
+        self.assertEqual(streams, self.streams[:1])
+
+    def testPickle(self):
+        "records can be pickled"
+        for name in ('networks', 'stations', 'sensorsLoc', 'streams'):
+            rows = getattr(self, name)
+            self.assertEqual(pickle.loads(pickle.dumps(rows)), rows)
+
+    def testStreamEpochs(self):
+        "epochs of a stream"
+        self.assertEqual(self.inv.streamEpochs('GE', 'APE', 'BHZ', ''), [0])
+        self.assertEqual(self.inv.streamEpochs('GE', 'APE', 'BHN', ''), [1])
+        self.assertEqual(self.inv.streamEpochs('GE', 'APE', 'BHZ', '00'),
+                         [2])
+        self.assertEqual(self.inv.streamEpochs('GE', 'APE', 'BHE', ''), [])
+
+    def testStringTable(self):
+        "lookup of strings"
+        strings = self.inv.strings
+        self.assertEqual(strings[strings.lookup('APE')], 'APE')
+        self.assertEqual(strings.lookup('XXX'), -1)
+        self.assertEqual(list(strings), sorted(strings))
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testInvFormat [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the generator of synthetic inventories.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import invformat
+import invgen
+
+
+class InvGenTests(unittest.TestCase):
+    """Test the functionality of invgen.py
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.inv = invgen.generate(500, seed=7)
+
+    def testDeterministic(self):
+        "same inventory from the same seed"
+        self.assertEqual(invformat.pack(*self.inv),
+                         invformat.pack(*invgen.generate(500, seed=7)),
+                         'Different inventories from the same seed')
+        self.assertNotEqual(invformat.pack(*self.inv),
+                            invformat.pack(*invgen.generate(500, seed=8)),
+                            'Same inventory from different seeds')
+
+    def testPointers(self):
+        "rows of every table pointing to their children"
+        (networks, stations, sensorsLoc, streams) = self.inv
+
+        for (pos, netw) in enumerate(networks):
+            if netw.children is not None:
+                self.assertTrue(netw.code.startswith('_'),
+                                'Virtual network with a wrong code')
+                continue
+
+            for stat in stations[netw.first:netw.last]:
+                self.assertEqual(stat.network, pos, 'Wrong network')
+
+        self.assertEqual(networks[-1].children is not None, True,
+                         'Virtual networks not at the end')
+
+        for (pos, stat) in enumerate(stations):
+            for loc in sensorsLoc[stat.first:stat.last]:
+                self.assertEqual(loc.station, pos, 'Wrong station')
+
+        for (pos, loc) in enumerate(sensorsLoc):
+            self.assertGreater(loc.last, loc.first,
+                               'Sensor location without streams')
+            for strm in streams[loc.first:loc.last]:
+                self.assertEqual(strm.sensorLoc, pos, 'Wrong location')
+
+        self.assertEqual(sum(netw.last - netw.first for netw in networks
+                             if netw.children is None), len(stations),
+                         'Stations without network')
+        self.assertEqual(len(stations), 500, 'Wrong number of stations')
+
+    def testOrder(self):
+        "networks and stations sorted as in update-metadata.py"
+        (networks, stations, sensorsLoc, streams) = self.inv
+        real = [(netw.code, netw.start) for netw in networks
+                if netw.children is None]
+        self.assertEqual(real, sorted(real), 'Networks not sorted')
+
+        for netw in networks:
+            if netw.children is None:
+                keys = [(stat.code, stat.start)
+                        for stat in stations[netw.first:netw.last]]
+                self.assertEqual(keys, sorted(keys), 'Stations not sorted')
+
+    def testStreamIndex(self):
+        "streams indexed by their codes"
+        idx = invgen.streamIndex(*self.inv)
+        self.assertEqual(sum(len(strms) for strms in idx.itervalues()),
+                         len(self.inv[3]), 'Streams missing in the index')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testInvGen [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
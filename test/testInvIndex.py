@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the indexes over the inventory cache.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import math
+import random
+import datetime
+import unittest
+from array import array
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import invindex
+import invformat
+
+
+class InvIndexTests(unittest.TestCase):
+    """Test the functionality of invindex.py
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.lats = [0.0, 10.5, -45.0, 89.9, 90.0, 30.0, 30.0, float('nan')]
+        self.lons = [0.0, 20.0, 179.5, -180.0, 180.0, -179.5, 5.5, 0.0]
+        self.grid = invindex.SpatialGrid(self.lats, self.lons)
+
+    def linear(self, latmin, latmax, lonmin, lonmax):
+        result = []
+        for idx, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            if not (latmin <= lat <= latmax):
+                continue
+            if lonmin <= lonmax:
+                if not (lonmin <= lon <= lonmax):
+                    continue
+            elif lon < lonmin and lon > lonmax:
+                continue
+            result.append(idx)
+        return result
+
+    def testBoxes(self):
+        "grid query equal to a linear scan"
+        boxes = [(-90, 90, -180, 180), (-10, 10, -20, 20), (0, 0, 0, 0),
+                 (29, 31, 5, 6), (10.5, 10.5, 20, 20), (80, 90, 170, -170),
+                 (-50, 50, 170, -170), (0, 90, 180, 180), (10, -10, -5, 5),
+                 (-100, 100, -200, 200)]
+        for box in boxes:
+            self.assertEqual(self.grid.query(*box), self.linear(*box),
+                             'Wrong stations in box %s' % (box,))
+
+    def testNoCoordinates(self):
+        "stations without coordinates are never found"
+        self.assertTrue(7 not in self.grid.query(-90, 90, -180, 180))
+
+
+    def testTree(self):
+        "k-d tree finds all the stations in an annulus"
+        rnd = random.Random(1)
+        lats = [rnd.uniform(-90, 90) for i in range(2000)]
+        lons = [rnd.uniform(-180, 180) for i in range(2000)]
+        tree = invindex.UnitVectorTree(lats, lons, margin=0.0)
+
+        for (lat, lon, mindist, maxdist) in [(0, 0, 0, 10), (89, 45, 5, 30),
+                                             (-20, 179, 90, 180),
+                                             (10, -60, None, 1),
+                                             (45, 10, 30, None)]:
+            expected = []
+            for idx in range(len(lats)):
+                d = math.degrees(math.acos(max(-1.0, min(1.0,
+                    math.sin(math.radians(lat)) *
+                    math.sin(math.radians(lats[idx])) +
+                    math.cos(math.radians(lat)) *
+                    math.cos(math.radians(lats[idx])) *
+                    math.cos(math.radians(lon - lons[idx]))))))
+                # Avoid rounding problems in the limits
+                if mindist is not None and d < mindist + 1e-6:
+                    continue
+                if maxdist is not None and d > maxdist - 1e-6:
+                    continue
+                expected.append(idx)
+
+            found = tree.query(lat, lon, mindist, maxdist)
+            self.assertEqual(found, sorted(found), 'Indexes are not sorted')
+            self.assertTrue(set(expected) <= set(found),
+                            'Stations missing around (%s, %s)' % (lat, lon))
+            self.assertTrue(len(found) - len(expected) < 20,
+                            'Too many stations around (%s, %s)' % (lat, lon))
+
+
+    def testEpochs(self):
+        "epochs active in a period equal to a linear scan"
+        empty = -2 ** 63
+        rnd = random.Random(2)
+        starts = []
+        ends = []
+        for i in range(500):
+            start = rnd.choice([empty, rnd.randint(0, 100)])
+            starts.append(start)
+            ends.append(rnd.choice([empty, max(start, 0) +
+                                    rnd.randint(0, 30)]))
+        index = invindex.EpochIndex(starts, ends, empty)
+
+        for (t1, t2) in [(None, None), (10, 20), (50, None), (None, 5),
+                         (30, 30), (-10, 0), (131, 200)]:
+            expected = [i for i in range(500)
+                        if (t1 is None or ends[i] == empty or ends[i] >= t1)
+                        and (t2 is None or starts[i] <= t2)]
+            active = index.active(t1, t2)
+            self.assertEqual(sorted(active), expected,
+                             'Wrong epochs active in %s-%s' % (t1, t2))
+            self.assertEqual([i for i in range(500) if i in active],
+                             expected,
+                             'Wrong epochs active in %s-%s' % (t1, t2))
+
+
+    def testUpdated(self):
+        "indexes updated with a delta equal to new ones"
+        empty = -2 ** 63
+        rnd = random.Random(3)
+        n = 300
+        lats = [rnd.uniform(-90, 90) for i in range(n)]
+        lons = [rnd.uniform(-180, 180) for i in range(n)]
+        starts = [rnd.choice([empty, rnd.randint(0, 100)]) for i in range(n)]
+        ends = [rnd.choice([empty, rnd.randint(100, 130)]) for i in range(n)]
+
+        # Remove some epochs, change others and add new ones at the end
+        kept = array('i', range(n))
+        newLats = list(lats)
+        newLons = list(lons)
+        newStarts = list(starts)
+        newEnds = list(ends)
+        for i in sorted(rnd.sample(range(n), 10), reverse=True):
+            del newLats[i], newLons[i], newStarts[i], newEnds[i]
+            kept[i] = -1
+            for j in range(i + 1, n):
+                kept[j] -= 1
+
+        renewed = sorted(rnd.sample(range(len(newLats)), 5))
+        for i in renewed:
+            newLats[i] = rnd.uniform(-90, 90)
+            newEnds[i] = rnd.randint(100, 130)
+        for i in range(n):
+            if kept[i] in renewed:
+                kept[i] = -1
+
+        for i in range(8):
+            renewed.append(len(newLats))
+            newLats.append(rnd.uniform(-90, 90))
+            newLons.append(rnd.uniform(-180, 180))
+            newStarts.append(rnd.randint(0, 100))
+            newEnds.append(empty)
+
+        grid = invindex.SpatialGrid(lats, lons).updated(newLats, newLons,
+                                                        kept, renewed)
+        tree = invindex.UnitVectorTree(lats, lons).updated(newLats, newLons,
+                                                           kept, renewed)
+        epochs = invindex.EpochIndex(starts, ends, empty).updated(
+            newStarts, newEnds, empty, kept, renewed)
+
+        expectedGrid = invindex.SpatialGrid(newLats, newLons)
+        expectedTree = invindex.UnitVectorTree(newLats, newLons)
+        expectedEpochs = invindex.EpochIndex(newStarts, newEnds, empty)
+
+        for box in [(-90, 90, -180, 180), (-10, 40, -20, 60),
+                    (30, 60, 170, -170)]:
+            self.assertEqual(grid.query(*box), expectedGrid.query(*box),
+                             'Wrong stations in box %s' % (box,))
+
+        for (lat, lon, mindist, maxdist) in [(0, 0, 0, 30), (45, 10, 30, 60),
+                                             (-20, 179, 90, None)]:
+            self.assertEqual(tree.query(lat, lon, mindist, maxdist),
+                             expectedTree.query(lat, lon, mindist, maxdist),
+                             'Wrong stations around (%s, %s)' % (lat, lon))
+
+        for (t1, t2) in [(None, None), (10, 20), (50, None), (None, 5),
+                         (110, 120), (131, 200)]:
+            active = epochs.active(t1, t2)
+            expected = expectedEpochs.active(t1, t2)
+            self.assertEqual(sorted(active), sorted(expected),
+                             'Wrong epochs active in %s-%s' % (t1, t2))
+            self.assertEqual([i for i in range(len(newStarts))
+                              if i in active],
+                             [i for i in range(len(newStarts))
+                              if i in expected],
+                             'Wrong epochs active in %s-%s' % (t1, t2))
+
+        self.assertEqual(invindex.remapIndexes({'a': [0, 3], 'b': [1]},
+                                               array('i', [2, -1, 5, 0])),
+                         {'a': [0, 2]}, 'Wrong indexes renumbered')
+
+    def testNetworkBits(self):
+        "network sets equal to a linear scan"
+        Network = invformat.Network
+        networks = [Network('GE', 0, 5, None, 1993, None, '', 2, 'p', '', ''),
+                    Network('Z3', 5, 9, None, 2005, 2007, '', 1, 't', '', ''),
+                    Network('Z3', 9, 12, None, 2015, 2017, '', 2, 't', '', ''),
+                    Network('XX', 12, 13, None, 1980, 1990, '', 1, 'p', '',
+                            ''),
+                    Network('_V', None, None, [1, 2], 0, None, '', False,
+                            'p', '', '')]
+        bits = invindex.NetworkBits(networks)
+
+        self.assertEqual(invindex.bitIndexes(bits.all), range(5),
+                         'Wrong set with all the networks')
+        self.assertEqual(invindex.bitIndexes(bits.virtual), [4],
+                         'Wrong set of virtual networks')
+        self.assertEqual(invindex.bitIndexes(bits.restricted[1]), [1, 3],
+                         'Wrong set of restricted networks')
+        self.assertEqual(invindex.bitIndexes(bits.netclass['t']), [1, 2],
+                         'Wrong set of temporary networks')
+
+        for year in range(1975, 2025):
+            self.assertEqual(invindex.bitIndexes(bits.endingBefore(year)),
+                             [i for i, n in enumerate(networks)
+                              if n.end and n.end < year],
+                             'Wrong networks ending before %d' % year)
+            self.assertEqual(invindex.bitIndexes(bits.startingAfter(year)),
+                             [i for i, n in enumerate(networks)
+                              if n.start and n.start > year],
+                             'Wrong networks starting after %d' % year)
+
+
+    def testStreamSummary(self):
+        "summary of the streams of a station"
+        start = invformat.toEpoch(datetime.datetime(2001, 2, 3))
+        Stream = invformat.Stream
+        networks = [invformat.Network('GE', 0, 1, None, 1993, None, 'GEOFON',
+                                      2, 'p', 'GFZ', '')]
+        stations = [invformat.Station(0, 0, 2, 'APE', 37.07, 25.53,
+                                      'Apirathos', start, None, 620.0, 2)]
+        sensorsLoc = [invformat.SensorLocation(0, 0, 3, '10'),
+                      invformat.SensorLocation(0, 3, 5, '')]
+        streams = [Stream(0, 'HHZ', 'BB', 100.0, 1.0, 'Q330', start, None, 1),
+                   Stream(0, 'BHZ', 'BB', 20.0, 1.0, 'Q330', start, None, 2),
+                   Stream(0, 'LHZ', None, 0.0, 1.0, 'Q330', start, None, 2),
+                   Stream(1, 'SHZ', 'SP', 50.0, 1.0, 'Q330', start, None, 2),
+                   Stream(1, 'BHZ', None, 20.0, 1.0, 'Q330', start, None,
+                          None)]
+        inv = invformat.ColumnarInventory(invformat.pack(networks, stations,
+                                                         sensorsLoc, streams))
+        summaries = invindex.StreamSummaries(inv)
+        summary = summaries[0]
+        bands = dict((i, band) for (band, i)
+                     in summaries.bandCodes.ids.items())
+
+        self.assertEqual(summary.locch, ['.BHZ', '.SHZ', '10.BHZ', '10.HHZ',
+                                         '10.LHZ'], 'Wrong streams')
+        self.assertEqual(summary.streams, [4, 3, 1, 0, 2],
+                         'Wrong stream indexes')
+        self.assertEqual([bands[i] for i in summary.bands],
+                         ['BH', 'SH', 'BH', 'HH', 'LH'], 'Wrong band codes')
+        self.assertEqual(summary.sps, [0.05, 0.02, 0.05, 0.01, None],
+                         'Wrong sampling rates')
+        self.assertEqual([inv.strings[i] for i in summary.sensortypes],
+                         [None, 'SP', 'BB', 'BB', None], 'Wrong sensor types')
+        self.assertEqual(summary.restricted, [None, 2, 2, 1, 2],
+                         'Wrong restrictions')
+
+        bandCodes = summaries.bandCodes
+        self.assertEqual(sorted(bandCodes.ids), ['BH', 'HH', 'LH', 'SH'],
+                         'Wrong band codes in the inventory')
+        self.assertEqual(bandCodes.lookup(['BH', 'XX', 'HH']),
+                         set([bandCodes.ids['BH'], bandCodes.ids['HH']]),
+                         'Wrong integers of band codes')
+
+    def testBandCounts(self):
+        "band code counts of stations and networks"
+        start = invformat.toEpoch(datetime.datetime(2001, 2, 3))
+        later = invformat.toEpoch(datetime.datetime(2009, 1, 1))
+        Station = invformat.Station
+        Stream = invformat.Stream
+        networks = [invformat.Network('GE', 0, 3, None, 1993, None, 'GEOFON',
+                                      2, 'p', 'GFZ', ''),
+                    invformat.Network('_V', None, None, [1, 2], 1993, None,
+                                      '', 2, 'p', '', '')]
+        stations = [Station(0, 0, 1, 'APE', 37.07, 25.53, '', start, later,
+                            620.0, 2),
+                    Station(0, 1, 2, 'APE', 37.07, 25.53, '', later, None,
+                            620.0, 2),
+                    Station(0, 2, 3, 'MATE', 40.65, 16.70, '', start, None,
+                            490.0, 2)]
+        sensorsLoc = [invformat.SensorLocation(0, 0, 2, ''),
+                      invformat.SensorLocation(1, 2, 4, ''),
+                      invformat.SensorLocation(2, 4, 7, '')]
+        streams = [Stream(0, 'BHZ', 'BB', 20.0, 1.0, 'Q330', start, later, 2),
+                   Stream(0, 'BHN', 'BB', 20.0, 1.0, 'Q330', start, later, 2),
+                   Stream(1, 'HHZ', 'BB', 100.0, 1.0, 'Q330', later, None, 2),
+                   Stream(1, 'LHZ', 'BB', 1.0, 1.0, 'Q330', later, None, 2),
+                   Stream(2, 'BHZ', 'BB', 20.0, 1.0, 'Q330', start, None, 2),
+                   Stream(2, 'BHE', 'BB', 20.0, 1.0, 'Q330', start, None, 2),
+                   Stream(2, 'HHZ', 'BB', 100.0, 1.0, 'Q330', start, None, 2)]
+        inv = invformat.ColumnarInventory(invformat.pack(networks, stations,
+                                                         sensorsLoc, streams))
+        summaries = invindex.StreamSummaries(inv)
+        codes = summaries.bandCodes.codes
+
+        def named(counts):
+            return dict((codes[b], c) for (b, c) in counts.items())
+
+        self.assertEqual(sorted(codes), ['BH', 'HH', 'LH'],
+                         'Wrong band codes in the inventory')
+        for band in codes:
+            self.assertEqual(codes[summaries.bandCodes.ids[band]], band,
+                             'Wrong integer of band code %s' % band)
+
+        self.assertEqual(named(summaries[0].bandCounts), {'BH': 2},
+                         'Wrong counts of the first station')
+        self.assertEqual(named(invindex.mergeBandCounts(summaries, [1, 2])),
+                         {'BH': 2, 'HH': 2, 'LH': 1},
+                         'Wrong counts of two stations')
+
+        counts = invindex.NetworkBandCounts(inv, summaries)
+        self.assertEqual(named(counts[0]), {'BH': 4, 'HH': 1},
+                         'Wrong counts of the first epochs of the network')
+        self.assertEqual(named(counts[1]), {'BH': 2, 'HH': 2, 'LH': 1},
+                         'Wrong counts of the virtual network')
+        self.assertTrue(counts[0] is counts[0], 'Counts built twice')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testInvIndex [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the segmented storage of the inventory.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import math
+import random
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import invformat
+import invsegment
+import invgen
+
+
+class InvSegmentTests(unittest.TestCase):
+    """Test the functionality of invsegment.py
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        "Setting up test"
+        cls.tables = invgen.generate(400, seed=5)
+        cls.columnar = invformat.ColumnarInventory(
+            invformat.pack(*cls.tables))
+
+        cls.filename = 'test-inventory.seg'
+        invsegment.write(cls.filename, *cls.tables)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def testRows(self):
+        "same rows and columns as the columnar format"
+        inv = invsegment.load(self.filename)
+        for name in ('networks', 'stations', 'sensorsLoc', 'streams'):
+            self.assertEqual(list(getattr(inv, name)),
+                             list(getattr(self.columnar, name)),
+                             'Different rows in %s' % name)
+
+            for (col, coltype) in invformat.LAYOUT[name]:
+                values = list(getattr(inv, name).column(col))
+                expected = list(getattr(self.columnar, name).column(col))
+                self.assertEqual(len(values), len(expected))
+                for (a, b) in zip(values, expected):
+                    self.assertTrue(a == b or (math.isnan(a) and
+                                               math.isnan(b)),
+                                    'Different values of column %s' % col)
+
+    def testLazy(self):
+        "segments read only when needed"
+        inv = invsegment.load(self.filename)
+        self.assertEqual(len(inv.cache), 0, 'Segments read when opened')
+        self.assertEqual(len(inv.stations), len(self.tables[1]))
+
+        stream = self.tables[3][-1]
+        self.assertEqual(inv.streams[-1], stream)
+        self.assertEqual(len(inv.cache), 1, 'Wrong number of segments read')
+
+    def testMemory(self):
+        "segments discarded when they take too much memory"
+        inv = invsegment.load(self.filename, 4096)
+        for pos in xrange(len(inv.segments['network'])):
+            inv.segment(pos)
+            self.assertTrue(inv.cache.size <= 4096, 'Too many segments kept')
+
+        # Rows of the segments discarded are read again
+        self.assertEqual(list(inv.streams), list(self.columnar.streams))
+
+    def testStreamEpochs(self):
+        "epochs of a stream found by its codes"
+        inv = invsegment.load(self.filename)
+        rnd = random.Random(1)
+        for i in xrange(50):
+            key = self.columnar.streamKey(rnd.randrange(len(self.tables[3])))
+            self.assertEqual(inv.streamEpochs(*key),
+                             sorted(self.columnar.streamEpochs(*key),
+                                    key=lambda s: (self.tables[3][s].start,
+                                                   s)),
+                             'Wrong epochs of %s' % (key,))
+        self.assertEqual(inv.streamEpochs('XX', 'NONE', 'BHZ', ''), [])
+        self.assertEqual(inv.streamCodes(), self.columnar.streamCodes())
+
+    def testEpochs(self):
+        "streams active in a period"
+        inv = invsegment.load(self.filename)
+        table = self.columnar.streams
+        index = invsegment.EpochIndex(inv.streams)
+
+        for period in [(None, None), (0, None), (None, 10 ** 9),
+                       (10 ** 9, 1.2 * 10 ** 9)]:
+            expected = [i for (i, s) in enumerate(self.tables[3])
+                        if (period[1] is None or s.start <= period[1]) and
+                        (period[0] is None or s.end is None or
+                         s.end >= period[0])]
+            active = index.active(*period)
+            self.assertEqual(sorted(active), expected,
+                             'Wrong streams in %s' % (period,))
+            self.assertEqual([i for i in xrange(len(table)) if i in active],
+                             expected,
+                             'Wrong streams checked in %s' % (period,))
+
+    def testVersion(self):
+        "files which are not inventories in segmented format"
+        with open('test-inventory.tmp', 'w') as fout:
+            fout.write('This is not an inventory')
+        try:
+            self.assertRaises(ValueError, invsegment.load,
+                              'test-inventory.tmp')
+        finally:
+            os.remove('test-inventory.tmp')
+
+        self.assertRaises(IOError, invsegment.load, 'missing.seg')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testInvSegment [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
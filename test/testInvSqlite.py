@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the SQLite storage of the inventory.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import math
+import random
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import invformat
+import invindex
+import invsqlite
+import invgen
+
+
+class InvSqliteTests(unittest.TestCase):
+    """Test the functionality of invsqlite.py
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        "Setting up test"
+        cls.tables = invgen.generate(400, seed=5)
+        cls.columnar = invformat.ColumnarInventory(
+            invformat.pack(*cls.tables))
+
+        cls.filename = 'test-inventory.sqlite'
+        invsqlite.write(cls.filename, *cls.tables)
+        cls.inv = invsqlite.load(cls.filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def testRows(self):
+        "same rows and columns as the columnar format"
+        for name in ('networks', 'stations', 'sensorsLoc', 'streams'):
+            self.assertEqual(list(getattr(self.inv, name)),
+                             list(getattr(self.columnar, name)),
+                             'Different rows in %s' % name)
+
+        for (col, coltype) in invformat.LAYOUT['stations']:
+            values = list(self.inv.stations.column(col))
+            expected = list(self.columnar.stations.column(col))
+            self.assertEqual(len(values), len(expected))
+            for (a, b) in zip(values, expected):
+                self.assertTrue(a == b or (math.isnan(a) and math.isnan(b)),
+                                'Different values of column %s' % col)
+
+    def testStrings(self):
+        "string table with the same references"
+        self.assertEqual(len(self.inv.strings), len(self.columnar.strings))
+        for value in ('BHZ', '00', 'Q330', 'missing'):
+            self.assertEqual(self.inv.strings.lookup(value),
+                             self.columnar.strings.lookup(value),
+                             'Wrong reference of %s' % value)
+
+    def testStreamEpochs(self):
+        "epochs of a stream found by its codes"
+        rnd = random.Random(1)
+        for i in xrange(50):
+            key = self.columnar.streamKey(rnd.randrange(len(self.tables[3])))
+            self.assertEqual(self.inv.streamEpochs(*key),
+                             sorted(self.columnar.streamEpochs(*key),
+                                    key=lambda s: (self.tables[3][s].start,
+                                                   s)),
+                             'Wrong epochs of %s' % (key,))
+        self.assertEqual(self.inv.streamEpochs('XX', 'NONE', 'BHZ', ''), [])
+
+    def testBoxes(self):
+        "boxes with the R*Tree and without it"
+        lats = self.columnar.stations.column('latitude')
+        lons = self.columnar.stations.column('longitude')
+        grid = invindex.SpatialGrid(lats, lons)
+        index = invsqlite.BoxIndex(self.inv)
+
+        boxes = [(-90, 90, -180, 180), (-10, 10, -20, 20), (30, 60, -10, 40),
+                 (-50, 50, 170, -170), (10, -10, -5, 5)]
+        for rtree in (True, False):
+            self.inv.rtree = rtree
+            for box in boxes:
+                self.assertEqual(index.query(*box), grid.query(*box),
+                                 'Wrong stations in box %s' % (box,))
+        self.inv.rtree = True
+
+    def testDistances(self):
+        "all the stations close to a point are found"
+        lats = self.columnar.stations.column('latitude')
+        lons = self.columnar.stations.column('longitude')
+        tree = invindex.UnitVectorTree(lats, lons, margin=0.0)
+        index = invsqlite.DistanceIndex(self.inv)
+
+        for (lat, lon, maxdist) in [(0, 0, 20), (45, 179, 10), (-80, 0, 15),
+                                    (10, -100, 100), (50, 10, None)]:
+            near = set(index.query(lat, lon, 0, maxdist))
+            self.assertTrue(set(tree.query(lat, lon, 0, maxdist)) <= near,
+                            'Stations missing around %s, %s' % (lat, lon))
+
+    def testEpochs(self):
+        "epochs active in a period"
+        for name in ('stations', 'streams'):
+            table = getattr(self.columnar, name)
+            memory = invindex.EpochIndex(table.column('start'),
+                                         table.column('end'),
+                                         invformat.NONE_EPOCH)
+            index = invsqlite.EpochIndex(self.inv, name)
+
+            for period in [(None, None), (0, None), (None, 10 ** 9),
+                           (10 ** 9, 1.2 * 10 ** 9)]:
+                expected = sorted(memory.active(*period))
+                active = index.active(*period)
+                self.assertEqual(sorted(active), expected,
+                                 'Wrong %s in %s' % (name, period))
+                self.assertEqual([i for i in xrange(len(table))
+                                  if i in active], expected,
+                                 'Wrong %s checked in %s' % (name, period))
+
+    def testCodes(self):
+        "stations found by their codes"
+        networks = self.tables[0]
+        stations = self.tables[1]
+
+        stat = stations[123]
+        netw = networks[stat.network]
+        byCode = invsqlite.StationsByCode(self.inv)
+        self.assertEqual(byCode[(netw.code, stat.code)],
+                         [s for (s, other) in enumerate(stations)
+                          if other.code == stat.code and
+                          networks[other.network].code == netw.code])
+        self.assertEqual(byCode.get(('XX', 'NONE'), ()), ())
+
+        key = '%s-%s-%s-%s' % (netw.code, netw.start, netw.end, stat.code)
+        self.assertTrue(123 in invsqlite.StationsByKey(self.inv).get(key),
+                        'Station not found by key')
+
+        # A station of a virtual network
+        vnet = len(networks) - 1
+        child = networks[vnet].children[0]
+        parents = invsqlite.VirtualParents(self.inv)
+        self.assertTrue(vnet in parents.get(child, ()), 'Parent not found')
+
+        pairs = invsqlite.ChildrenByCode(self.inv).get(
+            (networks[vnet].code, stations[child].code))
+        self.assertEqual(pairs, [(vnet, s) for s in networks[vnet].children
+                                 if stations[s].code ==
+                                 stations[child].code])
+
+    def testVersion(self):
+        "files which are not databases of the inventory"
+        with open('test-inventory.tmp', 'w') as fout:
+            fout.write('This is not a database')
+        try:
+            self.assertRaises(ValueError, invsqlite.load,
+                              'test-inventory.tmp')
+        finally:
+            os.remove('test-inventory.tmp')
+
+        self.assertRaises(IOError, invsqlite.load, 'missing.sqlite')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testInvSqlite [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
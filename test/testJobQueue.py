@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the queue of background jobs.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import jobqueue
+
+
+def rows(*parts):
+    """Job producing the given lists of rows."""
+    def job():
+        for part in parts:
+            yield part
+    return job
+
+
+def failing():
+    yield [[1, 2]]
+    raise jobqueue.JobError('Maximum request size exceeded')
+
+
+class JobQueueTests(unittest.TestCase):
+    """Test the functionality of jobqueue.py
+
+    """
+
+    def setUp(self):
+        "Setting up test"
+        self.spool = tempfile.mkdtemp()
+        self.jobs = jobqueue.JobQueue(self.spool, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.spool)
+
+    def testResult(self):
+        "status and result of a job"
+        jobid = self.jobs.submit('a', rows([[1, 'x']], [], [[2, 'y']]))
+        self.assertEqual(self.jobs.status(jobid)['status'], jobqueue.QUEUED)
+        self.assertEqual(self.jobs.result(jobid), None, 'Result not done')
+
+        self.assertEqual(self.jobs.runNext(), jobid)
+        self.assertEqual(self.jobs.runNext(), None)
+
+        status = self.jobs.status(jobid)
+        self.assertEqual(status['status'], jobqueue.DONE)
+        self.assertEqual(status['lines'], 2)
+        self.assertEqual(status['error'], None)
+        self.assertEqual(json.loads(''.join(self.jobs.result(jobid))),
+                         [[1, 'x'], [2, 'y']])
+
+    def testFailed(self):
+        "job which raises an error"
+        jobid = self.jobs.submit('a', failing)
+        self.jobs.runNext()
+
+        status = self.jobs.status(jobid)
+        self.assertEqual(status['status'], jobqueue.FAILED)
+        self.assertEqual(status['lines'], 1)
+        self.assertEqual(status['error'], 'Maximum request size exceeded')
+        self.assertEqual(self.jobs.result(jobid), None)
+
+    def testFair(self):
+        "jobs of every client taken in turn"
+        a = [self.jobs.submit('a', rows()) for i in xrange(3)]
+        b = [self.jobs.submit('b', rows()) for i in xrange(2)]
+        c = self.jobs.submit('c', rows())
+
+        order = [self.jobs.runNext() for i in xrange(6)]
+        self.assertEqual(order, [a[0], b[0], c, a[1], b[1], a[2]])
+
+    def testUnknown(self):
+        "jobs which do not exist"
+        self.assertEqual(self.jobs.status('0' * 32), None)
+        self.assertEqual(self.jobs.status('../jobs'), None)
+        self.assertEqual(self.jobs.status(None), None)
+        self.assertEqual(self.jobs.result('0' * 32), None)
+
+    def testExpire(self):
+        "files of old jobs removed"
+        jobid = self.jobs.submit('a', rows([[1]]))
+        self.jobs.runNext()
+        self.jobs.expire()
+        self.assertNotEqual(self.jobs.status(jobid), None, 'Job removed')
+
+        for name in os.listdir(self.spool):
+            os.utime(os.path.join(self.spool, name), (0, 0))
+
+        self.jobs.expire()
+        self.assertEqual(self.jobs.status(jobid), None, 'Job not removed')
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def testExpireInterval(self):
+        "spool not checked for old jobs on every submission"
+        first = self.jobs.submit('a', rows())
+        for name in os.listdir(self.spool):
+            os.utime(os.path.join(self.spool, name), (0, 0))
+
+        self.jobs.submit('a', rows())
+        self.assertNotEqual(self.jobs.status(first), None, 'Job removed')
+
+    def testOrphan(self):
+        "jobs queued by a process which no longer exists"
+        jobid = self.jobs.submit('a', rows([[1]]))
+        self.assertFalse('owner' in self.jobs.status(jobid))
+
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()
+
+        path = os.path.join(self.spool, jobid + '.status')
+        with open(path) as fin:
+            status = json.load(fin)
+        status['owner'] = ['elsewhere', proc.pid]
+        with open(path, 'w') as fout:
+            json.dump(status, fout)
+        self.assertEqual(self.jobs.status(jobid)['status'], jobqueue.QUEUED,
+                         'Job of another host failed')
+
+        status['owner'] = [jobqueue.HOST, proc.pid]
+        with open(path, 'w') as fout:
+            json.dump(status, fout)
+        status = self.jobs.status(jobid)
+        self.assertEqual(status['status'], jobqueue.FAILED)
+        self.assertEqual(status['error'], 'The job was interrupted')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testJobQueue [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the cache of responses.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import lrucache
+
+
+class LRUCacheTests(unittest.TestCase):
+    """Test the functionality of lrucache.py
+
+    """
+
+    def testSize(self):
+        "least recently used entries are discarded"
+        cache = lrucache.LRUCache(10)
+        cache.put('a', '1234')
+        cache.put('b', '1234')
+        self.assertEqual(cache.get('a'), '1234', 'Entry not found')
+        cache.put('c', '1234')
+
+        self.assertEqual(cache.get('b'), None, 'Entry b was not discarded')
+        self.assertEqual(cache.get('a'), '1234', 'Entry a was discarded')
+        self.assertEqual(cache.size, 8, 'Wrong size of the cache')
+
+        cache.put('d', '12345678901')
+        self.assertEqual(cache.get('d'), None, 'Too large entry was stored')
+        self.assertEqual(len(cache), 2, 'Wrong number of entries')
+
+    def testReplace(self):
+        "replacing an entry updates the size"
+        cache = lrucache.LRUCache(10)
+        cache.put('a', '1234')
+        cache.put('a', '12')
+        self.assertEqual(cache.size, 2, 'Wrong size of the cache')
+        self.assertEqual(cache.get('a'), '12', 'Entry not replaced')
+
+    def testSizeof(self):
+        "size of the values given by a function"
+        cache = lrucache.LRUCache(2, lambda value: 1)
+        cache.put('a', '1234')
+        cache.put('b', '1234')
+        cache.put('c', '1234')
+        self.assertEqual(cache.size, 2, 'Wrong size of the cache')
+        self.assertEqual(cache.get('a'), None, 'Entry was not discarded')
+        self.assertEqual(cache.get('c'), '1234', 'Entry was discarded')
+
+    def testVersion(self):
+        "entries are discarded when the version changes"
+        cache = lrucache.LRUCache(10)
+        cache.validate('v1')
+        cache.put('a', '1234')
+        cache.validate('v1')
+        self.assertEqual(cache.get('a'), '1234', 'Entry was discarded')
+        cache.validate('v2')
+        self.assertEqual(cache.get('a'), None, 'Entry was not discarded')
+        self.assertEqual(cache.size, 0, 'Wrong size of the cache')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testLRUCache [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the cache of travel times.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import traveltime
+
+
+class TT(object):
+    def __init__(self, phase, time):
+        self.phase = phase
+        self.time = time
+
+
+class Table(object):
+    """Travel time table depending only on the longitude of the station."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def compute(self, lat1, lon1, dep, lat2, lon2, alt):
+        self.calls += 1
+        result = [TT('Pn', 10.0 + lon2), TT('pP', 12.0 + lon2)]
+        if lon2 < 175:
+            result.extend([TT('S', 20.0 + lon2), TT('SKSac', 30.0 + lon2)])
+        if lon2 > 110:
+            result.append(TT('PKPdf', 15.0 + lon2))
+        return sorted(result, key=lambda tt: tt.time)
+
+
+def station(delta, depth, alt=0.0):
+    """Event on the equator and station along it at a distance delta."""
+    return (0.0, 0.0, depth, 0.0, delta, alt)
+
+
+class TravelTimeTests(unittest.TestCase):
+    """Test the functionality of traveltime.py
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        "Setting up test"
+        cls.filename = 'test-traveltimes.grid'
+        traveltime.writeGrid(cls.filename, Table(), (0.0, 10.0, 19),
+                             (0.0, 100.0, 8))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def testFirstArrivals(self):
+        "first phase of every group"
+        arrivals = traveltime.firstArrivals(Table().compute(0, 0, 10, 0, 130,
+                                                            0))
+        self.assertEqual(arrivals.time('P', 100), 140.0)
+        self.assertEqual(arrivals.time('P', 130), 145.0, 'PKP not used')
+        self.assertEqual(arrivals.time('S', 130), 150.0)
+        self.assertEqual(arrivals.time('OT', 130), 0.0)
+        self.assertRaises(ValueError, arrivals.time, 'X', 130)
+
+        arrivals = traveltime.firstArrivals(Table().compute(0, 0, 10, 0, 50,
+                                                            0))
+        self.assertEqual(arrivals.time('P', 130), None)
+
+        arrivals = traveltime.firstArrivals([])
+        self.assertEqual(arrivals.time('OT', 0), None)
+
+    def testCache(self):
+        "travel times computed once for every distance and depth"
+        table = Table()
+        cache = traveltime.TravelTimeCache(table, 10, 0.1, 1.0)
+
+        first = cache.arrivals(station(30.0, 10), 30.0)
+        self.assertEqual(first.time('P', 30.0), 40.0)
+        other = cache.arrivals((5.0, 3.0, 10.2, 5.0, 33.01, 0.0), 30.01)
+        self.assertEqual(other.time('P', 30.0), 40.0)
+        self.assertEqual(table.calls, 1, 'Travel times not reused')
+
+        cache.arrivals(station(30.0, 12), 30.0)
+        cache.arrivals(station(31.0, 10), 31.0)
+        cache.arrivals(station(30.0, 10, 100.0), 30.0)
+        self.assertEqual(table.calls, 4, 'Travel times wrongly reused')
+
+        # Computed for the rounded distance
+        self.assertEqual(cache.arrivals(station(45.04, 10), 45.04).time(
+            'P', 45.0), 55.0)
+
+        for i in xrange(20):
+            cache.arrivals(station(float(i), 10), float(i))
+        self.assertEqual(len(cache.cache), 10, 'Too many entries kept')
+
+    def testExact(self):
+        "exact positions without resolution"
+        table = Table()
+        cache = traveltime.TravelTimeCache(table, 10)
+        cache.arrivals(station(30.0, 10), 30.0)
+        cache.arrivals(station(30.01, 10), 30.01)
+        self.assertEqual(cache.arrivals(station(30.0, 10), 30.0).time(
+            'P', 30.0), 40.0)
+        self.assertEqual(table.calls, 2)
+
+        # Same distance from another position or to another elevation
+        cache.arrivals((10.0, 0.0, 10, 10.0, 30.0, 0.0), 30.0)
+        cache.arrivals(station(30.0, 10, 100.0), 30.0)
+        self.assertEqual(table.calls, 4, 'Travel times wrongly reused')
+
+        table = Table()
+        cache = traveltime.TravelTimeCache(table, 0, 0.1, 1.0)
+        cache.arrivals(station(30.0, 10), 30.0)
+        cache.arrivals(station(30.0, 10), 30.0)
+        self.assertEqual(table.calls, 2, 'Travel times kept without cache')
+
+    def testGrid(self):
+        "travel times interpolated from the grid"
+        grid = traveltime.load(self.filename)
+        deltas = [0.0, 35.0, 47.5, 100.0, 125.0, 180.0, 105.0, 190.0, 10.0]
+        depths = [0.0, 10.0, 250.0, 700.0, 30.0, 0.0, 0.0, 0.0, 750.0]
+
+        self.assertEqual(grid.times('P', deltas, depths),
+                         [10.0, 45.0, 57.5, 110.0, 140.0, 195.0, 115.0, None,
+                          None])
+        self.assertEqual(grid.times('S', deltas, depths)[:6],
+                         [20.0, 55.0, 67.5, 120.0, 145.0, None])
+        self.assertEqual(grid.times('OT', deltas, depths), [0.0] * 9)
+        self.assertRaises(ValueError, grid.times, 'X', deltas, depths)
+
+        # Without NumPy
+        numpy = traveltime.numpy
+        try:
+            traveltime.numpy = None
+            grid = traveltime.load(self.filename)
+            self.assertEqual(grid.times('P', deltas, depths),
+                             [10.0, 45.0, 57.5, 110.0, 140.0, 195.0, 115.0,
+                              None, None])
+        finally:
+            traveltime.numpy = numpy
+
+    def testGridFile(self):
+        "files which are not grids of travel times"
+        with open('test-traveltimes.tmp', 'w') as fout:
+            fout.write('This is not a grid')
+        try:
+            self.assertRaises(ValueError, traveltime.load,
+                              'test-traveltimes.tmp')
+        finally:
+            os.remove('test-traveltimes.tmp')
+
+        self.assertRaises(IOError, traveltime.load, 'missing.grid')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testTravelTime [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Run unit tests on the responses sent to the client.
+#
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import datetime
+import unittest
+from unittestTools import WITestRunner
+
+sys.path.append(os.path.join('..', 'wsgi'))
+
+import wsgicomm
+
+
+class StartResponse(object):
+    def __call__(self, status, headers):
+        self.status = status
+        self.headers = dict(headers)
+
+
+class CachedResponseTests(unittest.TestCase):
+    """Test the functionality of CachedResponse in wsgicomm.py
+
+    """
+
+    def testBody(self):
+        "cached response is sent with its entity tag"
+        res = wsgicomm.CachedResponse('[["P", "P/Pdiff"]]', maxage=60)
+        start = StartResponse()
+        body = wsgicomm.send_cached_response({}, res, start)
+
+        self.assertEqual(start.status, '200 OK', 'Wrong status')
+        self.assertEqual(''.join(body), '[["P", "P/Pdiff"]]', 'Wrong body')
+        self.assertEqual(start.headers['ETag'], res.etag, 'Wrong ETag')
+        self.assertEqual(start.headers['Cache-Control'], 'public, max-age=60',
+                         'Wrong Cache-Control')
+        self.assertEqual(start.headers['Content-Length'], '18',
+                         'Wrong Content-Length')
+
+    def testNotModified(self):
+        "matching If-None-Match gets 304 without body"
+        res = wsgicomm.CachedResponse('[]')
+        for header in (res.etag, '"x", ' + res.etag, 'W/' + res.etag, '*'):
+            start = StartResponse()
+            body = wsgicomm.send_cached_response(
+                {'HTTP_IF_NONE_MATCH': header}, res, start)
+            self.assertEqual(start.status, '304 Not Modified',
+                             'Wrong status for %s' % header)
+            self.assertEqual(body, [], 'Body sent for %s' % header)
+
+        start = StartResponse()
+        wsgicomm.send_cached_response({'HTTP_IF_NONE_MATCH': '"x"'}, res,
+                                      start)
+        self.assertEqual(start.status, '200 OK', 'Wrong status')
+
+    def testTag(self):
+        "entity tag depends only on the content"
+        self.assertEqual(wsgicomm.CachedResponse('abc').etag,
+                         wsgicomm.CachedResponse('abc').etag, 'Tags differ')
+        self.assertNotEqual(wsgicomm.CachedResponse('abc').etag,
+                            wsgicomm.CachedResponse('abd').etag, 'Tags equal')
+
+
+class DateEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        return json.JSONEncoder.default(self, obj)
+
+
+class StreamedResponseTests(unittest.TestCase):
+    """Test the functionality of StreamedResponse in wsgicomm.py
+
+    """
+
+    def testJSON(self):
+        "rows serialized in groups as one compact array"
+        for count in (0, 1, 3, 7, 9):
+            rows = [['GE', 'APE', i, 1.5] for i in xrange(count)]
+            parts = list(wsgicomm.iterJSON(iter(rows), chunksize=3))
+            self.assertEqual(json.loads(''.join(parts)), rows,
+                             'Wrong array with %d rows' % count)
+            self.assertTrue(len(parts) <= count // 3 + 3,
+                            'Too many parts with %d rows' % count)
+            self.assertFalse(' ' in ''.join(parts), 'Not compact')
+
+        rows = [(datetime.datetime(2019, 1, 2), 'GE')]
+        self.assertEqual(''.join(wsgicomm.iterJSON(rows, DateEncoder)),
+                         '[["2019-01-02T00:00:00","GE"]]')
+
+    def testLazy(self):
+        "rows produced only when the body is read"
+        produced = []
+
+        def rows():
+            for i in xrange(5):
+                produced.append(i)
+                yield [i]
+
+        res = wsgicomm.StreamedResponse(wsgicomm.iterJSON(rows(),
+                                                          chunksize=2))
+        start = StartResponse()
+        body = iter(wsgicomm.send_streamed_response('200 OK', res, start))
+
+        self.assertEqual(start.status, '200 OK', 'Wrong status')
+        self.assertFalse('Content-Length' in start.headers,
+                         'Length sent in advance')
+        self.assertEqual(produced, [], 'Rows produced before reading')
+
+        self.assertEqual(body.next(), '[[0],[1]')
+        self.assertEqual(produced, [0, 1], 'Rows produced in advance')
+        self.assertEqual(''.join(body), ',[2],[3],[4]]')
+
+
+# ----------------------------------------------------------------------
+def usage():
+    print 'testWSGIComm [-h] [-p]'
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    unittest.main(testRunner=WITestRunner(mode=mode))
@@ -0,0 +1,158 @@
+"""Patterns of stream codes for the Arclink web interface
+
+Network, station, location and channel codes can be selected with lists of
+patterns separated by commas, as in the FDSN web services. A '?' matches
+exactly one character and a '*' any number of them. '--' stands for an
+empty location code.
+
+A pattern is compiled once and then checked against the distinct codes of
+the inventory, which are kept sorted in a CodeTable. Only the codes
+starting with the literal prefix of every pattern are checked, and the
+rows of the codes found are returned without looking at the rest.
+
+"""
+
+import re
+import bisect
+from collections import defaultdict
+
+WILDCARDS = re.compile(r'[?*]')
+
+# Characters allowed in a pattern
+VALID = re.compile(r'^[A-Za-z0-9_?*-]*$')
+
+
+def isPattern(text):
+    """Tell whether a code is a list or has wildcards."""
+    return ',' in text or WILDCARDS.search(text) is not None
+
+
+class CodePattern(object):
+    """List of codes with wildcards, separated by commas.
+
+    Codes without wildcards are compared directly. The rest are translated
+    to regular expressions when the pattern is created. The result of
+    every code checked is kept, so that every distinct code is checked
+    only once.
+
+    """
+
+    def __init__(self, text):
+        # Exact codes, and literal prefix and expression of the rest
+        self.exact = set()
+        self.wildcards = []
+        self.any = False
+
+        for code in text.split(','):
+            code = code.strip()
+            if not VALID.match(code):
+                raise ValueError('Invalid code: %s' % code)
+
+            if code == '--':
+                code = ''
+
+            wildcard = WILDCARDS.search(code)
+            if wildcard is None:
+                self.exact.add(code)
+                continue
+
+            if code.strip('*') == '':
+                self.any = True
+                continue
+
+            regex = ''.join('.' if c == '?' else '.*' if c == '*'
+                            else re.escape(c) for c in code)
+            self.wildcards.append((code[:wildcard.start()],
+                                   re.compile(regex + r'\Z')))
+
+        self.__results = {}
+
+    def match(self, code):
+        """Tell whether a code matches the pattern."""
+        try:
+            return self.__results[code]
+        except KeyError:
+            pass
+
+        result = (self.any or code in self.exact or
+                  any(code.startswith(prefix) and regex.match(code)
+                      for (prefix, regex) in self.wildcards))
+        self.__results[code] = result
+        return result
+
+    def select(self, table):
+        """Return the sorted indexes of the rows of a CodeTable whose code
+        matches the pattern.
+
+        """
+
+        if self.any:
+            return range(table.size)
+
+        codes = set(code for code in self.exact if code in table.rows)
+
+        for (prefix, regex) in self.wildcards:
+            pos = bisect.bisect_left(table.codes, prefix)
+            while pos < len(table.codes) and \
+                    table.codes[pos].startswith(prefix):
+                if regex.match(table.codes[pos]):
+                    codes.add(table.codes[pos])
+                pos += 1
+
+        result = []
+        for code in codes:
+            result.extend(table.rows[code])
+        result.sort()
+        return result
+
+
+class NSLCPattern(object):
+    """Patterns of the network, station, location and channel codes.
+
+    The text has the four patterns separated by dots, e.g. 'G*.*.00.BH?'.
+    The patterns missing at the end match any code.
+
+    """
+
+    def __init__(self, text):
+        parts = text.split('.')
+        if len(parts) > 4:
+            raise ValueError('Invalid pattern: %s' % text)
+
+        parts += ['*'] * (4 - len(parts))
+        (self.network, self.station, self.location, self.channel) = \
+            [CodePattern(part) for part in parts]
+
+        self.__streams = {}
+
+    def matchStream(self, locch):
+        """Tell whether the location and channel codes of a stream (given
+        as 'LOC.CHA') match the pattern.
+
+        """
+
+        try:
+            return self.__streams[locch]
+        except KeyError:
+            pass
+
+        (loc, cha) = locch.split('.', 1)
+        result = self.location.match(loc) and self.channel.match(cha)
+        self.__streams[locch] = result
+        return result
+
+
+class CodeTable(object):
+    """Sorted list of the distinct codes of a column, with the indexes of
+    the rows with every code.
+
+    """
+
+    def __init__(self, codes):
+        self.size = len(codes)
+        self.rows = defaultdict(list)
+        for (i, code) in enumerate(codes):
+            self.rows[code].append(i)
+
+        self.rows = dict(self.rows)
+        self.codes = sorted(self.rows)
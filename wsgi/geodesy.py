@@ -0,0 +1,114 @@
+"""Distances and azimuths for the Arclink web interface
+
+Great-circle distances and azimuths between two sets of points on a
+sphere, computed for all the pairs at once. NumPy is used if it is
+installed. Otherwise, the same values are computed in pure Python.
+
+All angles are in degrees.
+
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def delazi(lat1, lon1, lat2, lon2):
+    """Distance, azimuth and backazimuth between two sets of points.
+
+    Inputs:
+      lat1, lon1: sequences with the coordinates of the first set of points
+      lat2, lon2: sequences with the coordinates of the second set of points
+
+    Returns a tuple (dist, azi, baz) of matrices with one row for every
+    point of the first set and one column for every point of the second
+    set. dist is the spherical distance, azi the azimuth from the point of
+    the first set to the one of the second set and baz the azimuth in the
+    opposite direction, in the range [0, 360).
+
+    The matrices are NumPy arrays if NumPy is available and lists of lists
+    otherwise. Both are indexed as dist[i][j].
+
+    >>> (dist, azi, baz) = delazi([0.0], [0.0], [0.0, 90.0], [90.0, 0.0])
+    >>> [round(x, 6) for x in dist[0]]
+    [90.0, 90.0]
+    >>> [round(x, 6) for x in azi[0]]
+    [90.0, 0.0]
+    >>> [round(x, 6) for x in baz[0]]
+    [270.0, 180.0]
+
+    """
+
+    if numpy is not None:
+        return _delaziNumPy(lat1, lon1, lat2, lon2)
+
+    return _delaziPython(lat1, lon1, lat2, lon2)
+
+
+def _delaziNumPy(lat1, lon1, lat2, lon2):
+    p1 = numpy.radians(numpy.asarray(lat1, dtype=float))[:, numpy.newaxis]
+    l1 = numpy.radians(numpy.asarray(lon1, dtype=float))[:, numpy.newaxis]
+    p2 = numpy.radians(numpy.asarray(lat2, dtype=float))[numpy.newaxis, :]
+    l2 = numpy.radians(numpy.asarray(lon2, dtype=float))[numpy.newaxis, :]
+
+    sp1 = numpy.sin(p1)
+    cp1 = numpy.cos(p1)
+    sp2 = numpy.sin(p2)
+    cp2 = numpy.cos(p2)
+    sdl = numpy.sin(l2 - l1)
+    cdl = numpy.cos(l2 - l1)
+
+    # Components of the direction to the other point, seen from each point
+    north1 = cp1 * sp2 - sp1 * cp2 * cdl
+    east1 = sdl * cp2
+    north2 = cp2 * sp1 - sp2 * cp1 * cdl
+    east2 = -sdl * cp1
+    up = sp1 * sp2 + cp1 * cp2 * cdl
+
+    dist = numpy.degrees(numpy.arctan2(numpy.hypot(north1, east1), up))
+    azi = numpy.degrees(numpy.arctan2(east1, north1)) % 360.0
+    baz = numpy.degrees(numpy.arctan2(east2, north2)) % 360.0
+
+    return (dist, azi, baz)
+
+
+def _delaziPython(lat1, lon1, lat2, lon2):
+    points2 = [(math.sin(math.radians(p)), math.cos(math.radians(p)),
+                math.radians(l)) for (p, l) in zip(lat2, lon2)]
+
+    dist = []
+    azi = []
+    baz = []
+    for (p, l) in zip(lat1, lon1):
+        sp1 = math.sin(math.radians(p))
+        cp1 = math.cos(math.radians(p))
+        l1 = math.radians(l)
+
+        rowDist = []
+        rowAzi = []
+        rowBaz = []
+        for (sp2, cp2, l2) in points2:
+            sdl = math.sin(l2 - l1)
+            cdl = math.cos(l2 - l1)
+
+            # Components of the direction to the other point, seen from each
+            # point
+            north1 = cp1 * sp2 - sp1 * cp2 * cdl
+            east1 = sdl * cp2
+            north2 = cp2 * sp1 - sp2 * cp1 * cdl
+            east2 = -sdl * cp1
+            up = sp1 * sp2 + cp1 * cp2 * cdl
+
+            rowDist.append(math.degrees(math.atan2(math.hypot(north1, east1),
+                                                   up)))
+            rowAzi.append(math.degrees(math.atan2(east1, north1)) % 360.0)
+            rowBaz.append(math.degrees(math.atan2(east2, north2)) % 360.0)
+
+        dist.append(rowDist)
+        azi.append(rowAzi)
+        baz.append(rowBaz)
+
+    return (dist, azi, baz)
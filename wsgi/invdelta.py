@@ -0,0 +1,235 @@
+"""Differences between versions of the inventory for the Arclink web interface
+
+update-metadata.py compares the inventory it has just built with the
+previous one and saves the differences in a small file next to the cache.
+The web interface uses them to update the indexes of the inventory it
+already has in memory, instead of building all of them again.
+
+The rows of both versions are matched by their key: code and start of a
+network; network, code and start of a station; station and code of a
+sensor location; sensor location, code and start of a stream. A row with
+the same key in both versions but other attributes (e.g. a new end of the
+epoch) is considered to be changed.
+
+"""
+
+import os
+import cPickle as pickle
+from array import array
+
+
+# Version of the format of the file with the differences
+VERSION = 1
+
+# Attributes compared to decide whether a row has changed. The pointers to
+# other rows are not included, because they change whenever rows are added
+# or removed before them.
+ATTRIBUTES = {'networks': ('end', 'description', 'restricted', 'netclass',
+                           'archive', 'institutions'),
+              'stations': ('latitude', 'longitude', 'description', 'end',
+                           'elevation', 'restricted'),
+              'sensorsLoc': (),
+              'streams': ('sensortype', 'denominator', 'numerator',
+                          'datalogger', 'end', 'restricted')}
+
+
+class TableDelta(object):
+    """Differences between two versions of one of the inventory tables.
+
+    mapping has the position in the new version of every row of the old
+    one (-1 for the rows removed). added and changed are the sorted
+    positions in the new version of the rows which did not exist before
+    and of the ones whose attributes are different.
+
+    """
+
+    def __init__(self, mapping, added, changed):
+        self.mapping = mapping
+        self.added = added
+        self.changed = changed
+
+    def __getstate__(self):
+        return (self.mapping.tostring(), self.added, self.changed)
+
+    def __setstate__(self, state):
+        self.mapping = array('i')
+        self.mapping.fromstring(state[0])
+        (self.added, self.changed) = state[1:]
+
+    @property
+    def removed(self):
+        """Positions in the old version of the rows removed."""
+        return [i for (i, j) in enumerate(self.mapping) if j < 0]
+
+    def unchanged(self):
+        """Return True if the table is the same in both versions."""
+        if self.added or self.changed:
+            return False
+
+        for (i, j) in enumerate(self.mapping):
+            if i != j:
+                return False
+
+        return True
+
+    def kept(self):
+        """Return the new position of the rows of the old version which
+        have not changed, with -1 for the rows removed or changed.
+
+        """
+
+        kept = array('i', self.mapping)
+        if self.changed:
+            changed = set(self.changed)
+            for (i, j) in enumerate(kept):
+                if j in changed:
+                    kept[i] = -1
+        return kept
+
+    def renewed(self):
+        """Return the sorted positions of the rows added or changed."""
+        return sorted(self.added + self.changed)
+
+
+class InventoryDelta(object):
+    """Differences between two versions of the inventory.
+
+    versions has, for the name of every file of the cache, the hashes of
+    its content before and after the changes. There is a TableDelta for
+    every table of the inventory.
+
+    """
+
+    def __init__(self, networks, stations, sensorsLoc, streams,
+                 versions=None):
+        self.networks = networks
+        self.stations = stations
+        self.sensorsLoc = sensorsLoc
+        self.streams = streams
+        self.versions = versions if versions is not None else {}
+
+    def applies(self, filename, base, version):
+        """Return True if the delta updates the version base of a file of
+        the cache to the version given.
+
+        """
+
+        return self.versions.get(os.path.basename(filename)) == \
+            (base, version)
+
+
+def _unique(keys):
+    """Number the repeated keys, so that every row has a different one."""
+    seen = {}
+    result = []
+    for key in keys:
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        result.append((key, count))
+    return result
+
+
+def _keys(networks, stations, sensorsLoc, streams):
+    """Keys of the rows of the four tables."""
+    netKeys = _unique((netw.code, netw.start) for netw in networks)
+    staKeys = _unique((netKeys[stat.network], stat.code, stat.start)
+                      for stat in stations)
+    locKeys = _unique((staKeys[loc.station], loc.code)
+                      for loc in sensorsLoc)
+    strKeys = _unique((locKeys[strm.sensorLoc], strm.code, strm.start)
+                      for strm in streams)
+    return (netKeys, staKeys, locKeys, strKeys)
+
+
+def _encode(value):
+    # Strings read from the columnar format are always encoded in UTF-8
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _values(name, table, staKeys):
+    """Attributes of the rows of a table which are compared."""
+    attributes = ATTRIBUTES[name]
+    result = [tuple(_encode(getattr(row, attr)) for attr in attributes)
+              for row in table]
+
+    # The members of a virtual network are compared by their keys
+    if name == 'networks':
+        for (i, netw) in enumerate(table):
+            if netw.children is not None:
+                result[i] += (tuple(sorted(staKeys[s]
+                                           for s in netw.children)),)
+
+    return result
+
+
+def _diffTable(oldKeys, oldValues, newKeys, newValues):
+    positions = dict((key, i) for (i, key) in enumerate(oldKeys))
+
+    mapping = array('i', [-1]) * len(oldKeys)
+    added = []
+    changed = []
+    for (j, key) in enumerate(newKeys):
+        i = positions.get(key)
+        if i is None:
+            added.append(j)
+            continue
+
+        mapping[i] = j
+        if oldValues[i] != newValues[j]:
+            changed.append(j)
+
+    return TableDelta(mapping, added, changed)
+
+
+def diff(old, new):
+    """Compare two versions of the inventory.
+
+    Both are tuples with the tables of networks, stations, sensor locations
+    and streams, as lists of records or as the tables of a
+    ColumnarInventory. An InventoryDelta without versions is returned.
+
+    """
+
+    old = [list(table) for table in old]
+    new = [list(table) for table in new]
+    oldKeys = _keys(*old)
+    newKeys = _keys(*new)
+
+    tables = []
+    for (pos, name) in enumerate(('networks', 'stations', 'sensorsLoc',
+                                  'streams')):
+        tables.append(_diffTable(oldKeys[pos],
+                                 _values(name, old[pos], oldKeys[1]),
+                                 newKeys[pos],
+                                 _values(name, new[pos], newKeys[1])))
+
+    return InventoryDelta(*tables)
+
+
+def write(filename, delta):
+    """Save the differences between two versions of the inventory.
+
+    The file is written under a temporary name and then renamed, so that
+    nobody reads an incomplete version.
+
+    """
+
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as fout:
+        os.chmod(tmpfile, 0o0664)
+        pickle.dump((VERSION, delta), fout, pickle.HIGHEST_PROTOCOL)
+
+    os.rename(tmpfile, filename)
+
+
+def load(filename):
+    """Read the differences between two versions of the inventory."""
+    with open(filename, 'rb') as fin:
+        (version, delta) = pickle.load(fin)
+
+    if version != VERSION:
+        raise ValueError('unsupported version %s of %s' % (version, filename))
+
+    return delta
@@ -34,18 +34,376 @@ import datetime
 import os
 ###import tempfile
 import math
+import threading
 import cPickle as pickle
 import xml.etree.cElementTree as ET
 import json
+import bisect
 from collections import defaultdict
 
 import wsgicomm
+import invformat
+import invindex
+import invdelta
+import invsqlite
+import invsegment
+import geodesy
+import codepattern
 from seiscomp import logs
-import seiscomp3.Math as Math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 ###tempdir = tempfile.gettempdir()
 
 
+class snapshotIndex(object):
+    """Attribute of a snapshot which is built the first time it is used.
+
+    The value is stored in the instance and hides the descriptor afterwards.
+
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = self.func(obj)
+        obj.__dict__[self.__name__] = value
+        return value
+
+
+class InventorySnapshot(object):
+    """Immutable version of the inventory used to answer the queries.
+
+    The data of a snapshot is never modified after its creation. Only its
+    indexes are added, when they are first needed (see snapshotIndex). When
+    the cache file changes, a new snapshot is built and replaces the old
+    one, while the queries which already started keep working with the old
+    one.
+
+    """
+
+    def __init__(self, inventory, filename, version):
+        # Inventory in columnar format
+        self.inventory = inventory
+
+        self.networks = inventory.networks
+        self.stations = inventory.stations
+        self.sensorsLoc = inventory.sensorsLoc
+        self.streams = inventory.streams
+
+        # File from which the snapshot was read and the hash of its content
+        self.filename = filename
+        self.version = version
+
+    def prepare(self):
+        """Build all the indexes of the snapshot in advance."""
+        for name in dir(type(self)):
+            if isinstance(getattr(type(self), name), snapshotIndex):
+                getattr(self, name)
+
+    def adopt(self, previous, delta):
+        """Take the indexes of the previous snapshot, updated with the
+        differences between both versions of the inventory.
+
+        Only the indexes already built in the previous snapshot are
+        updated, and only if the delta allows it. The rest are built on
+        demand as usual. The previous snapshot is not modified, so that the
+        queries using it are not affected.
+
+        """
+
+        built = previous.__dict__
+        networks = delta.networks
+        stations = delta.stations
+        streams = delta.streams
+
+        keptStations = stations.kept()
+        renewedStations = stations.renewed()
+
+        if 'stationGrid' in built:
+            self.stationGrid = built['stationGrid'].updated(
+                self.stations.column('latitude'),
+                self.stations.column('longitude'),
+                keptStations, renewedStations)
+
+        if 'stationTree' in built:
+            self.stationTree = built['stationTree'].updated(
+                self.stations.column('latitude'),
+                self.stations.column('longitude'),
+                keptStations, renewedStations)
+
+        if 'stationEpochIndex' in built:
+            self.stationEpochIndex = built['stationEpochIndex'].updated(
+                self.stations.column('start'), self.stations.column('end'),
+                invformat.NONE_EPOCH, keptStations, renewedStations)
+
+        if 'streamEpochIndex' in built:
+            self.streamEpochIndex = built['streamEpochIndex'].updated(
+                self.streams.column('start'), self.streams.column('end'),
+                invformat.NONE_EPOCH, streams.kept(), streams.renewed())
+
+        ptNets = self.networks
+        if 'stationsByCode' in built:
+            result = invindex.remapIndexes(built['stationsByCode'],
+                                           keptStations)
+            keys = set()
+            for s in renewedStations:
+                stat = self.stations[s]
+                key = (ptNets[stat.network].code, stat.code)
+                result.setdefault(key, []).append(s)
+                keys.add(key)
+
+            for key in keys:
+                result[key].sort()
+            self.stationsByCode = result
+
+        # The keys include the epoch of the network
+        if 'stationsByKey' in built and not networks.changed:
+            result = invindex.remapIndexes(built['stationsByKey'],
+                                           keptStations)
+            keys = set()
+            for s in renewedStations:
+                stat = self.stations[s]
+                netw = ptNets[stat.network]
+                key = '%s-%s-%s-%s' % (netw.code, netw.start, netw.end,
+                                       stat.code)
+                result.setdefault(key, []).append(s)
+                keys.add(key)
+
+            for key in keys:
+                result[key].sort()
+            self.stationsByKey = result
+
+        # The pairs include the index of the network and the children of the
+        # virtual networks
+        if 'childrenByCode' in built and networks.unchanged():
+            result = {}
+            for (key, pairs) in built['childrenByCode'].iteritems():
+                pairs = [(i, keptStations[s]) for (i, s) in pairs
+                         if keptStations[s] >= 0]
+                if pairs:
+                    result[key] = pairs
+
+            parents = self.virtualParents
+            for s in renewedStations:
+                stat = self.stations[s]
+                for i in [stat.network] + parents.get(s, []):
+                    result.setdefault((ptNets[i].code, stat.code),
+                                      []).append((i, s))
+
+            for pairs in result.itervalues():
+                pairs.sort()
+            self.childrenByCode = result
+
+    @snapshotIndex
+    def networkBits(self):
+        """Sets of networks with the same attributes."""
+        return invindex.NetworkBits(self.networks)
+
+    @snapshotIndex
+    def stationGrid(self):
+        """Spatial grid with the coordinates of the stations."""
+        return invindex.SpatialGrid(self.stations.column('latitude'),
+                                    self.stations.column('longitude'))
+
+    @snapshotIndex
+    def virtualParents(self):
+        """Indexes of the virtual networks including every station."""
+        parents = defaultdict(list)
+        for i, netw in enumerate(self.networks):
+            if (netw.first is None) or (netw.last is None):
+                for s in netw.children:
+                    parents[s].append(i)
+        return dict(parents)
+
+    @snapshotIndex
+    def stationsByCode(self):
+        """Indexes of the epochs of every station by network/station code."""
+        ptNets = self.networks
+        result = defaultdict(list)
+        for s, stat in enumerate(self.stations):
+            result[(ptNets[stat.network].code, stat.code)].append(s)
+        return dict(result)
+
+    @snapshotIndex
+    def networksByKey(self):
+        """Index of the first network with every code, start and end."""
+        result = {}
+        for i, netw in enumerate(self.networks):
+            result.setdefault((netw.code, netw.start, netw.end), i)
+        return result
+
+    @snapshotIndex
+    def stationsByKey(self):
+        """Indexes of the stations by key (NET-START-END-STA).
+
+        The key is built with the real network of the station.
+
+        """
+        ptNets = self.networks
+        result = defaultdict(list)
+        for s, stat in enumerate(self.stations):
+            netw = ptNets[stat.network]
+            result['%s-%s-%s-%s' % (netw.code, netw.start, netw.end,
+                                    stat.code)].append(s)
+        return dict(result)
+
+    @snapshotIndex
+    def childrenByCode(self):
+        """Pairs of network and station indexes by network/station code.
+
+        Virtual networks are included. The pairs follow the order of the
+        networks and their children.
+
+        """
+        ptStats = self.stations
+        result = defaultdict(list)
+        for i, netw in enumerate(self.networks):
+            # A normal network has pointers to first and last child
+            if (netw.first is not None) and (netw.last is not None):
+                children = xrange(netw.first, netw.last)
+            # A virtual network has a list of children
+            else:
+                children = netw.children
+
+            for s in children:
+                result[(netw.code, ptStats[s].code)].append((i, s))
+        return dict(result)
+
+    @snapshotIndex
+    def networkCodes(self):
+        """Sorted codes of the networks, to select them by patterns."""
+        return codepattern.CodeTable([netw.code for netw in self.networks])
+
+    @snapshotIndex
+    def stationCodes(self):
+        """Sorted codes of the stations, to select them by patterns."""
+        strings = self.inventory.strings
+        return codepattern.CodeTable([strings[ref] for ref in
+                                      self.stations.column('code')])
+
+    @snapshotIndex
+    def stationEpochIndex(self):
+        """Index of the epochs of the stations."""
+        return invindex.EpochIndex(self.stations.column('start'),
+                                   self.stations.column('end'),
+                                   invformat.NONE_EPOCH)
+
+    @snapshotIndex
+    def streamEpochIndex(self):
+        """Index of the epochs of the streams."""
+        return invindex.EpochIndex(self.streams.column('start'),
+                                   self.streams.column('end'),
+                                   invformat.NONE_EPOCH)
+
+    @snapshotIndex
+    def streamSummaries(self):
+        """Summaries of the streams of every station."""
+        return invindex.StreamSummaries(self.inventory)
+
+    @snapshotIndex
+    def networkBandCounts(self):
+        """Band code counts of the streams of every network."""
+        return invindex.NetworkBandCounts(self.inventory,
+                                          self.streamSummaries)
+
+    @snapshotIndex
+    def stationTree(self):
+        """k-d tree with the positions of the stations."""
+        return invindex.UnitVectorTree(self.stations.column('latitude'),
+                                       self.stations.column('longitude'))
+
+
+class SqliteSnapshot(InventorySnapshot):
+    """Snapshot of an inventory in a SQLite database.
+
+    The indexes of the stations and streams are the ones of the database,
+    so they are not built in memory by every process. Only the small
+    indexes of the networks and the summaries of the streams of the
+    stations used are kept.
+
+    """
+
+    def adopt(self, previous, delta):
+        """Nothing to update, the indexes are always the ones of the
+        database.
+
+        """
+
+        pass
+
+    @snapshotIndex
+    def stationGrid(self):
+        """R*Tree with the coordinates of the stations."""
+        return invsqlite.BoxIndex(self.inventory)
+
+    @snapshotIndex
+    def virtualParents(self):
+        """Indexes of the virtual networks including every station."""
+        return invsqlite.VirtualParents(self.inventory)
+
+    @snapshotIndex
+    def stationsByCode(self):
+        """Indexes of the epochs of every station by network/station code."""
+        return invsqlite.StationsByCode(self.inventory)
+
+    @snapshotIndex
+    def stationsByKey(self):
+        """Indexes of the stations by key (NET-START-END-STA)."""
+        return invsqlite.StationsByKey(self.inventory)
+
+    @snapshotIndex
+    def childrenByCode(self):
+        """Pairs of network and station indexes by network/station code."""
+        return invsqlite.ChildrenByCode(self.inventory)
+
+    @snapshotIndex
+    def stationEpochIndex(self):
+        """Index of the epochs of the stations."""
+        return invsqlite.EpochIndex(self.inventory, 'stations')
+
+    @snapshotIndex
+    def streamEpochIndex(self):
+        """Index of the epochs of the streams."""
+        return invsqlite.EpochIndex(self.inventory, 'streams')
+
+    @snapshotIndex
+    def stationTree(self):
+        """Stations close to a point, found with the R*Tree."""
+        return invsqlite.DistanceIndex(self.inventory)
+
+
+class SegmentedSnapshot(InventorySnapshot):
+    """Snapshot of an inventory in segmented format.
+
+    The indexes of the networks and stations are built in memory from the
+    directory of the inventory. The streams are only read from the
+    segments of the stations used, so there is no index of all of them.
+
+    """
+
+    def adopt(self, previous, delta):
+        """Nothing to update, the differences are not saved for the
+        segmented format.
+
+        """
+
+        pass
+
+    @snapshotIndex
+    def streamEpochIndex(self):
+        """Epochs of the streams, checked in their segments."""
+        return invsegment.EpochIndex(self.streams)
+
+
 class InventoryCache(object):
     """Encapsulate and manage the information of networks,
     stations, locations and streams read from an Arclink XML file inventory.
@@ -54,22 +412,66 @@ class InventoryCache(object):
 
     """
 
-    def __init__(self, inventory):
+    def __init__(self, inventory, backend='columnar',
+                 segmentSize=invsegment.MAXSIZE):
         # Arclink inventory file in XML format
         self.inventory = inventory
 
+        # Storage of the inventory: 'columnar' (the columnar or pickled
+        # version loaded by every process), 'sqlite' (a database queried
+        # by all of them) or 'segmented' (the streams of every network read
+        # when first needed)
+        if backend not in ('columnar', 'sqlite', 'segmented'):
+            logs.error('Unknown backend of the inventory: %s' % backend)
+            backend = 'columnar'
+        self.backend = backend
+
         # Temporary file to store the internal representation of the cache
         # in pickle format
         ###self.cachefile = os.path.join(tempdir, 'webinterface-cache.bin')
         self.cachefile = os.path.join(os.path.dirname(inventory),
                                       'webinterface-cache.bin')
 
-        # Set how often the cache should be updated (in seconds)
+        # Same information in columnar format. If present, it is mapped in
+        # memory and shared by all the processes.
+        self.columnarfile = os.path.join(os.path.dirname(inventory),
+                                         'webinterface-cache.col')
+
+        # Same information in a SQLite database, used with the sqlite
+        # backend
+        self.sqlitefile = os.path.join(os.path.dirname(inventory),
+                                       'webinterface-cache.sqlite')
+
+        # Same information in segmented format, used with the segmented
+        # backend, and the maximum size of the segments kept in memory (in
+        # bytes)
+        self.segmentfile = os.path.join(os.path.dirname(inventory),
+                                        'webinterface-cache.seg')
+        self.segmentSize = segmentSize
+
+        # Differences between the last two versions of the cache, written
+        # by update-metadata.py
+        self.deltafile = os.path.join(os.path.dirname(inventory),
+                                      'webinterface-cache.delta')
+
+        # Set how often the cache file should be checked for changes
+        # (in seconds)
         self.time2refresh = 3600.0
 
         # Fake date to force an update the first time
         self.lastUpdated = datetime.datetime(2000, 1, 1)
 
+        # Current snapshot of the inventory and a lock to allow only one
+        # reload at a time
+        self.snapshot = None
+        self.__reloading = threading.Lock()
+
+        # Cache file and modification time last checked by __reload
+        self.__checked = None
+
+        # Whether the current snapshot is kept for good (see freeze)
+        self.__frozen = False
+
         # Types of network. The columns are:
         # CODE, DESCRIPTION, PERMANENT, RESTRICTED (1: True; 2: False)
         self.nettypes = [("all", "All nets", None, None),
@@ -83,6 +485,10 @@ class InventoryCache(object):
                          ("permr", "Non-public permanent nets", True, 1),
                          ("tempr", "Non-public temporary nets", False, 1)]
 
+        # Network types by code
+        self.__nettypeByCode = dict((nettype[0], nettype)
+                                    for nettype in self.nettypes)
+
         # List of sensor types
         # Multiple sensortypes in the same line should be separated by space.
         self.senstypes = [('all', 'Any'),
@@ -101,26 +507,6 @@ class InventoryCache(object):
         # Create/load the cache the first time that we start
         self.update()
 
-    def __indexStreams(self):
-        self.streamidx = {}
-
-        for stream in self.streams:
-            sensorLoc = self.sensorsLoc[stream[0]]
-            station = self.stations[sensorLoc[0]]
-            network = self.networks[station[0]]
-
-            # (net,sta,cha,loc)
-            key = (network[0], station[4], stream[1], sensorLoc[4])
-
-            try:
-                obj = self.streamidx[key]
-
-            except KeyError:
-                obj = []
-                self.streamidx[key] = obj
-
-            obj.append(stream)
-
     def update(self):
         """Read the inventory file in XML format and store it in memory.
 
@@ -134,8 +520,21 @@ class InventoryCache(object):
         dump of the generated structures, avoiding the time invested in
         the construction.
 
+        The columnar version of the cache is preferred, because it is mapped
+        in memory instead of being loaded. If it is not available, the
+        pickled version is read and converted to the same format. With the
+        sqlite backend, the SQLite version is used if it is available, and
+        with the segmented backend, the segmented one.
+
+        The first time, the inventory is loaded before returning. Afterwards,
+        the new version is loaded by a background thread and replaces the
+        current snapshot once it is complete.
+
         """
 
+        if self.__frozen:
+            return
+
         # Calculate when the next update should take place
         nextUpdate = self.lastUpdated + datetime.timedelta(
             seconds=self.time2refresh)
@@ -144,22 +543,217 @@ class InventoryCache(object):
         if nextUpdate > datetime.datetime.now():
             return
 
-        # Initialize lists
-        self.networks = []
-        self.stations = []
-        self.sensorsLoc = []
-        self.streams = []
+        # Only one reload at a time
+        if not self.__reloading.acquire(False):
+            return
+
         self.lastUpdated = datetime.datetime.now()
 
-        with open(self.cachefile) as cache:
-            (self.networks, self.stations, self.sensorsLoc,
-             self.streams, self.streamidx) = pickle.load(cache)
-            logs.info('Inventory loaded from pickle version')
+        if self.snapshot is None:
+            try:
+                self.__reload()
+            finally:
+                self.__reloading.release()
             return
 
+        thread = threading.Thread(target=self.__backgroundReload,
+                                  name='InventoryCache reload')
+        thread.daemon = True
+        thread.start()
+
+    def whileNotReloading(self, func):
+        """Call func while no reload is running, e.g. to fork processes
+        which get a copy of the inventory.
+
+        A reload in progress is waited for. The indexes of the current
+        snapshot are built before, so that the processes share them.
+        Returns the version of the snapshot and the result of func.
+
+        """
+
+        with self.__reloading:
+            snapshot = self.snapshot
+            snapshot.prepare()
+            return (snapshot.version, func())
+
+    def freeze(self):
+        """Keep the current snapshot for good, e.g. in a process forked
+        with whileNotReloading, which must answer with the same version of
+        the inventory as its parent.
+
+        """
+
+        self.__frozen = True
+
+    def __backgroundReload(self):
+        try:
+            self.__reload()
+        except Exception as e:
+            logs.error('Error reloading the inventory: %s' % e)
+        finally:
+            self.__reloading.release()
+
+    def __reload(self):
+        """Build a new snapshot if the cache file has changed.
+
+        The file is considered to be changed if its modification time is
+        different and also the hash of its content. If update-metadata.py
+        saved the differences between the version of the current snapshot
+        and the new one, the indexes are updated instead of built again.
+
+        """
+
+        if self.backend == 'sqlite' and os.path.exists(self.sqlitefile):
+            filename = self.sqlitefile
+        elif (self.backend == 'segmented' and
+              os.path.exists(self.segmentfile)):
+            filename = self.segmentfile
+        elif os.path.exists(self.columnarfile):
+            filename = self.columnarfile
+        else:
+            filename = self.cachefile
+
+        mtime = os.path.getmtime(filename)
+        current = self.snapshot
+
+        if current is not None and self.__checked == (filename, mtime):
+            return
+
+        version = invformat.fileHash(filename)
+        if (current is not None and current.filename == filename and
+                current.version == version):
+            self.__checked = (filename, mtime)
+            return
+
+        if filename == self.sqlitefile:
+            try:
+                inventory = invsqlite.load(filename)
+                logs.info('Inventory opened from SQLite version')
+            except (IOError, ValueError) as e:
+                logs.error('Error reading %s: %s' % (filename, e))
+                filename = self.columnarfile
+                if not os.path.exists(filename):
+                    filename = self.cachefile
+                mtime = os.path.getmtime(filename)
+                version = invformat.fileHash(filename)
+
+        if filename == self.segmentfile:
+            try:
+                inventory = invsegment.load(filename, self.segmentSize)
+                logs.info('Inventory opened from segmented version')
+            except (IOError, ValueError) as e:
+                logs.error('Error reading %s: %s' % (filename, e))
+                filename = self.columnarfile
+                if not os.path.exists(filename):
+                    filename = self.cachefile
+                mtime = os.path.getmtime(filename)
+                version = invformat.fileHash(filename)
+
+        if filename == self.columnarfile:
+            try:
+                inventory = invformat.load(filename)
+                logs.info('Inventory mapped from columnar version')
+            except (IOError, ValueError) as e:
+                logs.error('Error reading %s: %s' % (filename, e))
+                filename = self.cachefile
+                mtime = os.path.getmtime(filename)
+                version = invformat.fileHash(filename)
+
+        if filename == self.cachefile:
+            with open(filename) as cache:
+                (networks, stations, sensorsLoc,
+                 streams, streamidx) = pickle.load(cache)
+
+            # Caches written by old versions of update-metadata.py have
+            # lists instead of records
+            if networks and isinstance(networks[0], list):
+                (networks, stations, sensorsLoc, streams) = \
+                    invformat.fromLegacy(networks, stations, sensorsLoc,
+                                         streams)
+
+            inventory = invformat.ColumnarInventory(
+                invformat.pack(networks, stations, sensorsLoc, streams))
+            logs.info('Inventory loaded from pickle version')
+
+        if filename == self.sqlitefile:
+            snapshot = SqliteSnapshot(inventory, filename, version)
+        elif filename == self.segmentfile:
+            snapshot = SegmentedSnapshot(inventory, filename, version)
+        else:
+            snapshot = InventorySnapshot(inventory, filename, version)
+
+        delta = None
+        if current is not None:
+            delta = self.__loadDelta(filename, current.version, version)
+
+        # The first time the indexes are built on demand to start faster.
+        # Afterwards, they are ready before the new snapshot is used. The
+        # ones of the current snapshot are reused if the differences with
+        # the new version are known.
+        if current is not None:
+            if delta is not None:
+                snapshot.adopt(current, delta)
+                logs.info('Indexes of the inventory updated with %s' %
+                          self.deltafile)
+            snapshot.prepare()
+
+        # Replacing the reference is atomic. Queries in progress keep their
+        # own reference to the previous snapshot.
+        self.snapshot = snapshot
+        self.__checked = (filename, mtime)
+
+    def __loadDelta(self, filename, base, version):
+        """Return the differences between two versions of a cache file.
+
+        None is returned if they are not available, e.g. because the
+        current snapshot is older than the previous run of
+        update-metadata.py. In that case the inventory is loaded again from
+        scratch.
+
+        """
+
+        if not os.path.exists(self.deltafile):
+            return None
+
+        try:
+            delta = invdelta.load(self.deltafile)
+        except Exception as e:
+            logs.error('Error reading %s: %s' % (self.deltafile, e))
+            return None
+
+        if not delta.applies(filename, base, version):
+            return None
+
+        return delta
+
+    def __current(self):
+        """Return the snapshot to use for a query."""
+        self.update()
+        return self.snapshot
+
+    @property
+    def version(self):
+        """Hash of the current version of the inventory."""
+        return self.__current().version
+
+    @property
+    def networks(self):
+        return self.snapshot.networks
+
+    @property
+    def stations(self):
+        return self.snapshot.stations
+
+    @property
+    def sensorsLoc(self):
+        return self.snapshot.sensorsLoc
+
+    @property
+    def streams(self):
+        return self.snapshot.streams
 
     # Method to select networks from the parameters passed
-    def __selectNetworks(self, params):
+    def __selectNetworks(self, snap, params):
         """Select networks filtered by the input parameters.
 
         A list of indices is returned. These indices indicate the networks
@@ -167,10 +761,6 @@ class InventoryCache(object):
 
         """
 
-        if (self.lastUpdated + datetime.timedelta(seconds=self.time2refresh) <
-           datetime.datetime.now()):
-            self.update()
-
         # Check parameters
         # Start year of the period in which the network should contain data
         if 'start' in params:
@@ -210,14 +800,13 @@ class InventoryCache(object):
             if networktype is None:
                 raise Exception
 
-            for nettype in self.nettypes:
-                if networktype == nettype[0]:
-                    permanent = nettype[2]
-                    restricted = nettype[3]
-                    break
-            else:
+            nettype = self.__nettypeByCode.get(networktype)
+            if nettype is None:
                 return set()
 
+            permanent = nettype[2]
+            restricted = nettype[3]
+
         except:
             networktype = None
             permanent = None
@@ -231,82 +820,61 @@ class InventoryCache(object):
         except:
             network = None
 
-        # Filter and save indexes of networks in netsOK
-        netsOK = set()
-        for i, netw in enumerate(self.networks):
-            # If there is a network selected look only at the codes
-            if network:
-                try:
-                    # Extract the three parts of the network parameter
-                    (netcode, netstart, netend) = network.split('-')
-                    netstart = int(netstart)
-                    if netend == 'None':
-                        netend = None
-                    else:
-                        netend = int(netend)
-
-                    # If any of the three parts does not coincide with the
-                    # current network, skip it
-                    if((netcode != netw[0]) or (netstart != netw[4]) or
-                       (netend != netw[5])):
-                        continue
-                    else:
-                        # Once I found the code, insert it in the lists and
-                        # leave the loop
-                        netsOK.add(i)
-                        break
-
-                except:
-                    continue
+        # If there is a network selected look only at the codes
+        if network:
+            try:
+                # Extract the three parts of the network parameter
+                (netcode, netstart, netend) = network.split('-')
+                netstart = int(netstart)
+                if netend == 'None':
+                    netend = None
+                else:
+                    netend = int(netend)
+            except:
+                return set()
 
-            # Discard if start is after the end of the network operation
-            if start and netw[5]:
-                if netw[5] < start:
-                    continue
+            i = snap.networksByKey.get((netcode, netstart, netend))
+            return set() if i is None else set([i])
 
-            # Discard if end is before the start of the network operation
-            if end and netw[4]:
-                if end < netw[4]:
-                    continue
+        # Sets of networks with every attribute
+        bits = snap.networkBits
+        netsOK = bits.all
 
-            # Discard if the restricted attribute is not the same
-            if restricted is not None:
-                if netw[7] != restricted:
-                    continue
+        # Discard if start is after the end of the network operation
+        if start:
+            netsOK &= ~bits.endingBefore(start)
 
-            # Discard if the netClass/permanent attribute is not the same
-            if permanent is not None:
-                if permanent and (netw[8] == 't'):
-                    continue
+        # Discard if end is before the start of the network operation
+        if end:
+            netsOK &= ~bits.startingAfter(end)
 
-                if (not permanent) and (netw[8] == 'p'):
-                    continue
+        # Discard if the restricted attribute is not the same
+        if restricted is not None:
+            netsOK &= bits.restricted.get(restricted, 0)
 
-            # Virtual networks have no pointers to first child (1) and last
-            # child (2). They have a list of childs (3)
-            if networktype == 'virt':
-                if ((netw[1] is not None) or (netw[2] is not None)):
-                    continue
+        # Discard if the netClass/permanent attribute is not the same
+        if permanent is not None:
+            if permanent:
+                netsOK &= ~bits.netclass.get('t', 0)
+            else:
+                netsOK &= ~bits.netclass.get('p', 0)
 
-            # All checks have been done, so add the network index to the list
-            netsOK.add(i)
+        # Virtual networks have no pointers to first child (1) and last
+        # child (2). They have a list of childs (3)
+        if networktype == 'virt':
+            netsOK &= bits.virtual
 
-        return netsOK
+        return set(invindex.bitIndexes(netsOK))
 
-    def __selectStations(self, params):
-        """Select stations filtered by the input parameters.
+    def __selectPeriod(self, params):
+        """Select the period given by the start and end years in params.
 
-        Returns a set of indexes. These indexes indicate the
-        stations that satisfy the constraints indicated by the
-        input parameters.
+        Returns a tuple (start, end) with the limits in seconds since 1970
+        (as used by the epoch indexes of the snapshot) or None if no year
+        was given.
 
         """
 
-        if (self.lastUpdated + datetime.timedelta(seconds=self.time2refresh) <
-           datetime.datetime.now()):
-            self.update()
-
-        # Check parameters
         # Start year of the period in which the network should contain data
         try:
             start = datetime.datetime(int(params.get('start')), 1, 1, 0, 0, 0)
@@ -320,19 +888,60 @@ class InventoryCache(object):
             end = None
 
         # With any of these parameters I need to filter on time range
-        if start or end:
-            # Default values in case they are not provided
-            if start is None:
-                start = datetime.datetime(1900, 1, 1, 0, 0, 0)
+        if not (start or end):
+            return None
 
-            if end is None:
-                end = datetime.datetime.now()
+        # Default values in case they are not provided
+        if start is None:
+            start = datetime.datetime(1900, 1, 1, 0, 0, 0)
 
-            # Swap values if they are in the wrong order
-            if start > end:
-                aux = start
-                start = end
-                end = aux
+        if end is None:
+            end = datetime.datetime.now()
+
+        # Swap values if they are in the wrong order
+        if start > end:
+            aux = start
+            start = end
+            end = aux
+
+        return (invformat.toEpochCeil(start), invformat.toEpoch(end))
+
+    def __selectSensorTypes(self, snap, sensortype):
+        """Convert the sensortype parameter to references to the string table.
+
+        The sensor types are separated by spaces. None is returned if all
+        sensor types should be selected.
+
+        """
+
+        if sensortype is None or sensortype == 'all':
+            return None
+
+        strings = snap.inventory.strings
+        refs = set(strings.lookup(senstype)
+                   for senstype in sensortype.strip().split(' '))
+        refs.discard(invformat.NONE_INT)
+        return refs
+
+    def __selectStations(self, snap, params, candidates=None):
+        """Select stations filtered by the input parameters.
+
+        Returns a set of indexes. These indexes indicate the
+        stations that satisfy the constraints indicated by the
+        input parameters.
+
+        If candidates (sorted station indexes, e.g. from one of the indexes
+        of the snapshot) is given, only those stations are checked instead
+        of all the children of the selected networks.
+
+        """
+
+        # Stations operating at some point in the period
+        period = self.__selectPeriod(params)
+        if period is not None:
+            active = snap.stationEpochIndex.active(*period)
+        else:
+            active = None
 
         # Select only one station
         try:
@@ -344,127 +953,296 @@ class InventoryCache(object):
             stations = None
 
         # Filter and save indexes of networks in netsOK
-        netsOK = self.__selectNetworks(params)
+        netsOK = self.__selectNetworks(snap, params)
         # codesOK = set()
 
         statcodesOK = set()
         statsOK = set()
 
         # Just to make notation shorter
-        ptNets = self.networks
-        ptStats = self.stations
+        ptNets = snap.networks
+        ptStats = snap.stations
+
+        # Only the stations with the given keys need to be checked
+        if stations and candidates is None:
+            candidates = set()
+            for key in stations:
+                candidates.update(snap.stationsByKey.get(key, ()))
+            candidates = sorted(candidates)
+
+        # Otherwise all the children of the selected networks are checked
+        if candidates is not None:
+            return self.__selectCandidates(snap, netsOK, candidates, active,
+                                           stations)
+
+        # Columns needed to filter duplicated stations
+        strings = snap.inventory.strings
+        stationNet = ptStats.column('network')
+        stationCode = ptStats.column('code')
+        netCodes = [netw.code for netw in ptNets]
 
         for i in netsOK:
+            netw = ptNets[i]
+
             # A normal network has pointers to first and last child
-            if ((ptNets[i][1] is not None) and (ptNets[i][2] is not None)):
-                list_of_children = range(ptNets[i][1], ptNets[i][2])
+            if ((netw.first is not None) and (netw.last is not None)):
+                list_of_children = range(netw.first, netw.last)
             # A virtual network has a list of children
             else:
-                list_of_children = ptNets[i][3]
+                list_of_children = netw.children
+
+            netcode = netw.code
 
             # Filter and add stations
             for s in list_of_children:
 
+                # Discard if the station was not operating in the period
+                if active is not None and s not in active:
+                    continue
+
                 # Take the real network in which the station is
                 # That means, no virtual networks
-                realParent = self.stations[s][0]
+                realParent = stationNet[s]
+                stacode = strings[stationCode[s]]
 
-                # Discard if start is after the end of the network operation
-                if start and ptStats[s][9]:
-                    if ptStats[s][9] < start:
-                        continue
+                # Filter duplicated stations
+                if (netCodes[realParent], stacode) in statcodesOK:
+                    continue
 
-                # Discard if end is previous than the start of the network
-                # operation
-                if end and ptStats[s][8]:
-                    if end < ptStats[s][8]:
-                        continue
+                statcodesOK.add((netcode, stacode))
+                statsOK.add(s)
 
-                # If there is a station selected look only at the codes
-                if stations:
-                    key = '%s-%s-%s-%s' % (ptNets[realParent][0],
-                                           ptNets[realParent][4],
-                                           ptNets[realParent][5],
-                                           ptStats[s][4])
-                    if key not in stations:
-                        continue
-                    else:
-                        # Once I found the code, insert it in the lists and
-                        # leave the loop
-                        statsOK.add(s)
+        return statsOK
 
-                # Filter duplicated stations
-                if (ptNets[realParent][0], ptStats[s][4]) in statcodesOK:
+    def __selectCandidates(self, snap, netsOK, candidates, active, stations):
+        """Filter a list of station indexes like __selectStations.
+
+        The result is the same as going through the children of every network
+        in netsOK. Only the first epoch of a station in the selected (normal)
+        networks is kept, even if the other epochs are not candidates.
+        Stations reached only through virtual networks are kept if there is no
+        such epoch.
+
+        """
+
+        # Just to make notation shorter
+        ptNets = snap.networks
+        ptStats = snap.stations
+        virtualParents = snap.virtualParents
+
+        def passes(s):
+            # Discard if the station was not operating in the period
+            if active is not None and s not in active:
+                return False
+
+            # If there is a station selected look only at the codes
+            if stations:
+                realParent = ptNets[ptStats[s].network]
+                key = '%s-%s-%s-%s' % (realParent.code, realParent.start,
+                                       realParent.end, ptStats[s].code)
+                if key not in stations:
+                    return False
+
+            return True
+
+        statsOK = set()
+        for s in candidates:
+            realParent = ptStats[s].network
+
+            if realParent not in netsOK:
+                for v in virtualParents.get(s, ()):
+                    if v in netsOK:
+                        break
+                else:
                     continue
 
-                statcodesOK.add((ptNets[i][0], ptStats[s][4]))
+            if not passes(s):
+                continue
+
+            # Stations in the list are added even if they are duplicated
+            if stations:
+                statsOK.add(s)
+
+            # Filter duplicated stations
+            first = None
+            for other in snap.stationsByCode[(ptNets[realParent].code,
+                                              ptStats[s].code)]:
+                if ptStats[other].network in netsOK and passes(other):
+                    first = other
+                    break
+
+            if first == s or first is None:
                 statsOK.add(s)
 
         return statsOK
 
-    def __buildStreamsList(self, statidx, streamFilter, sensortype=None,
-                           preferredsps=None, start=None, end=None):
+    def __selectPattern(self, params):
+        """Compile the patterns of the codes given in the nslc parameter.
+
+        Returns a codepattern.NSLCPattern or None if no pattern was given.
+
+        """
+
+        nslc = params.get('nslc')
+        if nslc is None:
+            return None
+
+        try:
+            return codepattern.NSLCPattern(nslc)
+        except ValueError as e:
+            raise wsgicomm.WIClientError, 'Error! %s' % e
+
+    def __selectCodes(self, snap, nslc):
+        """Select the stations whose network and station codes match.
+
+        Returns a set of pairs (network, station) of indexes. Virtual
+        networks are matched by their own codes. Only the networks and
+        stations with one of the codes matching are checked.
+
+        """
+
+        nets = nslc.network.select(snap.networkCodes)
+        stats = nslc.station.select(snap.stationCodes)
+
+        ptNets = snap.networks
+        children = 0
+        for i in nets:
+            netw = ptNets[i]
+            if (netw.first is not None) and (netw.last is not None):
+                children += netw.last - netw.first
+            else:
+                children += len(netw.children)
+
+        result = set()
+
+        # Go through the shortest list, the stations or the children
+        if len(stats) <= children:
+            netsOK = set(nets)
+            stationNet = snap.stations.column('network')
+            virtualParents = snap.virtualParents
+            for s in stats:
+                for i in [stationNet[s]] + virtualParents.get(s, []):
+                    if i in netsOK:
+                        result.add((i, s))
+
+        else:
+            statsOK = set(stats)
+            for i in nets:
+                netw = ptNets[i]
+                if (netw.first is not None) and (netw.last is not None):
+                    children = xrange(netw.first, netw.last)
+                else:
+                    children = netw.children
+
+                for s in children:
+                    if s in statsOK:
+                        result.add((i, s))
+
+        return result
+
+    def __selectNearEvents(self, snap, params, events, minradius, maxradius,
+                           minazimuth, maxazimuth):
+        """Select the stations close enough to at least one event.
+
+        Returns the set of indexes of the stations selected by
+        __selectStations whose distance to an event is between minradius
+        and maxradius and whose azimuth (from the station to the event) is
+        between minazimuth and maxazimuth. The limits are excluded.
+
+        The stations close to every event are found with the k-d tree of the
+        snapshot and only those are checked.
+
+        """
+
+        # Without upper limits there is nothing to select
+        if maxradius is None or maxazimuth is None:
+            return set()
+
+        candidates = []
+        allCandidates = set()
+        for evt in events:
+            near = snap.stationTree.query(evt[0], evt[1], minradius,
+                                          maxradius)
+            candidates.append(near)
+            allCandidates.update(near)
+
+        statsOK = self.__selectStations(snap, params, sorted(allCandidates))
+
+        # Just to make notation shorter
+        ptStats = snap.stations
+
+        lats = ptStats.column('latitude')
+        lons = ptStats.column('longitude')
+
+        selected = set()
+        for evt, near in zip(events, candidates):
+            near = [st for st in near
+                    if st not in selected and st in statsOK]
+            if not near:
+                continue
+
+            # Calculate radial distance and azimuth (from the station to the
+            # event) for all the stations at once
+            (dist, other, azi) = geodesy.delazi([evt[0]], [evt[1]],
+                                                [lats[st] for st in near],
+                                                [lons[st] for st in near])
+
+            for pos, st in enumerate(near):
+                d = float(dist[0][pos])
+                a = float(azi[0][pos])
+                if (minradius < d) and (d < maxradius) and \
+                   (minazimuth < a) and (a < maxazimuth):
+                    selected.add(st)
+
+        return selected
+
+    def __buildStreamsList(self, snap, statidx, streamFilter,
+                           sensortype=None, preferredsps=None, active=None,
+                           nslc=None):
         """Build a list of streams based on a station index
 
         Inputs:
-          statidx: Station index on self.stations
-          streamFilter: a list of tuples with two
-                        components. The first one is the location code, while
-                        the second one is the two first letters of the
-                        channel. For instance, ('00', 'BH')
-          sensortype:   as received in parameters
+          snap:         Snapshot of the inventory to use
+          statidx:      Station index on snap.stations
+          streamFilter: set with the integers of the band codes (two
+                        first letters of the channel) to select (from
+                        snap.streamSummaries.bandCodes)
+          sensortype:   set with the references to the string table of the
+                        sensor types to select
           preferredsps: the preferred sample rate. At least one stream is
                         selected from each station.
-          start:        start year in datetime format from parameters sent by
-                        the web client
-          end:          end year in datetime format from parameters sent by
-                        the web client
+          active:       streams operating in the period requested by the
+                        web client (from snap.streamEpochIndex)
+          nslc:         patterns of the location and channel codes (a
+                        codepattern.NSLCPattern)
 
         """
 
-        if sensortype is not None:
-            sensortype = sensortype.strip().split(' ')
-
-        first_child_sensor = self.stations[statidx][1]
-        last_child_sensor = self.stations[statidx][2]
-
-        # Just to make notation shorter
-        ptSens = self.sensorsLoc
-        ptStre = self.streams
+        # Streams of the station, already sorted
+        summary = snap.streamSummaries[statidx]
 
         loc_ch = []
         spslist = []
         restr = []
-        for loc in range(first_child_sensor, last_child_sensor):
-            first_child_stream = ptSens[loc][1]
-            last_child_stream = ptSens[loc][2]
-
-            for ch in range(first_child_stream, last_child_stream):
+        for pos, ch in enumerate(summary.streams):
 
-                if streamFilter is not None:
-                    if ptStre[ch][1][:2] not in streamFilter:
-                        continue
-
-                if sensortype is not None:
-                    if (ptStre[ch][2] not in sensortype):
-                        continue
+            if streamFilter is not None:
+                if summary.bands[pos] not in streamFilter:
+                    continue
 
-                if (ptStre[ch][7] is not None) and (start is not None):
-                    if (ptStre[ch][7] < start):
-                        continue
+            if sensortype is not None:
+                if (summary.sensortypes[pos] not in sensortype):
+                    continue
 
-                if (ptStre[ch][6] is not None) and (end is not None):
-                    if (end < ptStre[ch][6]):
-                        continue
+            if active is not None and ch not in active:
+                continue
 
-                loc_ch.append('%s.%s' % (ptSens[loc][4], ptStre[ch][1]))
-                # Calculate sps for the stream
-                try:
-                    spslist.append(float(ptStre[ch][4] / ptStre[ch][3]))
-                except:
-                    spslist.append(None)
+            if nslc is not None and not nslc.matchStream(summary.locch[pos]):
+                continue
 
-                restr.append(self.streams[ch][8])
+            loc_ch.append(summary.locch[pos])
+            spslist.append(summary.sps[pos])
+            restr.append(summary.restricted[pos])
 
         # Extra processing to select only one stream per station if there is a
         # preferred sampling rate
@@ -491,9 +1269,11 @@ class InventoryCache(object):
             loc_ch = [loc_ch[i] for i in selected]
             restr = [restr[i] for i in selected]
 
-        (loc_ch, restr) = zip(*sorted(zip(loc_ch, restr))) or ([], [])
+        if not loc_ch:
+            return ([], [])
 
-        return (loc_ch, restr)
+        # The order of the summary is kept
+        return (tuple(loc_ch), tuple(restr))
 
     # Public method that wraps a function to select networks based on the input
     # parameters.
@@ -507,20 +1287,21 @@ class InventoryCache(object):
 
         """
 
-        netsOK = self.__selectNetworks(params)
+        snap = self.__current()
+        netsOK = self.__selectNetworks(snap, params)
 
         # Just to make notation shorter
-        ptNets = self.networks
+        ptNets = snap.networks
 
         netList = []
         for i in netsOK:
-            netList.append(('%s-%s-%s' % (ptNets[i][0], ptNets[i][4],
-                                          ptNets[i][5]),
+            netw = ptNets[i]
+            netList.append(('%s-%s-%s' % (netw.code, netw.start, netw.end),
                             '%s%s%s (%s) - %s [data hosted at: %s]' %
-                            (ptNets[i][0],
-                             '*' if ptNets[i][8] == 't' else ' ',
-                             '+' if ptNets[i][7] == 1 else ' ',
-                             ptNets[i][4], ptNets[i][6], ptNets[i][9])))
+                            (netw.code,
+                             '*' if netw.netclass == 't' else ' ',
+                             '+' if netw.restricted == 1 else ' ',
+                             netw.start, netw.description, netw.archive)))
 
         netList.sort()
         netList.insert(0, ('all', 'All Networks'))
@@ -536,20 +1317,22 @@ class InventoryCache(object):
 
         """
 
-        statsOK = self.__selectStations(params)
+        snap = self.__current()
+        statsOK = self.__selectStations(snap, params)
 
         # Just to make notation shorter
-        ptNets = self.networks
-        ptStats = self.stations
+        ptNets = snap.networks
+        ptStats = snap.stations
 
         statsList = []
         for i in statsOK:
             stat = ptStats[i]
-            netw = ptNets[stat[0]]
-            statsList.append(('%s-%s-%s-%s' % (netw[0], netw[4], netw[5],
-                                               stat[4]),
+            netw = ptNets[stat.network]
+            statsList.append(('%s-%s-%s-%s' % (netw.code, netw.start,
+                                               netw.end, stat.code),
                               '%-5s %s %s (%d)' %
-                              (stat[4], netw[0], stat[7], stat[8].year)))
+                              (stat.code, netw.code, stat.description,
+                               invformat.fromEpoch(stat.start).year)))
 
         statsList.sort()
         statsList.insert(0, ('all', 'All Stations'))
@@ -563,35 +1346,65 @@ class InventoryCache(object):
         actually selected by __selectStations. It contains only a
         couple of columns because it is used in the menus.
 
+        Only the streams of the sensor types given in the parameter
+        sensortype and operating in the period given by the start and end
+        years are counted. Without these filters, the band code counts of
+        the stations (or the whole network) are added up.
+
         """
 
-        # Filter and save indexes of stations in statsOK
-        statsOK = self.__selectStations(params)
+        snap = self.__current()
+        summaries = snap.streamSummaries
 
-        # The default dictionary is used to be able to count
-        # how many times the keys have been included.
-        streamDict = defaultdict(int)
+        period = self.__selectPeriod(params)
+        sensortype = self.__selectSensorTypes(snap, params.get('sensortype'))
 
-        # Browse the selected stations
-        for statidx in statsOK:
-            first_child_sensor = self.stations[statidx][1]
-            last_child_sensor = self.stations[statidx][2]
+        # Select only one network and all its stations
+        network = params.get('network')
+        station = params.get('station')
+        wholeNetwork = bool(network) and network != 'all' and \
+            (station is None or station.split(',')[0] == 'all')
 
-            # Browse the children (sensors) of the current station
-            for senLocidx in range(first_child_sensor, last_child_sensor):
-                first_child_stream = self.sensorsLoc[senLocidx][1]
-                last_child_stream = self.sensorsLoc[senLocidx][2]
+        networks = None
+        if period is None and sensortype is None and wholeNetwork:
+            networks = list(self.__selectNetworks(snap, params))
 
-                # Browse the children (streams) of the current sensor
-                for stridx in range(first_child_stream, last_child_stream):
-                    # FIXME: Streams need to be filtered further with params
-                    streamDict[self.streams[stridx][1][:2]] += 1
+        # The key of a network selects at most one, whose counts are kept
+        # precomputed. Otherwise, the counts of the stations are merged.
+        if networks is not None and len(networks) <= 1:
+            counts = snap.networkBandCounts[networks[0]] if networks else {}
 
-        streamList = []
-        for w in sorted(streamDict, key=streamDict.get, reverse=True):
-            streamList.append(w)
+        else:
+            # Filter and save indexes of stations in statsOK
+            statsOK = self.__selectStations(snap, params)
 
-        return streamList
+            if period is None and sensortype is None:
+                counts = invindex.mergeBandCounts(summaries, statsOK)
+
+            else:
+                # Streams operating at some point in the period
+                if period is not None:
+                    active = snap.streamEpochIndex.active(*period)
+                else:
+                    active = None
+
+                counts = defaultdict(int)
+                for statidx in statsOK:
+                    summary = summaries[statidx]
+                    for pos, ch in enumerate(summary.streams):
+                        if sensortype is not None and \
+                                summary.sensortypes[pos] not in sensortype:
+                            continue
+
+                        if active is not None and ch not in active:
+                            continue
+
+                        counts[summary.bands[pos]] += 1
+
+        # The band codes are sorted by the number of streams and then by code
+        bands = summaries.bandCodes.codes
+        return [band for (count, band) in
+                sorted((-count, bands[b]) for (b, count) in counts.iteritems())]
 
     def getQuery(self, params):
         """Get a list of streams that satisfies the input parameters.
@@ -652,10 +1465,7 @@ class InventoryCache(object):
             if (networktype == 'all') or (networktype is None):
                 networktype = None
             else:
-                for nettype in self.nettypes:
-                    if networktype == nettype[0]:
-                        break
-                else:
+                if networktype not in self.__nettypeByCode:
                     raise Exception
 
         except:
@@ -751,124 +1561,82 @@ class InventoryCache(object):
         # These are the two lists to return
         stats = []
 
-        # Filter and save indexes of stations in statsOK
-        statsOK = self.__selectStations(params)
-
-        # Just to make notation shorter
-        ptNets = self.networks
-        ptStats = self.stations
+        snap = self.__current()
 
-        if ('station' in params):
-            # Builds a list from the selected stations
-            for st in statsOK:
-                parent_net = ptStats[st][0]
-
-                (loc_ch, restricted) = self.__buildStreamsList(st, streams,
-                                                               sensortype,
-                                                               preferredsps,
-                                                               start_date,
-                                                               end_date)
-
-                if len(loc_ch):
-                    stats.append(('%s-%s-%s-%s%s%s' % (ptNets[parent_net][0],
-                                  ptNets[parent_net][4], ptStats[st][4],
-                                  ptStats[st][8].year, ptStats[st][8].month,
-                                  ptStats[st][8].day),  ptNets[parent_net][0],
-                                  ptStats[st][4], ptStats[st][5],
-                                  ptStats[st][6], ptNets[parent_net][7],
-                                  ptNets[parent_net][8], ptNets[parent_net][9],
-                                  ptNets[parent_net][10], loc_ch, restricted))
-
-        elif (latmin is not None and latmax is not None and lonmin is not None
-              and lonmax is not None):
-
-            # statsOK is a set and therefore, there will be no repetitions
-            for st in statsOK:
-                # Pointer to the parent network
-                parent_net = ptStats[st][0]
-
-                # Filter by latitude
-                if(ptStats[st][5] < latmin) or (ptStats[st][5] > latmax):
-                    continue
-
-                # Filter by longitude
-                if(lonmin <= lonmax):
-                    if (ptStats[st][6] < lonmin) or (ptStats[st][6] > lonmax):
-                        continue
-                else:
-                    if (ptStats[st][6] < lonmin) and (ptStats[st][6] > lonmax):
-                        continue
+        eventsMode = False
 
-                (loc_ch, restricted) = self.__buildStreamsList(st, streams,
-                                                               sensortype,
-                                                               preferredsps,
-                                                               start_date,
-                                                               end_date)
-
-                if len(loc_ch):
-                    stats.append(('%s-%s-%s-%s%s%s' %
-                                  (ptNets[parent_net][0],
-                                   ptNets[parent_net][4], ptStats[st][4],
-                                   ptStats[st][8].year, ptStats[st][8].month,
-                                   ptStats[st][8].day),
-                                  ptNets[parent_net][0],
-                                  ptStats[st][4], ptStats[st][5],
-                                  ptStats[st][6], ptNets[parent_net][7],
-                                  ptNets[parent_net][8], ptNets[parent_net][9],
-                                  ptNets[parent_net][10], loc_ch, restricted))
+        # Stations whose codes match the patterns given
+        nslc = self.__selectPattern(params)
+        if nslc is not None:
+            codesOK = sorted(set(s for (i, s) in
+                                 self.__selectCodes(snap, nslc)))
+        else:
+            codesOK = None
 
+        # Filter and save indexes of stations in statsOK
+        if 'station' in params:
+            statsOK = self.__selectStations(snap, params, codesOK)
+        elif (latmin is not None and latmax is not None and
+              lonmin is not None and lonmax is not None):
+            # Only the stations inside the box need to be checked
+            candidates = snap.stationGrid.query(latmin, latmax, lonmin,
+                                                lonmax)
+            if codesOK is not None:
+                candidates = sorted(set(candidates).intersection(codesOK))
+            statsOK = self.__selectStations(snap, params, candidates)
         elif events is not None:
-
             events = json.loads(events)
-
-            for st in statsOK:
-                # Pointer to the parent network
-                parent_net = ptStats[st][0]
-
-                # Retrieve latitude and longitude of station
-                slat = ptStats[st][5]
-                slon = ptStats[st][6]
-
-                for evt in events:
-                    # Retrieve latitude and longitude of event
-                    lat = evt[0]
-                    lon = evt[1]
-
-                    # Calculate radial distance and azimuth
-                    (dist, azi, other) = Math.delazi(slat, slon, lat, lon)
-
-                    if (minradius < dist) and (dist < maxradius) and \
-                       (minazimuth < azi) and (azi < maxazimuth):
-                        (loc_ch, restricted) = \
-                            self.__buildStreamsList(st, streams, sensortype,
-                                                    preferredsps, start_date,
-                                                    end_date)
-
-                        if len(loc_ch):
-                            stats.append(('%s-%s-%s-%s%s%s' %
-                                          (ptNets[parent_net][0],
-                                           ptNets[parent_net][4],
-                                           ptStats[st][4],
-                                           ptStats[st][8].year,
-                                           ptStats[st][8].month,
-                                           ptStats[st][8].day),
-                                          ptNets[parent_net][0],
-                                          ptStats[st][4], ptStats[st][5],
-                                          ptStats[st][6],
-                                          ptStats[st][11],
-                                          ptNets[parent_net][8],
-                                          ptNets[parent_net][9],
-                                          ptNets[parent_net][10], loc_ch,
-                                          restricted))
-
-                        # Stop the loop through events and go for the
-                        # next station
-                        break
-
+            eventsMode = True
+            statsOK = self.__selectNearEvents(snap, params, events,
+                                              minradius, maxradius,
+                                              minazimuth, maxazimuth)
+            if codesOK is not None:
+                statsOK.intersection_update(codesOK)
+        elif codesOK is not None:
+            statsOK = self.__selectStations(snap, params, codesOK)
         else:
             msg = 'Error: not enough parameters have been given.'
             raise wsgicomm.WIClientError, msg
 
+        # Just to make notation shorter
+        ptNets = snap.networks
+        ptStats = snap.stations
+
+        # Streams operating at some point in the period
+        active = snap.streamEpochIndex.active(invformat.toEpoch(start_date),
+                                              invformat.toEpoch(end_date))
+
+        # Band codes and sensor types are compared as integers
+        if streams is not None:
+            streams = snap.streamSummaries.bandCodes.lookup(streams)
+
+        sensortype = self.__selectSensorTypes(snap, sensortype)
+
+        # Builds a list from the selected stations. statsOK is a set and
+        # therefore, there will be no repetitions.
+        for st in statsOK:
+            (loc_ch, restricted) = self.__buildStreamsList(snap, st, streams,
+                                                           sensortype,
+                                                           preferredsps,
+                                                           active, nslc)
+
+            if len(loc_ch):
+                stat = ptStats[st]
+                # Parent network
+                netw = ptNets[stat.network]
+                start = invformat.fromEpoch(stat.start)
+
+                # In the events mode the station restriction is shown
+                stats.append(('%s-%s-%s-%s%s%s' % (netw.code, netw.start,
+                                                   stat.code, start.year,
+                                                   start.month, start.day),
+                              netw.code, stat.code, stat.latitude,
+                              stat.longitude,
+                              stat.restricted if eventsMode
+                              else netw.restricted,
+                              netw.netclass, netw.archive, netw.institutions,
+                              loc_ch, restricted))
+
         stats.sort()
 
         stats.insert(0, ('key', 'netcode', 'statcode', 'latitude', 'longitude',
@@ -877,50 +1645,195 @@ class InventoryCache(object):
 
         return stats
 
-    def getStreamInfo(self, start_time, end_time, net, sta, cha, loc):
+    def getStationsByCode(self, net, sta):
+        """Get the epochs of a station in the networks with a code.
+
+        Returns a list of pairs (network, station) with the rows of the
+        network and station. Virtual networks are also considered. The
+        pairs follow the order of the networks and their children.
+
+        """
+
+        snap = self.__current()
+        return [(snap.networks[i], snap.stations[s])
+                for (i, s) in snap.childrenByCode.get((net, sta), ())]
+
+    def getCodesByPattern(self, nslc):
+        """Get the codes of the streams matching some patterns.
+
+        nslc has the patterns of the network, station, location and channel
+        codes separated by dots (see codepattern.NSLCPattern). Returns a
+        sorted list of (net, sta, loc, cha) tuples. Virtual networks are
+        matched by their own codes.
+
+        """
+
+        snap = self.__current()
         try:
-            stream_epochs = self.streamidx[(net, sta, cha, loc)]
-        except KeyError:
-            logs.error("%s,%s,%s,%s not found" % (net, sta, cha, loc))
-            return None
+            nslc = codepattern.NSLCPattern(nslc)
+        except ValueError as e:
+            raise wsgicomm.WIClientError, 'Error! %s' % e
 
-        for stream in stream_epochs:
-            try:
-                station = self.stations[self.sensorsLoc[stream[0]][0]]
+        result = set()
+        for (i, s) in self.__selectCodes(snap, nslc):
+            netcode = snap.networks[i].code
+            stacode = snap.stations[s].code
+            for locch in snap.streamSummaries[s].locch:
+                if nslc.matchStream(locch):
+                    (loc, cha) = locch.split('.', 1)
+                    result.add((netcode, stacode, loc, cha))
+
+        return sorted(result)
+
+    def getStreamInfo(self, start_time, end_time, net, sta, cha, loc):
+        """Get the coordinates and the estimated data size of a stream.
+
+        Returns a dictionary with latitude, longitude, elevation and size
+        (in bytes) for the first epoch of the stream operating between
+        start_time and end_time, or None if there is no such epoch.
+
+        """
+
+        return self.getStreamInfoMany([(start_time, end_time)],
+                                      [(net, sta, cha, loc)])[0]
+
+    def getStreamInfoMany(self, windows, streams):
+        """Get the information of many streams at once.
+
+        Inputs:
+          windows: list of (start_time, end_time) pairs
+          streams: list of (net, sta, cha, loc) codes, one for every window
+
+        Returns a list with the result of getStreamInfo for every pair of
+        window and stream. The epochs of every stream are read once and
+        searched with bisection. The sizes are estimated all together.
+
+        """
+
+        snap = self.__current()
+        starts = snap.streams.column('start')
+        ends = snap.streams.column('end')
+        empty = invformat.NONE_EPOCH
+        last = float('inf')
+
+        # Epochs of every stream sorted by start, with the latest end of the
+        # epochs up to every position
+        epochs = {}
+        for key in set(streams):
+            idxs = snap.inventory.streamEpochs(*key)
+            if not idxs:
+                logs.error("%s,%s,%s,%s not found" % key)
+                continue
+
+            maxEnds = []
+            latest = -last
+            for i in idxs:
+                latest = max(latest, last if ends[i] == empty else ends[i])
+                maxEnds.append(latest)
+
+            epochs[key] = (idxs, [starts[i] for i in idxs], maxEnds)
+
+        # Open epochs are considered to end one year from now
+        later = datetime.datetime.now() + datetime.timedelta(days=365)
 
-            except IndexError:
-                logs.error("cache inconsistency")
-                return None
+        result = [None] * len(streams)
+        rates = []
+        durations = []
+        positions = []
 
-            # stream_start = datetime.datetime(station[8], 1, 1)
-            # stream_end = datetime.datetime(station[9], 1, 1) if station[9] \
-            #         else datetime.datetime(2030, 1, 1)
-            stream_start = stream[6]
-            stream_end = stream[7] if stream[7] is not None \
-                else (datetime.datetime.now() + datetime.timedelta(days=365))
+        # Limits of every distinct window and coordinates and sampling rate
+        # of every epoch found, as many windows share them
+        limits = {}
+        found = {}
 
-            if start_time >= stream_end or end_time <= stream_start:
+        for pos, ((start_time, end_time), key) in enumerate(zip(windows,
+                                                                 streams)):
+            if key not in epochs:
                 continue
 
-            result = {'latitude': station[5],
-                      'longitude': station[6],
-                      'elevation': station[10]}
+            (idxs, epStarts, maxEnds) = epochs[key]
 
-            if stream[3] != 0:
+            # Streams operating between start_time and end_time (the limits
+            # are excluded)
+            try:
+                (begin, end) = limits[(start_time, end_time)]
+            except KeyError:
+                begin = invformat.toEpoch(start_time) + 1
+                end = invformat.toEpochCeil(end_time) - 1
+                limits[(start_time, end_time)] = (begin, end)
+
+            # Epochs after the first one ending in the period and starting
+            # before its end
+            stop = bisect.bisect_right(epStarts, end)
+            epoch = None
+            for j in xrange(bisect.bisect_left(maxEnds, begin), stop):
+                i = idxs[j]
+                if ends[i] == empty:
+                    if start_time >= later:
+                        continue
+                elif ends[i] < begin:
+                    continue
+
+                epoch = i
+                break
+
+            if epoch is None:
+                continue
+
+            if epoch not in found:
+                stream = snap.streams[epoch]
+
+                try:
+                    station = snap.stations[
+                        snap.sensorsLoc[stream.sensorLoc].station]
+
+                except IndexError:
+                    logs.error("cache inconsistency")
+                    continue
+
+                rate = None
+                if stream.denominator != 0:
+                    rate = (float(stream.numerator) /
+                            float(stream.denominator))
+
+                found[epoch] = (station.latitude, station.longitude,
+                                station.elevation, rate)
+
+            (latitude, longitude, elevation, rate) = found[epoch]
+            result[pos] = {'latitude': latitude,
+                           'longitude': longitude,
+                           'elevation': elevation,
+                           'size': 0}
+
+            if rate is not None:
                 tdiff = end_time - start_time
-                tdiff = tdiff.days * 86400 + tdiff.seconds
-                samp = float(stream[4]) / float(stream[3])
+                durations.append(tdiff.days * 86400 + tdiff.seconds)
+                rates.append(rate)
+                positions.append(pos)
 
-                # assuming approximately 1 byte per sample (compressed),
-                # 512 bytes record size
-                bytesper = 1
-                recsize = 512
-                result['size'] = int(recsize * math.ceil(
-                                     float(tdiff * samp * bytesper) / recsize))
+        for pos, size in zip(positions, estimateSizes(durations, rates)):
+            result[pos]['size'] = size
 
-            else:
-                result['size'] = 0
+        return result
+
+
+def estimateSizes(durations, rates):
+    """Estimate the size in bytes of the data of some streams.
+
+    durations are the lengths of the time windows in seconds and rates the
+    sampling rates of the streams. NumPy is used if it is installed.
+
+    """
+
+    # assuming approximately 1 byte per sample (compressed),
+    # 512 bytes record size
+    bytesper = 1
+    recsize = 512
 
-            return result
+    if numpy is not None and durations:
+        samples = numpy.asarray(durations) * numpy.asarray(rates, dtype=float)
+        sizes = recsize * numpy.ceil(samples * bytesper / recsize)
+        return [int(size) for size in sizes]
 
-        return None
+    return [int(recsize * math.ceil(float(tdiff * samp * bytesper) / recsize))
+            for (tdiff, samp) in zip(durations, rates)]
@@ -0,0 +1,653 @@
+"""Columnar inventory format for the Arclink web interface
+
+The inventory is stored in one binary file with fixed-width typed columns
+for every attribute of the networks, stations, sensor locations and streams.
+All strings are kept once in a sorted string table and the columns store
+only their positions in it.
+
+The file is mapped in memory by every process using the inventory, so
+that all of them share the same physical pages and no copy of the data is
+made at start-up. The tables return rows as compact records (Network,
+Station, SensorLocation and Stream) with one attribute per column. The
+start and end of stations and streams are integer seconds since 1970.
+
+"""
+
+import os
+import math
+import mmap
+import json
+import array
+import bisect
+import ctypes
+import hashlib
+import struct
+import calendar
+import datetime
+
+MAGIC = 'WDC3INV\0'
+VERSION = 1
+
+# Value stored in the integer columns instead of None
+NONE_INT = -1
+NONE_EPOCH = -2 ** 63
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Type of every column (struct format) and its equivalent in ctypes
+CTYPES = {'b': ctypes.c_int8,
+          'i': ctypes.c_int32,
+          'q': ctypes.c_int64,
+          'd': ctypes.c_double}
+
+# Typecodes of the array module used to write the columns
+ARRAYCODES = {'b': 'b', 'i': 'i', 'q': 'l', 'd': 'd'}
+
+# Columns of every table. A type 's' means a reference to the string table.
+LAYOUT = {
+    'networks': [('code', 's'), ('first', 'i'), ('last', 'i'),
+                 ('vfirst', 'i'), ('vlast', 'i'), ('start', 'i'),
+                 ('end', 'i'), ('description', 's'), ('restricted', 'b'),
+                 ('netclass', 's'), ('archive', 's'),
+                 ('institutions', 's')],
+    'stations': [('network', 'i'), ('first', 'i'), ('last', 'i'),
+                 ('code', 's'), ('latitude', 'd'), ('longitude', 'd'),
+                 ('description', 's'), ('start', 'q'), ('end', 'q'),
+                 ('elevation', 'd'), ('restricted', 'b')],
+    'sensorsLoc': [('station', 'i'), ('first', 'i'), ('last', 'i'),
+                   ('code', 's')],
+    'streams': [('sensorLoc', 'i'), ('code', 's'), ('sensortype', 's'),
+                ('denominator', 'd'), ('numerator', 'd'),
+                ('datalogger', 's'), ('start', 'q'), ('end', 'q'),
+                ('restricted', 'b')]
+}
+
+
+def toEpoch(dt):
+    """Convert a datetime to integer seconds since 1970 (None if empty)."""
+    if dt is None:
+        return None
+    return calendar.timegm(dt.utctimetuple())
+
+
+def toEpochCeil(dt):
+    """Like toEpoch, but rounding up the fractions of a second."""
+    if dt is None:
+        return None
+    return toEpoch(dt) + (1 if dt.microsecond else 0)
+
+
+def fromEpoch(sec):
+    """Convert integer seconds since 1970 to a datetime."""
+    return EPOCH + datetime.timedelta(seconds=sec)
+
+
+class Record(object):
+    """Row of one of the inventory tables.
+
+    The attributes are listed in __slots__, in the same order as the
+    arguments of the constructor. Records can be compared, pickled and
+    converted to tuples.
+
+    """
+
+    __slots__ = ()
+
+    def __iter__(self):
+        for name in self.__slots__:
+            yield getattr(self, name)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        return (type(self), tuple(self))
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join(repr(value) for value in self))
+
+
+class Network(Record):
+    """Network (or virtual network) of the inventory.
+
+    Normal networks have the indexes of their first and last (excluded)
+    station. Virtual networks have a list with the indexes of their
+    stations in children instead. start and end are years.
+
+    """
+
+    __slots__ = ('code', 'first', 'last', 'children', 'start', 'end',
+                 'description', 'restricted', 'netclass', 'archive',
+                 'institutions')
+
+    def __init__(self, code, first, last, children, start, end, description,
+                 restricted, netclass, archive, institutions):
+        self.code = code
+        self.first = first
+        self.last = last
+        self.children = children
+        self.start = start
+        self.end = end
+        self.description = description
+        self.restricted = restricted
+        self.netclass = netclass
+        self.archive = archive
+        self.institutions = institutions
+
+
+class Station(Record):
+    """Epoch of a station, with the indexes of its sensor locations."""
+
+    __slots__ = ('network', 'first', 'last', 'code', 'latitude', 'longitude',
+                 'description', 'start', 'end', 'elevation', 'restricted')
+
+    def __init__(self, network, first, last, code, latitude, longitude,
+                 description, start, end, elevation, restricted):
+        self.network = network
+        self.first = first
+        self.last = last
+        self.code = code
+        self.latitude = latitude
+        self.longitude = longitude
+        self.description = description
+        self.start = start
+        self.end = end
+        self.elevation = elevation
+        self.restricted = restricted
+
+
+class SensorLocation(Record):
+    """Sensor location of a station, with the indexes of its streams."""
+
+    __slots__ = ('station', 'first', 'last', 'code')
+
+    def __init__(self, station, first, last, code):
+        self.station = station
+        self.first = first
+        self.last = last
+        self.code = code
+
+
+class Stream(Record):
+    """Epoch of a stream of a sensor location."""
+
+    __slots__ = ('sensorLoc', 'code', 'sensortype', 'denominator',
+                 'numerator', 'datalogger', 'start', 'end', 'restricted')
+
+    def __init__(self, sensorLoc, code, sensortype, denominator, numerator,
+                 datalogger, start, end, restricted):
+        self.sensorLoc = sensorLoc
+        self.code = code
+        self.sensortype = sensortype
+        self.denominator = denominator
+        self.numerator = numerator
+        self.datalogger = datalogger
+        self.start = start
+        self.end = end
+        self.restricted = restricted
+
+
+def fromLegacy(networks, stations, sensorsLoc, streams):
+    """Convert the lists of a pickled cache to records.
+
+    Old versions of update-metadata.py stored every row as a list, with an
+    unused column after the pointers of stations and sensor locations and
+    with datetimes for the start and end of stations and streams.
+
+    """
+
+    return ([Network(*net) for net in networks],
+            [Station(sta[0], sta[1], sta[2], sta[4], sta[5], sta[6], sta[7],
+                     toEpoch(sta[8]), toEpoch(sta[9]), sta[10], sta[11])
+             for sta in stations],
+            [SensorLocation(loc[0], loc[1], loc[2], loc[4])
+             for loc in sensorsLoc],
+            [Stream(cha[0], cha[1], cha[2], cha[3], cha[4], cha[5],
+                    toEpoch(cha[6]), toEpoch(cha[7]), cha[8])
+             for cha in streams])
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class StringTable(object):
+    """Sorted table of unique strings stored in the inventory file.
+
+    The position of a string in the table is used as reference in the
+    columns. As the table is sorted, comparing two references is equivalent
+    to comparing the strings.
+
+    The strings are read and interned when the table is loaded, so that
+    every row using the same code or description shares the same object.
+
+    """
+
+    def __init__(self, offsets, buf, base):
+        self._values = [intern(str(buf[base + offsets[i]:
+                                       base + offsets[i + 1]]))
+                        for i in xrange(len(offsets) - 1)]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            return None
+        return self._values[idx]
+
+    def lookup(self, value):
+        """Return the reference of a string or -1 if it is not present."""
+        idx = bisect.bisect_left(self._values, value)
+        if idx < len(self._values) and self._values[idx] == value:
+            return idx
+        return -1
+
+
+class Table(object):
+    """Read-only table backed by the columns of the inventory file.
+
+    Rows are built on demand as records.
+
+    """
+
+    def __init__(self, inventory, name, size, columns, makerow):
+        self.inventory = inventory
+        self.name = name
+        self.columns = columns
+        self._size = size
+        self._makerow = makerow
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError('%s index out of range' % self.name)
+        return self._makerow(self.inventory, idx)
+
+    def __iter__(self):
+        for idx in xrange(self._size):
+            yield self._makerow(self.inventory, idx)
+
+    def column(self, name):
+        return self.columns[name]
+
+
+def _optInt(value):
+    return None if value == NONE_INT else value
+
+
+def _optEpoch(value):
+    return None if value == NONE_EPOCH else value
+
+
+def _optFloat(value):
+    return None if math.isnan(value) else value
+
+
+def _networkRow(inv, i):
+    c = inv.networks.columns
+    s = inv.strings
+    vfirst = c['vfirst'][i]
+    return Network(s[c['code'][i]], _optInt(c['first'][i]),
+                   _optInt(c['last'][i]),
+                   inv.vchildren[vfirst:c['vlast'][i]]
+                   if vfirst != NONE_INT else None,
+                   c['start'][i], _optInt(c['end'][i]),
+                   s[c['description'][i]], _optInt(c['restricted'][i]),
+                   s[c['netclass'][i]], s[c['archive'][i]],
+                   s[c['institutions'][i]])
+
+
+def _stationRow(inv, i):
+    c = inv.stations.columns
+    s = inv.strings
+    return Station(c['network'][i], c['first'][i], c['last'][i],
+                   s[c['code'][i]], _optFloat(c['latitude'][i]),
+                   _optFloat(c['longitude'][i]), s[c['description'][i]],
+                   c['start'][i], _optEpoch(c['end'][i]),
+                   _optFloat(c['elevation'][i]),
+                   _optInt(c['restricted'][i]))
+
+
+def _sensorLocRow(inv, i):
+    c = inv.sensorsLoc.columns
+    return SensorLocation(c['station'][i], c['first'][i], c['last'][i],
+                          inv.strings[c['code'][i]])
+
+
+def _streamRow(inv, i):
+    c = inv.streams.columns
+    s = inv.strings
+    return Stream(c['sensorLoc'][i], s[c['code'][i]], s[c['sensortype'][i]],
+                  _optFloat(c['denominator'][i]),
+                  _optFloat(c['numerator'][i]), s[c['datalogger'][i]],
+                  c['start'][i], _optEpoch(c['end'][i]),
+                  _optInt(c['restricted'][i]))
+
+
+ROWS = {'networks': _networkRow,
+        'stations': _stationRow,
+        'sensorsLoc': _sensorLocRow,
+        'streams': _streamRow}
+
+
+class ColumnarInventory(object):
+    """Inventory read from a buffer in columnar format.
+
+    The buffer can be a memory mapped file or a bytearray. The columns are
+    ctypes arrays created on top of the buffer, so no data is copied.
+
+    """
+
+    def __init__(self, buf):
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not an inventory in columnar format')
+
+        version, toclen = struct.unpack_from('=II', buf, len(MAGIC))
+        if version != VERSION:
+            raise ValueError('Unsupported version of the columnar format: %d'
+                             % version)
+
+        start = len(MAGIC) + 8
+        toc = json.loads(str(buf[start:start + toclen]))
+
+        self.buffer = buf
+
+        offsets = self._array(toc['strings']['offsets'])
+        self.strings = StringTable(offsets, buf, toc['strings']['blob'][0])
+        self.vchildren = self._array(toc['vchildren'])
+        self.streamkeys = self._array(toc['streamkeys'])
+
+        for name, cols in LAYOUT.iteritems():
+            table = toc['tables'][name]
+            columns = dict((col, self._array(table['columns'][col]))
+                           for col, coltype in cols)
+            setattr(self, name, Table(self, name, table['rows'], columns,
+                                      ROWS[name]))
+
+    def _array(self, desc):
+        coltype, offset, count = desc
+        return (CTYPES[coltype] * count).from_buffer(self.buffer, offset)
+
+    def streamEpochs(self, net, sta, cha, loc):
+        """Return the indexes of all the epochs of a stream.
+
+        The search is done in the list of streams sorted by
+        (network, station, channel, location, start).
+
+        """
+
+        key = (net, sta, cha, loc)
+        keys = self.streamkeys
+
+        lo = 0
+        hi = len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.streamKey(keys[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        result = []
+        while lo < len(keys) and self.streamKey(keys[lo]) == key:
+            result.append(keys[lo])
+            lo += 1
+
+        return result
+
+    def streamCodes(self):
+        """Return the set of references of the channel codes."""
+        return set(self.streams.column('code'))
+
+    def streamKey(self, idx):
+        """Return the (net, sta, cha, loc) tuple of a stream."""
+        s = self.strings
+        loc = self.streams.columns['sensorLoc'][idx]
+        sta = self.sensorsLoc.columns['station'][loc]
+        net = self.stations.columns['network'][sta]
+        return (s[self.networks.columns['code'][net]],
+                s[self.stations.columns['code'][sta]],
+                s[self.streams.columns['code'][idx]],
+                s[self.sensorsLoc.columns['code'][loc]])
+
+
+def fileHash(filename):
+    """Return the SHA-1 of the content of a file."""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(1024 * 1024), ''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load(filename):
+    """Map the inventory file read-only in memory and return its content.
+
+    The file is mapped with copy-on-write access, which is what ctypes needs
+    to create arrays on top of it. Nothing writes into the mapping, so the
+    pages are shared by all processes that load the same file.
+
+    """
+
+    with open(filename, 'rb') as fin:
+        buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    return ColumnarInventory(buf)
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _tobytes(coltype, values):
+    """Binary representation of a column in native byte order."""
+    if coltype == 'q' and array.array('l').itemsize != 8:
+        return struct.pack('=%dq' % len(values), *values)
+    return array.array(ARRAYCODES[coltype], values).tostring()
+
+
+def pack(networks, stations, sensorsLoc, streams):
+    """Build the columnar representation of the four inventory tables.
+
+    The input are the lists of records generated by update-metadata.py.
+    A bytearray is returned, which can be either saved in a file or read
+    directly with ColumnarInventory.
+
+    """
+
+    tables = (('networks', networks), ('stations', stations),
+              ('sensorsLoc', sensorsLoc), ('streams', streams))
+
+    # Collect and sort all the strings to build the string table
+    allstrings = set()
+    for name, rows in tables:
+        strcols = [col for col, coltype in LAYOUT[name] if coltype == 's']
+        for row in rows:
+            for col in strcols:
+                value = getattr(row, col)
+                if value is not None:
+                    allstrings.add(_encode(value))
+
+    strlist = sorted(allstrings)
+    strids = dict((s, i) for i, s in enumerate(strlist))
+
+    def sref(value):
+        return NONE_INT if value is None else strids[_encode(value)]
+
+    def optint(value):
+        return NONE_INT if value is None else int(value)
+
+    def optepoch(value):
+        return NONE_EPOCH if value is None else int(value)
+
+    def optfloat(value):
+        return float('nan') if value is None else float(value)
+
+    # Children of virtual networks are kept in a separate array
+    vchildren = []
+    cols = dict((name, dict((col, []) for col, coltype in LAYOUT[name]))
+                for name in LAYOUT)
+
+    c = cols['networks']
+    for net in networks:
+        c['code'].append(sref(net.code))
+        c['first'].append(optint(net.first))
+        c['last'].append(optint(net.last))
+        if net.children is None:
+            c['vfirst'].append(NONE_INT)
+            c['vlast'].append(NONE_INT)
+        else:
+            c['vfirst'].append(len(vchildren))
+            vchildren.extend(net.children)
+            c['vlast'].append(len(vchildren))
+        c['start'].append(int(net.start))
+        c['end'].append(optint(net.end))
+        c['description'].append(sref(net.description))
+        c['restricted'].append(optint(net.restricted))
+        c['netclass'].append(sref(net.netclass))
+        c['archive'].append(sref(net.archive))
+        c['institutions'].append(sref(net.institutions))
+
+    c = cols['stations']
+    for sta in stations:
+        c['network'].append(sta.network)
+        c['first'].append(sta.first)
+        c['last'].append(sta.last)
+        c['code'].append(sref(sta.code))
+        c['latitude'].append(optfloat(sta.latitude))
+        c['longitude'].append(optfloat(sta.longitude))
+        c['description'].append(sref(sta.description))
+        c['start'].append(int(sta.start))
+        c['end'].append(optepoch(sta.end))
+        c['elevation'].append(optfloat(sta.elevation))
+        c['restricted'].append(optint(sta.restricted))
+
+    c = cols['sensorsLoc']
+    for loc in sensorsLoc:
+        c['station'].append(loc.station)
+        c['first'].append(loc.first)
+        c['last'].append(loc.last)
+        c['code'].append(sref(loc.code))
+
+    c = cols['streams']
+    for cha in streams:
+        c['sensorLoc'].append(cha.sensorLoc)
+        c['code'].append(sref(cha.code))
+        c['sensortype'].append(sref(cha.sensortype))
+        c['denominator'].append(optfloat(cha.denominator))
+        c['numerator'].append(optfloat(cha.numerator))
+        c['datalogger'].append(sref(cha.datalogger))
+        c['start'].append(int(cha.start))
+        c['end'].append(optepoch(cha.end))
+        c['restricted'].append(optint(cha.restricted))
+
+    # Streams sorted by (net, sta, cha, loc, start) to look for the epochs
+    # of a stream with a binary search. As the string table is sorted, the
+    # references can be compared instead of the strings.
+    netcode = cols['networks']['code']
+    stanet = cols['stations']['network']
+    stacode = cols['stations']['code']
+    locsta = cols['sensorsLoc']['station']
+    loccode = cols['sensorsLoc']['code']
+    chaloc = cols['streams']['sensorLoc']
+    chacode = cols['streams']['code']
+    chastart = cols['streams']['start']
+
+    def streamkey(idx):
+        loc = chaloc[idx]
+        sta = locsta[loc]
+        return (netcode[stanet[sta]], stacode[sta], chacode[idx],
+                loccode[loc], chastart[idx])
+
+    streamkeys = sorted(xrange(len(streams)), key=streamkey)
+
+    stroffsets = [0]
+    for s in strlist:
+        stroffsets.append(stroffsets[-1] + len(s))
+
+    # Lay out all the arrays one after the other. Offsets are relative to
+    # the end of the header and are fixed once its size is known.
+    chunks = []
+    size = [0]
+
+    def addchunk(data):
+        offset = size[0]
+        # Keep every array aligned to 8 bytes
+        data += '\0' * (_align(len(data)) - len(data))
+        chunks.append(data)
+        size[0] += len(data)
+        return offset
+
+    def addarray(coltype, values):
+        return [coltype, addchunk(_tobytes(coltype, values)), len(values)]
+
+    toc = {'strings': {'offsets': addarray('i', stroffsets),
+                       'blob': [addchunk(''.join(strlist)),
+                                stroffsets[-1]]},
+           'vchildren': addarray('i', vchildren),
+           'streamkeys': addarray('i', streamkeys),
+           'tables': {}}
+
+    for name, rows in tables:
+        toc['tables'][name] = {'rows': len(rows), 'columns': {}}
+        for col, coltype in LAYOUT[name]:
+            coltype = coltype if coltype != 's' else 'i'
+            toc['tables'][name]['columns'][col] = \
+                addarray(coltype, cols[name][col])
+
+    def relocated(base):
+        aux = json.loads(json.dumps(toc))
+        descs = [aux['strings']['offsets'], aux['strings']['blob'],
+                 aux['vchildren'], aux['streamkeys']]
+        for table in aux['tables'].itervalues():
+            descs.extend(table['columns'].itervalues())
+        for desc in descs:
+            desc[-2] += base
+        return json.dumps(aux)
+
+    # The length of the table of contents grows with the offsets in it
+    headersize = 0
+    while True:
+        tocstr = relocated(headersize)
+        needed = _align(len(MAGIC) + 8 + len(tocstr))
+        if needed <= headersize:
+            break
+        headersize = needed
+
+    header = MAGIC + struct.pack('=II', VERSION, len(tocstr)) + tocstr
+    result = bytearray(header + '\0' * (headersize - len(header)))
+    for data in chunks:
+        result.extend(data)
+    return result
+
+
+def write(filename, networks, stations, sensorsLoc, streams):
+    """Save the inventory in columnar format.
+
+    The file is written under a temporary name and then renamed, so that
+    processes which have the old version mapped in memory are not affected.
+
+    """
+
+    data = pack(networks, stations, sensorsLoc, streams)
+
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as fout:
+        os.chmod(tmpfile, 0o0664)
+        fout.write(data)
+
+    os.rename(tmpfile, filename)
@@ -0,0 +1,674 @@
+"""Indexes over the inventory of the Arclink web interface
+
+Auxiliary structures built once for every snapshot of the inventory and
+used by InventoryCache to avoid scanning all the stations or streams in
+every query.
+
+"""
+
+import math
+import bisect
+from array import array
+
+import invformat
+
+
+class SpatialGrid(object):
+    """Regular latitude/longitude grid with the stations in every cell.
+
+    A rectangular query visits only the cells overlapping the box and checks
+    the exact coordinates of the stations found there. Boxes crossing the
+    dateline (minlon > maxlon) are split in two.
+
+    """
+
+    def __init__(self, latitudes, longitudes, cellsize=1.0):
+        self.cellsize = float(cellsize)
+        self.nrows = int(math.ceil(180.0 / self.cellsize))
+        self.ncols = int(math.ceil(360.0 / self.cellsize))
+
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+
+        # Indexes of the stations in every non-empty cell
+        self.cells = {}
+        self.__add(xrange(len(latitudes)))
+
+    def __add(self, indexes):
+        for idx in indexes:
+            lat = self.latitudes[idx]
+            lon = self.longitudes[idx]
+            # Stations without coordinates can not be found by location
+            if math.isnan(lat) or math.isnan(lon):
+                continue
+
+            cell = (self.__row(lat), self.__col(lon))
+            try:
+                self.cells[cell].append(idx)
+            except KeyError:
+                self.cells[cell] = [idx]
+
+    def updated(self, latitudes, longitudes, kept, renewed):
+        """Return the grid of a new version of the stations.
+
+        kept has the new index of every station which has not changed (-1
+        for the rest) and renewed the indexes of the stations added or
+        changed, as given by invdelta.TableDelta.
+
+        """
+
+        result = object.__new__(SpatialGrid)
+        result.cellsize = self.cellsize
+        result.nrows = self.nrows
+        result.ncols = self.ncols
+        result.latitudes = latitudes
+        result.longitudes = longitudes
+
+        result.cells = {}
+        for (cell, indexes) in self.cells.iteritems():
+            indexes = [kept[idx] for idx in indexes if kept[idx] >= 0]
+            if indexes:
+                result.cells[cell] = indexes
+
+        result.__add(renewed)
+        return result
+
+    def __row(self, lat):
+        row = int((lat + 90.0) // self.cellsize)
+        return min(max(row, 0), self.nrows - 1)
+
+    def __col(self, lon):
+        col = int((lon + 180.0) // self.cellsize)
+        return min(max(col, 0), self.ncols - 1)
+
+    def query(self, latmin, latmax, lonmin, lonmax):
+        """Return the sorted indexes of the stations inside a box.
+
+        The limits are included. If lonmin is greater than lonmax, the box
+        crosses the dateline.
+
+        """
+
+        if latmin > latmax:
+            return []
+
+        if lonmin <= lonmax:
+            lonranges = [(lonmin, lonmax)]
+        else:
+            lonranges = [(lonmin, 180.0), (-180.0, lonmax)]
+
+        (r0, r1) = (self.__row(max(latmin, -90.0)),
+                    self.__row(min(latmax, 90.0)) + 1)
+
+        result = []
+        lats = self.latitudes
+        lons = self.longitudes
+        for (lon1, lon2) in lonranges:
+            if lon1 > 180.0 or lon2 < -180.0:
+                continue
+
+            (c0, c1) = (self.__col(max(lon1, -180.0)),
+                        self.__col(min(lon2, 180.0)) + 1)
+
+            # With big boxes it is cheaper to go through the non-empty cells
+            if (r1 - r0) * (c1 - c0) > len(self.cells):
+                cells = [cell for cell in self.cells
+                         if r0 <= cell[0] < r1 and c0 <= cell[1] < c1]
+            else:
+                cells = [(r, c) for r in xrange(r0, r1)
+                         for c in xrange(c0, c1)]
+
+            for cell in cells:
+                for idx in self.cells.get(cell, ()):
+                    if ((latmin <= lats[idx] <= latmax) and
+                            (lon1 <= lons[idx] <= lon2)):
+                        result.append(idx)
+
+        # A station could be in both longitude ranges if it is exactly on
+        # the dateline
+        return sorted(set(result))
+
+
+def unitVector(lat, lon):
+    """Position of a point of the sphere as a 3-D unit vector."""
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon),
+            math.sin(lat))
+
+
+def chord(dist):
+    """Length of the chord between two points of the unit sphere separated
+    by dist degrees.
+
+    """
+    dist = min(max(dist, 0.0), 180.0)
+    return 2.0 * math.sin(math.radians(dist) / 2.0)
+
+
+def boxDistance(node, p):
+    """Square of the distance from a point to the bounding box of a node."""
+    (low, high) = node[:2]
+    result = 0.0
+    for axis in range(3):
+        if p[axis] < low[axis]:
+            result += (low[axis] - p[axis]) ** 2
+        elif p[axis] > high[axis]:
+            result += (p[axis] - high[axis]) ** 2
+    return result
+
+
+class UnitVectorTree(object):
+    """k-d tree with the stations as 3-D unit vectors.
+
+    An annulus around a point of the sphere (minimum and maximum distance in
+    degrees) is a range of chord lengths, so that only the branches of the
+    tree whose bounding box can intersect it are visited.
+
+    The query is meant as a first filter. The stations returned are within a
+    margin of the annulus and the exact distance must still be checked with
+    geodesy.delazi.
+
+    """
+
+    leafsize = 16
+
+    def __init__(self, latitudes, longitudes, margin=1.0):
+        # Tolerance (in degrees) added to both sides of the annulus
+        self.margin = margin
+
+        points = self.__points(latitudes, longitudes, xrange(len(latitudes)))
+        self.root = self.__build(points) if points else None
+
+    @staticmethod
+    def __points(latitudes, longitudes, indexes):
+        points = []
+        for idx in indexes:
+            lat = latitudes[idx]
+            lon = longitudes[idx]
+            # Stations without coordinates can not be found by location
+            if math.isnan(lat) or math.isnan(lon):
+                continue
+            points.append((unitVector(lat, lon), idx))
+        return points
+
+    def __build(self, points):
+        """Return a node as (low corner, high corner, left, right, points)."""
+        low = tuple(min(p[0][axis] for p in points) for axis in range(3))
+        high = tuple(max(p[0][axis] for p in points) for axis in range(3))
+
+        if len(points) <= self.leafsize:
+            return (low, high, None, None, points)
+
+        # Split along the axis with the largest spread
+        axis = max(range(3), key=lambda a: high[a] - low[a])
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+
+        return (low, high, self.__build(points[:mid]),
+                self.__build(points[mid:]), None)
+
+    def updated(self, latitudes, longitudes, kept, renewed):
+        """Return the tree of a new version of the stations.
+
+        kept and renewed are as in SpatialGrid.updated. The stations which
+        are not kept are removed from the leaves and the renewed ones are
+        added to the leaf whose bounding box is the nearest. The boxes only
+        grow, so that they still contain all their points. If many stations
+        changed, the tree is built again to keep it balanced.
+
+        """
+
+        if len(renewed) * 10 > len(latitudes):
+            return UnitVectorTree(latitudes, longitudes, self.margin)
+
+        result = object.__new__(UnitVectorTree)
+        result.margin = self.margin
+        result.root = self.__remap(self.root, kept)
+
+        for point in self.__points(latitudes, longitudes, renewed):
+            result.root = self.__insert(result.root, point)
+
+        return result
+
+    def __remap(self, node, kept):
+        if node is None:
+            return None
+
+        (low, high, left, right, points) = node
+        if points is None:
+            return (low, high, self.__remap(left, kept),
+                    self.__remap(right, kept), None)
+
+        return (low, high, None, None,
+                [(p, kept[idx]) for (p, idx) in points if kept[idx] >= 0])
+
+    def __insert(self, node, point):
+        p = point[0]
+        if node is None:
+            return (p, p, None, None, [point])
+
+        (low, high, left, right, points) = node
+        low = tuple(min(low[axis], p[axis]) for axis in range(3))
+        high = tuple(max(high[axis], p[axis]) for axis in range(3))
+
+        if points is not None:
+            return (low, high, None, None, points + [point])
+
+        if boxDistance(left, p) <= boxDistance(right, p):
+            left = self.__insert(left, point)
+        else:
+            right = self.__insert(right, point)
+
+        return (low, high, left, right, None)
+
+    def query(self, lat, lon, mindist=None, maxdist=None):
+        """Return the sorted indexes of the stations whose distance (in
+        degrees) to a point could be between mindist and maxdist.
+
+        """
+
+        if self.root is None:
+            return []
+
+        q = unitVector(lat, lon)
+        cmin = chord(mindist - self.margin) if mindist is not None else 0.0
+        cmax = chord(maxdist + self.margin) if maxdist is not None else 2.0
+        cmin2 = cmin * cmin
+        cmax2 = cmax * cmax
+
+        result = []
+        pending = [self.root]
+        while pending:
+            (low, high, left, right, points) = pending.pop()
+
+            # Square of the minimum and maximum distance from the point to
+            # the bounding box of the node
+            near = 0.0
+            far = 0.0
+            for axis in range(3):
+                lo = low[axis] - q[axis]
+                hi = high[axis] - q[axis]
+                if lo > 0.0:
+                    near += lo * lo
+                elif hi < 0.0:
+                    near += hi * hi
+                far += max(lo * lo, hi * hi)
+
+            if near > cmax2 or far < cmin2:
+                continue
+
+            if points is None:
+                pending.append(left)
+                pending.append(right)
+                continue
+
+            for (p, idx) in points:
+                d2 = ((p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 +
+                      (p[2] - q[2]) ** 2)
+                if cmin2 <= d2 <= cmax2:
+                    result.append(idx)
+
+        result.sort()
+        return result
+
+
+class EpochIndex(object):
+    """Sorted starts and ends of a set of epochs (integer seconds).
+
+    The position of every epoch in both orders is stored, so that the
+    epochs active in a period are found with two binary searches and then
+    checked in constant time.
+
+    """
+
+    def __init__(self, starts, ends, empty):
+        # Epochs without start or end (empty) are open on that side
+        n = len(starts)
+        first = -float('inf')
+        last = float('inf')
+
+        self.byStart = sorted(xrange(n), key=lambda i: starts[i])
+        self.starts = [first if starts[i] == empty else starts[i]
+                       for i in self.byStart]
+        self.byEnd = sorted(xrange(n), key=lambda i: (ends[i] == empty,
+                                                      ends[i]))
+        self.ends = [last if ends[i] == empty else ends[i]
+                     for i in self.byEnd]
+
+        self.__rank()
+
+    def __rank(self):
+        """Store the position of every epoch in both orders."""
+        n = len(self.byStart)
+
+        self.startRank = array('i', [0] * n)
+        for rank, i in enumerate(self.byStart):
+            self.startRank[i] = rank
+
+        self.endRank = array('i', [0] * n)
+        for rank, i in enumerate(self.byEnd):
+            self.endRank[i] = rank
+
+    def updated(self, starts, ends, empty, kept, renewed):
+        """Return the index of a new version of the epochs.
+
+        kept has the new index of every epoch which has not changed (-1 for
+        the rest) and renewed the indexes of the epochs added or changed, as
+        given by invdelta.TableDelta. The epochs kept are still sorted and
+        the renewed ones are inserted with a binary search. If many epochs
+        changed, the index is built again.
+
+        """
+
+        if len(renewed) * 10 > len(starts):
+            return EpochIndex(starts, ends, empty)
+
+        first = -float('inf')
+        last = float('inf')
+
+        result = object.__new__(EpochIndex)
+        result.byStart = [kept[i] for i in self.byStart if kept[i] >= 0]
+        result.starts = [value for (i, value) in zip(self.byStart,
+                                                     self.starts)
+                         if kept[i] >= 0]
+        result.byEnd = [kept[i] for i in self.byEnd if kept[i] >= 0]
+        result.ends = [value for (i, value) in zip(self.byEnd, self.ends)
+                       if kept[i] >= 0]
+
+        for i in renewed:
+            value = first if starts[i] == empty else starts[i]
+            pos = bisect.bisect_right(result.starts, value)
+            result.starts.insert(pos, value)
+            result.byStart.insert(pos, i)
+
+            value = last if ends[i] == empty else ends[i]
+            pos = bisect.bisect_right(result.ends, value)
+            result.ends.insert(pos, value)
+            result.byEnd.insert(pos, i)
+
+        result.__rank()
+        return result
+
+    def active(self, start=None, end=None):
+        """Return the epochs which overlap the period from start to end.
+
+        The limits are included and None means no limit.
+
+        """
+
+        if end is None:
+            lastStart = len(self.starts)
+        else:
+            lastStart = bisect.bisect_right(self.starts, end)
+
+        if start is None:
+            firstEnd = 0
+        else:
+            firstEnd = bisect.bisect_left(self.ends, start)
+
+        return ActiveEpochs(self, lastStart, firstEnd)
+
+
+class ActiveEpochs(object):
+    """Epochs of an EpochIndex active in a period."""
+
+    def __init__(self, index, lastStart, firstEnd):
+        self.index = index
+        self.lastStart = lastStart
+        self.firstEnd = firstEnd
+
+    def __contains__(self, idx):
+        return (self.index.startRank[idx] < self.lastStart and
+                self.index.endRank[idx] >= self.firstEnd)
+
+    def __iter__(self):
+        """Iterate through the (unsorted) indexes of the active epochs."""
+        index = self.index
+        if self.lastStart <= len(index.ends) - self.firstEnd:
+            for i in index.byStart[:self.lastStart]:
+                if index.endRank[i] >= self.firstEnd:
+                    yield i
+        else:
+            for i in index.byEnd[self.firstEnd:]:
+                if index.startRank[i] < self.lastStart:
+                    yield i
+
+
+class NetworkBits(object):
+    """Sets of networks sharing an attribute, as bits of an integer.
+
+    The bit i corresponds to the network with index i. Besides the sets for
+    the restricted flag, the network class and the virtual networks, the
+    networks ending before and starting after every year are kept as
+    cumulative sets.
+
+    """
+
+    def __init__(self, networks):
+        self.all = (1 << len(networks)) - 1
+        self.restricted = {}
+        self.netclass = {}
+        self.virtual = 0
+
+        starts = []
+        ends = []
+        for i, netw in enumerate(networks):
+            bit = 1 << i
+            self.restricted[netw.restricted] = \
+                self.restricted.get(netw.restricted, 0) | bit
+            self.netclass[netw.netclass] = \
+                self.netclass.get(netw.netclass, 0) | bit
+
+            # Virtual networks have no pointers to first and last child
+            if (netw.first is None) and (netw.last is None):
+                self.virtual |= bit
+
+            # Networks without start or end year are never discarded
+            if netw.start:
+                starts.append((netw.start, bit))
+            if netw.end:
+                ends.append((netw.end, bit))
+
+        starts.sort()
+        ends.sort()
+
+        # endedBy[k] has the networks with the k earliest end years
+        self.endYears = [year for (year, bit) in ends]
+        self.endedBy = [0]
+        for (year, bit) in ends:
+            self.endedBy.append(self.endedBy[-1] | bit)
+
+        # startedFrom[k] has the networks with all but the k earliest start
+        # years
+        self.startYears = [year for (year, bit) in starts]
+        self.startedFrom = [0]
+        for (year, bit) in reversed(starts):
+            self.startedFrom.append(self.startedFrom[-1] | bit)
+        self.startedFrom.reverse()
+
+    def endingBefore(self, year):
+        """Networks whose end year is before year."""
+        return self.endedBy[bisect.bisect_left(self.endYears, year)]
+
+    def startingAfter(self, year):
+        """Networks whose start year is after year."""
+        return self.startedFrom[bisect.bisect_right(self.startYears, year)]
+
+
+def bitIndexes(bits):
+    """Return the positions of the bits set in an integer."""
+    result = []
+    while bits:
+        low = bits & -bits
+        result.append(low.bit_length() - 1)
+        bits ^= low
+    return result
+
+
+class BandCodes(object):
+    """Small integers for the band and instrument codes of the streams.
+
+    The band code is made of the first two letters of the channel code
+    (e.g. 'BH' for 'BHZ'). Every one found in the inventory gets an integer
+    and every channel code (as reference to the string table) is mapped to
+    the integer of its band code.
+
+    """
+
+    def __init__(self, inventory):
+        strings = inventory.strings
+
+        self.ids = {}
+        self.codes = []
+        self.byCode = {}
+        for ref in inventory.streamCodes():
+            band = strings[ref][:2]
+            if band not in self.ids:
+                self.ids[band] = len(self.codes)
+                self.codes.append(band)
+            self.byCode[ref] = self.ids[band]
+
+    def lookup(self, bands):
+        """Return the set of integers of some band codes.
+
+        Band codes which are not present in the inventory are ignored.
+
+        """
+
+        return set(self.ids[band] for band in bands if band in self.ids)
+
+
+class StreamSummary(object):
+    """Streams of a station with the attributes needed to list them.
+
+    All the attributes are lists with one element per stream, sorted by
+    location/channel code and restriction (like the lists returned by
+    InventoryCache). Band codes are given as integers of BandCodes and
+    sensor types as references to the string table. bandCounts has the
+    number of streams with every band code.
+
+    """
+
+    __slots__ = ('streams', 'locch', 'bands', 'sps', 'sensortypes',
+                 'restricted', 'bandCounts')
+
+    def __init__(self, inventory, statidx, bandCodes):
+        strings = inventory.strings
+        stations = inventory.stations.columns
+        locs = inventory.sensorsLoc.columns
+        streams = inventory.streams.columns
+        bandOf = bandCodes.byCode
+
+        rows = []
+        for loc in xrange(stations['first'][statidx],
+                          stations['last'][statidx]):
+            loccode = strings[locs['code'][loc]]
+
+            for ch in xrange(locs['first'][loc], locs['last'][loc]):
+                coderef = streams['code'][ch]
+
+                # Calculate sps for the stream
+                try:
+                    sps = float(streams['numerator'][ch] /
+                                streams['denominator'][ch])
+                    if math.isnan(sps):
+                        sps = None
+                except ZeroDivisionError:
+                    sps = None
+
+                restricted = streams['restricted'][ch]
+                if restricted == invformat.NONE_INT:
+                    restricted = None
+
+                rows.append((ch, '%s.%s' % (loccode, strings[coderef]),
+                             bandOf[coderef], sps,
+                             streams['sensortype'][ch], restricted))
+
+        rows.sort(key=lambda row: (row[1], row[5]))
+
+        (self.streams, self.locch, self.bands, self.sps, self.sensortypes,
+         self.restricted) = [list(col) for col in zip(*rows)] or \
+            ([], [], [], [], [], [])
+
+        self.bandCounts = {}
+        for band in self.bands:
+            self.bandCounts[band] = self.bandCounts.get(band, 0) + 1
+
+
+class StreamSummaries(object):
+    """Summaries of the streams of every station, built when first needed."""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.bandCodes = BandCodes(inventory)
+        self.summaries = [None] * len(inventory.stations)
+
+    def __getitem__(self, statidx):
+        summary = self.summaries[statidx]
+        if summary is None:
+            summary = StreamSummary(self.inventory, statidx, self.bandCodes)
+            self.summaries[statidx] = summary
+        return summary
+
+
+def mergeBandCounts(summaries, stations):
+    """Add up the band code counts of the streams of some stations."""
+    counts = {}
+    for statidx in stations:
+        for band, count in summaries[statidx].bandCounts.iteritems():
+            counts[band] = counts.get(band, 0) + count
+    return counts
+
+
+class NetworkBandCounts(object):
+    """Band code counts of the streams of every network, built when first
+    needed.
+
+    The stations counted are the ones selected by InventoryCache for the
+    network alone: only the first epoch of every station code in normal
+    networks and all the stations of virtual networks.
+
+    """
+
+    def __init__(self, inventory, summaries):
+        self.inventory = inventory
+        self.summaries = summaries
+        self.counts = [None] * len(inventory.networks)
+
+    def __getitem__(self, netidx):
+        counts = self.counts[netidx]
+        if counts is None:
+            netw = self.inventory.networks[netidx]
+            if (netw.first is not None) and (netw.last is not None):
+                codes = self.inventory.stations.column('code')
+                seen = set()
+                stations = []
+                for s in xrange(netw.first, netw.last):
+                    if codes[s] not in seen:
+                        seen.add(codes[s])
+                        stations.append(s)
+            else:
+                stations = netw.children
+
+            counts = mergeBandCounts(self.summaries, stations)
+            self.counts[netidx] = counts
+        return counts
+
+
+def remapIndexes(index, kept):
+    """Renumber the lists of indexes of a dictionary, e.g. the stations
+    with every code.
+
+    kept is as in SpatialGrid.updated. The indexes which are not kept are
+    removed, as well as the keys left without indexes.
+
+    """
+
+    result = {}
+    for (key, indexes) in index.iteritems():
+        indexes = [kept[i] for i in indexes if kept[i] >= 0]
+        if indexes:
+            indexes.sort()
+            result[key] = indexes
+    return result
@@ -0,0 +1,538 @@
+"""Segmented storage of the inventory for the Arclink web interface
+
+The inventory is stored in one file with a directory and one segment per
+network. The directory has the string table, the networks and the stations
+(with their coordinates) in the columnar format (invformat.py) and is
+always kept in memory. A segment has the sensor locations and the streams
+of the stations of one network, with the same columns.
+
+A segment is read from the file the first time one of its rows is needed.
+The segments read are kept in a least recently used cache bounded by their
+total size, so that the memory used by a process depends on the networks
+it is asked about and not on the size of the inventory. The indexes of the
+rows are the same as in the columnar format.
+
+"""
+
+import os
+import mmap
+import json
+import bisect
+import ctypes
+import struct
+
+import invformat
+from lrucache import LRUCache
+
+MAGIC = 'WDC3SEG\0'
+VERSION = 1
+
+# Default maximum size of the segments kept in memory (in bytes)
+MAXSIZE = 256 * 1024 * 1024
+
+# Tables stored in the segments of the networks
+SEGMENTED = ('sensorsLoc', 'streams')
+
+# Columns describing every segment
+SEGMENTCOLS = [('network', 'i'), ('lfirst', 'i'), ('llast', 'i'),
+               ('sfirst', 'i'), ('slast', 'i'), ('offset', 'q'),
+               ('size', 'q')]
+
+
+def _coltype(coltype):
+    """Type of the values stored in a column (references are integers)."""
+    return 'i' if coltype == 's' else coltype
+
+
+def _segmentLayout(counts):
+    """Position of every column in a segment.
+
+    counts has the number of rows of every table in the segment. Returns
+    a list of (table, column, coltype, offset, count) and the size of the
+    segment. The arrays are aligned to 8 bytes as in the columnar format.
+
+    """
+
+    layout = []
+    size = 0
+    for name in SEGMENTED:
+        for (col, coltype) in invformat.LAYOUT[name]:
+            coltype = _coltype(coltype)
+            layout.append((name, col, coltype, size, counts[name]))
+            size += invformat._align(
+                counts[name] * ctypes.sizeof(invformat.CTYPES[coltype]))
+    return (layout, size)
+
+
+def _slice(column, coltype, first, last):
+    """Binary representation of the values of a column from first to last."""
+    itemsize = ctypes.sizeof(invformat.CTYPES[coltype])
+    return ctypes.string_at(ctypes.addressof(column) + first * itemsize,
+                            (last - first) * itemsize)
+
+
+def write(filename, networks, stations, sensorsLoc, streams):
+    """Save the inventory in segmented format.
+
+    The sensor locations and streams of the stations of every network must
+    be contiguous, as written by update-metadata.py. The file is written
+    under a temporary name and then renamed, so that processes which have
+    the old version open are not affected.
+
+    """
+
+    # The values are encoded as in the columnar format
+    inv = invformat.ColumnarInventory(
+        invformat.pack(networks, stations, sensorsLoc, streams))
+
+    nets = inv.networks.columns
+    stats = inv.stations.columns
+    locs = inv.sensorsLoc.columns
+
+    # Sensor locations and streams of the stations of every real network
+    segments = dict((col, []) for (col, coltype) in SEGMENTCOLS)
+    lnext = 0
+    snext = 0
+    for i in xrange(len(inv.networks)):
+        if nets['first'][i] == invformat.NONE_INT or \
+                nets['last'][i] == invformat.NONE_INT:
+            continue
+
+        segments['network'].append(i)
+        segments['lfirst'].append(lnext)
+        segments['sfirst'].append(snext)
+
+        for s in xrange(nets['first'][i], nets['last'][i]):
+            if stats['first'][s] != lnext:
+                raise ValueError('Sensor locations of network %s are not '
+                                 'contiguous' % inv.strings[nets['code'][i]])
+            lnext = stats['last'][s]
+
+        for l in xrange(segments['lfirst'][-1], lnext):
+            if locs['first'][l] != snext:
+                raise ValueError('Streams of network %s are not contiguous'
+                                 % inv.strings[nets['code'][i]])
+            snext = locs['last'][l]
+
+        segments['llast'].append(lnext)
+        segments['slast'].append(snext)
+
+    if lnext != len(inv.sensorsLoc) or snext != len(inv.streams):
+        raise ValueError('Sensor locations or streams without network')
+
+    # Segments are stored one after the other after the directory
+    layouts = []
+    offset = 0
+    for pos in xrange(len(segments['network'])):
+        (layout, size) = _segmentLayout(
+            {'sensorsLoc': segments['llast'][pos] - segments['lfirst'][pos],
+             'streams': segments['slast'][pos] - segments['sfirst'][pos]})
+        layouts.append(layout)
+        segments['offset'].append(offset)
+        segments['size'].append(size)
+        offset += size
+
+    # Stations sorted by network and station code to look for the epochs of
+    # a stream. As the string table is sorted, the references can be
+    # compared instead of the strings.
+    stationkeys = sorted(xrange(len(inv.stations)),
+                         key=lambda s: (nets['code'][stats['network'][s]],
+                                        stats['code'][s]))
+
+    strings = [inv.strings[i] for i in xrange(len(inv.strings))]
+    stroffsets = [0]
+    for s in strings:
+        stroffsets.append(stroffsets[-1] + len(s))
+
+    # Lay out the arrays of the directory one after the other. Offsets are
+    # relative to the end of the header.
+    chunks = []
+    size = [0]
+
+    def addchunk(data):
+        offset = size[0]
+        # Keep every array aligned to 8 bytes
+        data += '\0' * (invformat._align(len(data)) - len(data))
+        chunks.append(data)
+        size[0] += len(data)
+        return offset
+
+    def addarray(coltype, values):
+        return [coltype, addchunk(invformat._tobytes(coltype, values)),
+                len(values)]
+
+    def addcolumn(column, coltype):
+        return [coltype, addchunk(_slice(column, coltype, 0, len(column))),
+                len(column)]
+
+    toc = {'strings': {'offsets': addarray('i', stroffsets),
+                       'blob': [addchunk(''.join(strings)),
+                                stroffsets[-1]]},
+           'vchildren': addcolumn(inv.vchildren, 'i'),
+           'stationkeys': addarray('i', stationkeys),
+           'streamcodes': addarray('i',
+                                   sorted(set(inv.streams.column('code')))),
+           'segments': dict((col, addarray(coltype, segments[col]))
+                            for (col, coltype) in SEGMENTCOLS),
+           'rows': dict((name, len(getattr(inv, name)))
+                        for name in SEGMENTED),
+           'tables': {}}
+
+    for name in ('networks', 'stations'):
+        table = getattr(inv, name)
+        toc['tables'][name] = {'rows': len(table), 'columns': {}}
+        for (col, coltype) in invformat.LAYOUT[name]:
+            toc['tables'][name]['columns'][col] = \
+                addcolumn(table.columns[col], _coltype(coltype))
+
+    # The segments start after the directory
+    toc['directory'] = size[0]
+
+    tocstr = json.dumps(toc)
+    header = MAGIC + struct.pack('=II', VERSION, len(tocstr)) + tocstr
+    header += '\0' * (invformat._align(len(header)) - len(header))
+
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as fout:
+        os.chmod(tmpfile, 0o0664)
+        fout.write(header)
+        for data in chunks:
+            fout.write(data)
+
+        for (pos, layout) in enumerate(layouts):
+            for (name, col, coltype, offset, count) in layout:
+                first = segments['lfirst' if name == 'sensorsLoc'
+                                 else 'sfirst'][pos]
+                data = _slice(getattr(inv, name).columns[col], coltype,
+                              first, first + count)
+                fout.write(data + '\0' * (invformat._align(len(data)) -
+                                          len(data)))
+
+    os.rename(tmpfile, filename)
+
+
+class Segment(object):
+    """Sensor locations and streams of the stations of one network.
+
+    The tables have the same interface as the ones of the columnar format,
+    with the rows numbered from the first one of the segment. The pointers
+    stored in the rows are the indexes in the whole inventory. The length
+    of a segment is the size of its data in bytes.
+
+    """
+
+    def __init__(self, inventory, data, counts):
+        self.strings = inventory.strings
+        self.size = len(data)
+
+        columns = dict((name, {}) for name in SEGMENTED)
+        for (name, col, coltype, offset, count) in _segmentLayout(counts)[0]:
+            columns[name][col] = (invformat.CTYPES[coltype] *
+                                  count).from_buffer(data, offset)
+
+        for name in SEGMENTED:
+            setattr(self, name, invformat.Table(self, name, counts[name],
+                                                columns[name],
+                                                invformat.ROWS[name]))
+
+    def __len__(self):
+        return self.size
+
+
+class Column(object):
+    """Column of a segmented table.
+
+    The values are read from the segment of every row. The values of the
+    last segment used are kept, so that consecutive rows are read without
+    looking for their segment again.
+
+    """
+
+    def __init__(self, inventory, table, name):
+        self.inventory = inventory
+        self.table = table
+        self.name = name
+        self.size = inventory.rows[table]
+
+        # First and last rows of the last segment used and their values
+        self.last = (0, 0, ())
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(self.size))]
+
+        (first, last, values) = self.last
+        if first <= idx < last:
+            return values[idx - first]
+
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError('%s index out of range' % self.table)
+
+        (first, segment) = self.inventory.segmentOf(self.table, idx)
+        values = getattr(segment, self.table).columns[self.name]
+        self.last = (first, first + len(values), values)
+        return values[idx - first]
+
+    def __iter__(self):
+        for idx in xrange(self.size):
+            yield self[idx]
+
+
+class Table(invformat.Table):
+    """Table of the sensor locations or the streams, whose rows are read
+    from the segments of the networks.
+
+    """
+
+    def __init__(self, inventory, name, size):
+        columns = dict((col, Column(inventory, name, col))
+                       for (col, coltype) in invformat.LAYOUT[name])
+        invformat.Table.__init__(self, inventory, name, size, columns,
+                                 invformat.ROWS[name])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError('%s index out of range' % self.name)
+
+        (first, segment) = self.inventory.segmentOf(self.name, idx)
+        return self._makerow(segment, idx - first)
+
+    def __iter__(self):
+        for idx in xrange(self._size):
+            yield self[idx]
+
+
+class SegmentedInventory(object):
+    """Inventory read from a file in segmented format.
+
+    The directory is read when the inventory is opened and the segments
+    when they are first needed. The tables have the same interface as the
+    ones of invformat.ColumnarInventory.
+
+    """
+
+    def __init__(self, filename, maxsize=MAXSIZE):
+        with open(filename, 'rb') as fin:
+            try:
+                self.map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError) as e:
+                raise ValueError('Not an inventory in segmented format: %s'
+                                 % e)
+
+        start = len(MAGIC) + 8
+        if len(self.map) < start or self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not an inventory in segmented format')
+
+        version, toclen = struct.unpack('=II', self.map[len(MAGIC):start])
+        if version != VERSION:
+            raise ValueError('Unsupported version of the segmented format: '
+                             '%d' % version)
+
+        toc = json.loads(self.map[start:start + toclen])
+
+        # The directory is always kept in memory
+        self.base = invformat._align(start + toclen)
+        self.buffer = bytearray(self.map[self.base:
+                                         self.base + toc['directory']])
+        self.segmentsBase = self.base + toc['directory']
+
+        offsets = self._array(toc['strings']['offsets'])
+        self.strings = invformat.StringTable(offsets, self.buffer,
+                                             toc['strings']['blob'][0])
+        self.vchildren = self._array(toc['vchildren'])
+        self.stationkeys = self._array(toc['stationkeys'])
+        self.streamcodes = self._array(toc['streamcodes'])
+        self.segments = dict((col, self._array(toc['segments'][col]))
+                             for (col, coltype) in SEGMENTCOLS)
+        self.rows = toc['rows']
+
+        for name in ('networks', 'stations'):
+            table = toc['tables'][name]
+            columns = dict((col, self._array(table['columns'][col]))
+                           for (col, coltype) in invformat.LAYOUT[name])
+            setattr(self, name, invformat.Table(self, name, table['rows'],
+                                                columns,
+                                                invformat.ROWS[name]))
+
+        # First row of every segment with rows of a table, to find the
+        # segment of a row with a binary search
+        self.firsts = {}
+        self.positions = {}
+        for (name, first, last) in (('sensorsLoc', 'lfirst', 'llast'),
+                                    ('streams', 'sfirst', 'slast')):
+            self.positions[name] = [
+                pos for pos in xrange(len(self.segments['network']))
+                if self.segments[last][pos] > self.segments[first][pos]]
+            self.firsts[name] = [self.segments[first][pos]
+                                 for pos in self.positions[name]]
+
+        for name in SEGMENTED:
+            setattr(self, name, Table(self, name, self.rows[name]))
+
+        # Segments already read
+        self.cache = LRUCache(maxsize)
+
+    def _array(self, desc):
+        coltype, offset, count = desc
+        return (invformat.CTYPES[coltype] * count).from_buffer(self.buffer,
+                                                               offset)
+
+    def segment(self, pos):
+        """Return a segment, reading it from the file if needed."""
+        segment = self.cache.get(pos)
+        if segment is None:
+            segs = self.segments
+            start = self.segmentsBase + segs['offset'][pos]
+            data = bytearray(self.map[start:start + segs['size'][pos]])
+            segment = Segment(self, data,
+                              {'sensorsLoc': segs['llast'][pos] -
+                               segs['lfirst'][pos],
+                               'streams': segs['slast'][pos] -
+                               segs['sfirst'][pos]})
+            self.cache.put(pos, segment)
+
+        return segment
+
+    def segmentOf(self, table, idx):
+        """Return the segment with a row of a table and the index of its
+        first row of the table.
+
+        """
+
+        firsts = self.firsts[table]
+        pos = bisect.bisect_right(firsts, idx) - 1
+        return (firsts[pos], self.segment(self.positions[table][pos]))
+
+    def streamCodes(self):
+        """Return the set of references of the channel codes."""
+        return set(self.streamcodes)
+
+    def streamEpochs(self, net, sta, cha, loc):
+        """Return the indexes of all the epochs of a stream, sorted by
+        start.
+
+        The stations are searched in the list sorted by network and station
+        code. Only the segments of their networks are read.
+
+        """
+
+        refs = [self.strings.lookup(value) for value in (net, sta, cha, loc)]
+        if invformat.NONE_INT in refs:
+            return []
+
+        key = tuple(refs[:2])
+        keys = self.stationkeys
+        nets = self.networks.columns
+        stats = self.stations.columns
+
+        def stationKey(s):
+            return (nets['code'][stats['network'][s]], stats['code'][s])
+
+        lo = 0
+        hi = len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if stationKey(keys[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        locs = self.sensorsLoc.columns
+        streams = self.streams.columns
+
+        result = []
+        while lo < len(keys) and stationKey(keys[lo]) == key:
+            s = keys[lo]
+            for l in xrange(stats['first'][s], stats['last'][s]):
+                if locs['code'][l] != refs[3]:
+                    continue
+
+                for c in xrange(locs['first'][l], locs['last'][l]):
+                    if streams['code'][c] == refs[2]:
+                        result.append(c)
+            lo += 1
+
+        starts = streams['start']
+        result.sort(key=lambda c: (starts[c], c))
+        return result
+
+    def streamKey(self, idx):
+        """Return the (net, sta, cha, loc) tuple of a stream."""
+        s = self.strings
+        loc = self.streams.columns['sensorLoc'][idx]
+        sta = self.sensorsLoc.columns['station'][loc]
+        net = self.stations.columns['network'][sta]
+        return (s[self.networks.columns['code'][net]],
+                s[self.stations.columns['code'][sta]],
+                s[self.streams.columns['code'][idx]],
+                s[self.sensorsLoc.columns['code'][loc]])
+
+
+def load(filename, maxsize=MAXSIZE):
+    """Open an inventory in segmented format.
+
+    maxsize is the maximum size of the segments kept in memory (in bytes).
+
+    """
+
+    if not os.path.exists(filename):
+        raise IOError('%s not found' % filename)
+
+    return SegmentedInventory(filename, maxsize)
+
+
+class EpochIndex(object):
+    """Epochs of a segmented table active in a period, with the same
+    interface as invindex.EpochIndex.
+
+    Only the segments of the epochs checked are read.
+
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def active(self, start=None, end=None):
+        """Return the epochs which overlap the period from start to end.
+
+        The limits are included and None means no limit.
+
+        """
+
+        return ActiveEpochs(self.table, start, end)
+
+
+class ActiveEpochs(object):
+    """Epochs of an EpochIndex active in a period."""
+
+    def __init__(self, table, start, end):
+        self.table = table
+        self.start = start
+        self.end = end
+
+    def __contains__(self, idx):
+        columns = self.table.columns
+        if self.end is not None and columns['start'][idx] > self.end:
+            return False
+
+        epochEnd = columns['end'][idx]
+        return (self.start is None or epochEnd == invformat.NONE_EPOCH or
+                epochEnd >= self.start)
+
+    def __iter__(self):
+        """Iterate through the indexes of the active epochs.
+
+        All the segments are read.
+
+        """
+
+        for idx in xrange(len(self.table)):
+            if idx in self:
+                yield idx
@@ -0,0 +1,633 @@
+"""SQLite storage of the inventory for the Arclink web interface
+
+The inventory is stored in a SQLite database with one table for the
+networks, stations, sensor locations and streams. The columns and the
+string table are the same as in the columnar format (invformat.py), with
+NULL instead of the values used there for None, so that the rows are
+built in the same way.
+
+Instead of building its own indexes in memory, every process using the
+database queries the B-tree indexes on codes and epochs and an R*Tree with
+the coordinates of the stations. Rows and column values are read in blocks
+and only a limited number of blocks are kept in memory, so that the memory
+used by a process does not depend on the size of the inventory. The pages
+of the database are mapped in memory and shared by all the processes.
+
+"""
+
+import os
+import math
+import sqlite3
+import threading
+
+import invformat
+
+
+# Version of the schema of the database
+VERSION = 1
+
+# Number of values read at once from a column and maximum number of blocks
+# kept in memory
+BLOCKSIZE = 256
+MAXBLOCKS = 1024
+
+# Size of the database mapped in memory by every connection
+MMAPSIZE = 1024 * 1024 * 1024
+
+# Value used in the columns of the columnar format instead of None (NULL)
+EMPTY = {'s': invformat.NONE_INT,
+         'i': invformat.NONE_INT,
+         'b': invformat.NONE_INT,
+         'q': invformat.NONE_EPOCH,
+         'd': float('nan')}
+
+INDEXES = ['CREATE INDEX stations_code ON stations (code, network)',
+           'CREATE INDEX stations_start ON stations (start)',
+           'CREATE INDEX stations_end ON stations ("end")',
+           'CREATE INDEX streams_start ON streams (start)',
+           'CREATE INDEX streams_end ON streams ("end")',
+           'CREATE INDEX vchildren_station ON vchildren (station, network)']
+
+
+def _columns(name):
+    """Names of the columns of a table, quoted for SQL."""
+    return ', '.join('"%s"' % col for (col, coltype) in invformat.LAYOUT[name])
+
+
+def _isEmpty(value, coltype):
+    if coltype == 'd':
+        return math.isnan(value)
+    return value == EMPTY[coltype]
+
+
+def write(filename, networks, stations, sensorsLoc, streams):
+    """Save the inventory in a SQLite database.
+
+    The database is written under a temporary name and then renamed, so
+    that processes which have the old version open are not affected.
+
+    """
+
+    # The values are encoded as in the columnar format
+    inv = invformat.ColumnarInventory(
+        invformat.pack(networks, stations, sensorsLoc, streams))
+
+    tmpfile = filename + '.tmp'
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+
+    conn = sqlite3.connect(tmpfile)
+    conn.text_factory = str
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+
+        conn.execute('CREATE TABLE metadata (name TEXT PRIMARY KEY, value)')
+        conn.execute('INSERT INTO metadata VALUES (?, ?)',
+                     ('version', VERSION))
+
+        conn.execute('CREATE TABLE strings (id INTEGER PRIMARY KEY, '
+                     'value TEXT NOT NULL UNIQUE)')
+        conn.executemany('INSERT INTO strings VALUES (?, ?)',
+                         enumerate(inv.strings[i]
+                                   for i in xrange(len(inv.strings))))
+
+        conn.execute('CREATE TABLE vchildren (id INTEGER PRIMARY KEY, '
+                     'network INTEGER, station INTEGER)')
+        vnetwork = [None] * len(inv.vchildren)
+        nets = inv.networks.columns
+        for i in xrange(len(inv.networks)):
+            if nets['vfirst'][i] != invformat.NONE_INT:
+                for pos in xrange(nets['vfirst'][i], nets['vlast'][i]):
+                    vnetwork[pos] = i
+        conn.executemany('INSERT INTO vchildren VALUES (?, ?, ?)',
+                         ((pos, vnetwork[pos], s)
+                          for (pos, s) in enumerate(inv.vchildren)))
+
+        for (name, cols) in sorted(invformat.LAYOUT.iteritems()):
+            table = getattr(inv, name)
+            conn.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, %s)' %
+                         (name, _columns(name)))
+
+            columns = [(table.columns[col], coltype)
+                       for (col, coltype) in cols]
+            rows = ([i] + [None if _isEmpty(c[i], coltype) else c[i]
+                           for (c, coltype) in columns]
+                    for i in xrange(len(table)))
+            conn.executemany('INSERT INTO %s VALUES (%s)' %
+                             (name, ', '.join('?' * (len(cols) + 1))), rows)
+
+        for sql in INDEXES:
+            conn.execute(sql)
+
+        # Stations without coordinates can not be found by location
+        stats = inv.stations.columns
+        located = [i for i in xrange(len(inv.stations))
+                   if not (math.isnan(stats['latitude'][i]) or
+                           math.isnan(stats['longitude'][i]))]
+        try:
+            conn.execute('CREATE VIRTUAL TABLE stationBoxes USING '
+                         'rtree(id, minLat, maxLat, minLon, maxLon)')
+            conn.executemany('INSERT INTO stationBoxes VALUES (?, ?, ?, ?, ?)',
+                             ((i, stats['latitude'][i], stats['latitude'][i],
+                               stats['longitude'][i], stats['longitude'][i])
+                              for i in located))
+        except sqlite3.OperationalError:
+            # SQLite without the R*Tree module
+            conn.execute('CREATE INDEX stations_position ON stations '
+                         '(latitude, longitude)')
+
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.chmod(tmpfile, 0o0664)
+    os.rename(tmpfile, filename)
+
+
+class BlockCache(object):
+    """Blocks of values read from the database.
+
+    When the maximum number of blocks is reached, all of them are
+    discarded. Queries go through one connection protected by a lock.
+
+    """
+
+    def __init__(self, conn, maxblocks=MAXBLOCKS):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.maxblocks = maxblocks
+        self.blocks = {}
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def add(self, key, values):
+        """Keep a block of values."""
+        if len(self.blocks) >= self.maxblocks:
+            self.blocks.clear()
+        self.blocks[key] = values
+
+
+class Column(object):
+    """Read-only column of a table of the database.
+
+    Values are returned as in the columns of the columnar format.
+
+    """
+
+    def __init__(self, cache, table, name, coltype, size):
+        self.cache = cache
+        self.table = table
+        self.name = name
+        self.empty = EMPTY[coltype]
+        self.size = size
+        self.sql = 'SELECT "%s" FROM %s WHERE id >= ? AND id < ? ' \
+                   'ORDER BY id' % (name, table)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(self.size))]
+
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError('%s.%s index out of range' %
+                             (self.table, self.name))
+
+        first = idx - idx % BLOCKSIZE
+        key = (self.table, self.name, first)
+        values = self.cache.blocks.get(key)
+        if values is None:
+            values = self.__read(first)
+            self.cache.add(key, values)
+        return values[idx - first]
+
+    def __iter__(self):
+        for first in xrange(0, self.size, BLOCKSIZE):
+            for value in self.__read(first):
+                yield value
+
+    def __read(self, first):
+        empty = self.empty
+        return [empty if value is None else value
+                for (value,) in self.cache.query(self.sql,
+                                                 (first, first + BLOCKSIZE))]
+
+
+class Table(invformat.Table):
+    """Read-only table backed by the database.
+
+    The values of the rows are read in blocks, with the strings already
+    looked up, and the records are built only for the rows used.
+
+    """
+
+    def __init__(self, inventory, name, size, columns):
+        invformat.Table.__init__(self, inventory, name, size, columns, None)
+
+        values = []
+        joins = []
+        for (col, coltype) in invformat.LAYOUT[name]:
+            if coltype == 's':
+                alias = 's%d' % len(joins)
+                values.append('%s.value' % alias)
+                joins.append('LEFT JOIN strings %s ON %s.id = t."%s"' %
+                             (alias, alias, col))
+            else:
+                values.append('t."%s"' % col)
+
+        self.sql = 'SELECT %s FROM %s t %s WHERE t.id >= ? AND t.id < ? ' \
+                   'ORDER BY t.id' % (', '.join(values), name, ' '.join(joins))
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError('%s index out of range' % self.name)
+
+        first = idx - idx % BLOCKSIZE
+        key = (self.name, None, first)
+        cache = self.inventory.cache
+        block = cache.blocks.get(key)
+        if block is None:
+            block = (cache.query(self.sql, (first, first + BLOCKSIZE)),
+                     [None] * BLOCKSIZE)
+            cache.add(key, block)
+
+        (values, rows) = block
+        row = rows[idx - first]
+        if row is None:
+            row = self.record(values[idx - first])
+            rows[idx - first] = row
+        return row
+
+    def __iter__(self):
+        for idx in xrange(self._size):
+            yield self[idx]
+
+    def record(self, values):
+        """Build the record of a row from the values in the database."""
+        if self.name == 'stations':
+            return invformat.Station(*values)
+        if self.name == 'streams':
+            return invformat.Stream(*values)
+        if self.name == 'sensorsLoc':
+            return invformat.SensorLocation(*values)
+
+        (code, first, last, vfirst, vlast) = values[:5]
+        children = (self.inventory.vchildren[vfirst:vlast]
+                    if vfirst is not None else None)
+        return invformat.Network(code, first, last, children, *values[5:])
+
+
+class StringTable(object):
+    """Sorted table of unique strings, as in the columnar format."""
+
+    def __init__(self, cache, size):
+        self.cache = cache
+        self.values = Column(cache, 'strings', 'value', 's', size)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            return None
+        return intern(self.values[idx])
+
+    def lookup(self, value):
+        """Return the reference of a string or -1 if it is not present."""
+        rows = self.cache.query('SELECT id FROM strings WHERE value = ?',
+                                (value,))
+        return rows[0][0] if rows else invformat.NONE_INT
+
+
+class SqliteInventory(object):
+    """Inventory read from a SQLite database.
+
+    It has the same interface as invformat.ColumnarInventory, but the
+    columns are read from the database when needed.
+
+    """
+
+    def __init__(self, filename):
+        try:
+            conn = sqlite3.connect(filename, check_same_thread=False)
+            conn.text_factory = str
+            conn.execute('PRAGMA query_only = 1')
+            # The queries are written for the indexes of the database
+            conn.execute('PRAGMA automatic_index = 0')
+            conn.execute('PRAGMA mmap_size = %d' % MMAPSIZE)
+            version = conn.execute(
+                "SELECT value FROM metadata WHERE name = 'version'").fetchall()
+        except sqlite3.DatabaseError as e:
+            raise ValueError('Not an inventory in SQLite format: %s' % e)
+
+        self.filename = filename
+        self.cache = BlockCache(conn)
+
+        if not version or version[0][0] != VERSION:
+            raise ValueError('Unsupported version of the SQLite format: %s'
+                             % (version[0][0] if version else None))
+
+        def count(table):
+            return self.cache.query('SELECT count(*) FROM %s' % table)[0][0]
+
+        self.strings = StringTable(self.cache, count('strings'))
+        self.vchildren = Column(self.cache, 'vchildren', 'station', 'i',
+                                count('vchildren'))
+
+        for name, cols in invformat.LAYOUT.iteritems():
+            size = count(name)
+            columns = dict((col, Column(self.cache, name, col, coltype, size))
+                           for col, coltype in cols)
+            setattr(self, name, Table(self, name, size, columns))
+
+        self.rtree = bool(self.cache.query(
+            "SELECT name FROM sqlite_master WHERE name = 'stationBoxes'"))
+
+    def query(self, sql, args=()):
+        """Run a query in the database and return all the rows."""
+        return self.cache.query(sql, args)
+
+    def refs(self, *values):
+        """References of some strings, or None if one is not present."""
+        refs = [self.strings.lookup(value) for value in values]
+        if invformat.NONE_INT in refs:
+            return None
+        return refs
+
+    def streamCodes(self):
+        """Return the set of references of the channel codes."""
+        return set(EMPTY['s'] if row[0] is None else row[0]
+                   for row in self.query('SELECT DISTINCT code FROM streams'))
+
+    def streamEpochs(self, net, sta, cha, loc):
+        """Return the indexes of all the epochs of a stream, sorted by
+        start.
+
+        """
+
+        refs = self.refs(net, sta, cha, loc)
+        if refs is None:
+            return []
+
+        return [row[0] for row in self.query(
+            'SELECT t.id FROM stations s CROSS JOIN networks n '
+            'CROSS JOIN sensorsLoc l CROSS JOIN streams t '
+            'WHERE n.id = s.network AND l.id >= s.first AND l.id < s.last '
+            'AND t.id >= l.first AND t.id < l.last '
+            'AND n.code = ? AND s.code = ? AND t.code = ? AND l.code = ? '
+            'ORDER BY t.start, t.id', refs)]
+
+
+def load(filename):
+    """Open the inventory in a SQLite database."""
+    if not os.path.exists(filename):
+        raise IOError('%s not found' % filename)
+
+    return SqliteInventory(filename)
+
+
+class BoxIndex(object):
+    """Stations inside a box, with the same interface as
+    invindex.SpatialGrid.
+
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def query(self, latmin, latmax, lonmin, lonmax):
+        """Return the sorted indexes of the stations inside a box.
+
+        The limits are included. If lonmin is greater than lonmax, the box
+        crosses the dateline.
+
+        """
+
+        if latmin > latmax:
+            return []
+
+        if lonmin <= lonmax:
+            lonranges = [(lonmin, lonmax)]
+        else:
+            lonranges = [(lonmin, 180.0), (-180.0, lonmax)]
+
+        # The R*Tree keeps the coordinates rounded outwards, so the exact
+        # ones are checked in the table of stations
+        if self.inventory.rtree:
+            sql = ('SELECT s.id FROM stationBoxes b '
+                   'JOIN stations s ON s.id = b.id '
+                   'WHERE b.maxLat >= ? AND b.minLat <= ? '
+                   'AND b.maxLon >= ? AND b.minLon <= ? '
+                   'AND s.latitude BETWEEN ? AND ? '
+                   'AND s.longitude BETWEEN ? AND ?')
+        else:
+            sql = ('SELECT id FROM stations '
+                   'WHERE latitude BETWEEN ? AND ? '
+                   'AND longitude BETWEEN ? AND ?')
+
+        result = set()
+        for (lon1, lon2) in lonranges:
+            args = (latmin, latmax, lon1, lon2)
+            if self.inventory.rtree:
+                args *= 2
+            result.update(row[0] for row in self.inventory.query(sql, args))
+
+        return sorted(result)
+
+
+class DistanceIndex(object):
+    """Stations close to a point, with the same interface as
+    invindex.UnitVectorTree.
+
+    The stations inside the box around the circle of the maximum distance
+    are returned, so the caller must check the exact distances.
+
+    """
+
+    def __init__(self, inventory, margin=1.0):
+        self.boxes = BoxIndex(inventory)
+        self.inventory = inventory
+        self.margin = margin
+
+    def query(self, lat, lon, mindist=None, maxdist=None):
+        """Return the sorted indexes of the stations whose distance (in
+        degrees) to a point could be between mindist and maxdist.
+
+        """
+
+        radius = maxdist + self.margin if maxdist is not None else 180.0
+        latmin = lat - radius
+        latmax = lat + radius
+
+        # Longitudes covered by the circle, unless it contains a pole
+        if latmin > -90.0 and latmax < 90.0:
+            ratio = (math.sin(math.radians(radius)) /
+                     math.cos(math.radians(lat)))
+        else:
+            ratio = None
+
+        if ratio is None or ratio >= 1.0 or radius >= 90.0:
+            return self.boxes.query(max(latmin, -90.0), min(latmax, 90.0),
+                                    -180.0, 180.0)
+
+        dlon = math.degrees(math.asin(ratio))
+        lonmin = (lon - dlon + 180.0) % 360.0 - 180.0
+        lonmax = (lon + dlon + 180.0) % 360.0 - 180.0
+        return self.boxes.query(latmin, latmax, lonmin, lonmax)
+
+
+class EpochIndex(object):
+    """Epochs of a table active in a period, with the same interface as
+    invindex.EpochIndex.
+
+    """
+
+    def __init__(self, inventory, table):
+        self.inventory = inventory
+        self.table = getattr(inventory, table)
+        self.name = table
+
+    def active(self, start=None, end=None):
+        """Return the epochs which overlap the period from start to end.
+
+        The limits are included and None means no limit.
+
+        """
+
+        return ActiveEpochs(self, start, end)
+
+
+class ActiveEpochs(object):
+    """Epochs of an EpochIndex active in a period."""
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+
+    def __contains__(self, idx):
+        columns = self.index.table.columns
+        if self.end is not None and columns['start'][idx] > self.end:
+            return False
+
+        epochEnd = columns['end'][idx]
+        return (self.start is None or epochEnd == invformat.NONE_EPOCH or
+                epochEnd >= self.start)
+
+    def __iter__(self):
+        """Iterate through the (unsorted) indexes of the active epochs."""
+        conditions = []
+        args = []
+        if self.end is not None:
+            conditions.append('start <= ?')
+            args.append(self.end)
+        if self.start is not None:
+            conditions.append('("end" IS NULL OR "end" >= ?)')
+            args.append(self.start)
+
+        sql = 'SELECT id FROM %s' % self.index.name
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        for row in self.index.inventory.query(sql, args):
+            yield row[0]
+
+
+class StationsByCode(object):
+    """Indexes of the epochs of every station by network/station code."""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def get(self, key, default=None):
+        refs = self.inventory.refs(*key)
+        if refs is None:
+            return default
+
+        result = [row[0] for row in self.inventory.query(
+            'SELECT s.id FROM stations s JOIN networks n ON n.id = s.network '
+            'WHERE n.code = ? AND s.code = ? ORDER BY s.id', refs)]
+        return result or default
+
+    def __getitem__(self, key):
+        result = self.get(key)
+        if result is None:
+            raise KeyError(key)
+        return result
+
+
+class StationsByKey(object):
+    """Indexes of the stations by key (NET-START-END-STA)."""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def get(self, key, default=None):
+        try:
+            (netcode, start, end, stacode) = key.split('-')
+            start = int(start)
+            end = None if end == 'None' else int(end)
+        except ValueError:
+            return default
+
+        refs = self.inventory.refs(netcode, stacode)
+        if refs is None:
+            return default
+
+        result = [row[0] for row in self.inventory.query(
+            'SELECT s.id FROM stations s JOIN networks n ON n.id = s.network '
+            'WHERE n.code = ? AND s.code = ? AND n.start = ? AND '
+            'n."end" IS ? ORDER BY s.id', (refs[0], refs[1], start, end))]
+        return result or default
+
+
+class ChildrenByCode(object):
+    """Pairs of network and station indexes by network/station code.
+
+    Virtual networks are included. The pairs follow the order of the
+    networks and their children.
+
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def get(self, key, default=None):
+        refs = self.inventory.refs(*key)
+        if refs is None:
+            return default
+
+        result = [(row[0], row[1]) for row in self.inventory.query(
+            'SELECT n.id, s.id, s.id FROM stations s '
+            'JOIN networks n ON s.id >= n.first AND s.id < n.last '
+            'WHERE n.code = ? AND s.code = ? '
+            'UNION ALL '
+            'SELECT v.network, v.station, v.id FROM vchildren v '
+            'JOIN networks n ON n.id = v.network '
+            'JOIN stations s ON s.id = v.station '
+            'WHERE n.code = ? AND s.code = ? '
+            'ORDER BY 1, 3', refs * 2)]
+        return result or default
+
+
+class VirtualParents(object):
+    """Indexes of the virtual networks including every station."""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def get(self, statidx, default=None):
+        result = [row[0] for row in self.inventory.query(
+            'SELECT network FROM vchildren WHERE station = ? '
+            'ORDER BY network', (statidx,))]
+        return result or default
@@ -0,0 +1,310 @@
+"""Background jobs for the Arclink web interface
+
+Requests which take too long to be answered at once are submitted as jobs
+and run by a pool of background threads. A job produces lists of rows,
+which are written to a JSON file in a spool directory as soon as they are
+ready. The status of every job is kept in another file next to it, so that
+any process of the web interface can report it and send the result. The
+jobs waiting in the queue of a process which no longer exists are reported
+as failed.
+
+Every client has its own queue of jobs, and the threads take the next job
+from the queues in turn, so that a client submitting many jobs does not
+delay the jobs of the rest. The files of a job are removed when they have
+not been modified for longer than the time to live. The spool directory
+is checked for them at most once every EXPIRE_INTERVAL seconds.
+
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import errno
+import socket
+import datetime
+import threading
+from collections import deque, OrderedDict
+
+import wsgicomm
+from seiscomp import logs
+
+# States of a job
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Identifiers of the jobs (also the names of their files)
+JOBID = re.compile(r'^[0-9a-f]{32}$')
+
+# Size of the blocks of the result sent to the client (in bytes)
+BLOCKSIZE = 64 * 1024
+
+# Minimum time between two checks of the spool for expired jobs (seconds)
+EXPIRE_INTERVAL = 600
+
+# Host of the processes running the queues of the jobs
+HOST = socket.gethostname()
+
+
+class JobError(Exception):
+    """Error of a job reported to the client in its status."""
+    pass
+
+
+class JobQueue(object):
+    """Queues of jobs of every client, run by a pool of threads.
+
+    Inputs:
+      spool      - directory for the status and the result of every job
+      workers    - number of threads running the jobs (0 to run them only
+                   with runNext)
+      ttl        - seconds the files of a job are kept after its last
+                   change
+
+    """
+
+    def __init__(self, spool, workers=1, ttl=86400):
+        self.spool = spool
+        self.ttl = ttl
+
+        if not os.path.isdir(spool):
+            os.makedirs(spool)
+
+        # Pending jobs of every client, in the order in which the clients
+        # are served
+        self.__queues = OrderedDict()
+        self.__cond = threading.Condition()
+
+        # Last check of the spool for expired jobs
+        self.__expired = 0
+
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.__work,
+                                      name='JobQueue worker %d' % i)
+            thread.daemon = True
+            thread.start()
+
+    def __path(self, jobid, ext):
+        return os.path.join(self.spool, '%s.%s' % (jobid, ext))
+
+    def __writeStatus(self, jobid, **status):
+        """Replace the status of a job."""
+        status['id'] = jobid
+        status['owner'] = [HOST, os.getpid()]
+        tmpfile = self.__path(jobid, 'status.tmp')
+        with open(tmpfile, 'w') as fout:
+            json.dump(status, fout)
+        os.rename(tmpfile, self.__path(jobid, 'status'))
+
+    def submit(self, client, job, cls=None):
+        """Queue a job of a client and return its identifier.
+
+        job is a callable returning an iterable of lists of rows. It is
+        called by one of the threads, and its rows are saved as soon as
+        every list is produced, encoded with the optional JSONEncoder
+        subclass cls. It can raise JobError to report an error.
+
+        """
+
+        self.__expire()
+
+        jobid = uuid.uuid4().hex
+        self.__writeStatus(jobid, status=QUEUED, lines=0,
+                           submitted=_now(), finished=None, error=None)
+
+        with self.__cond:
+            self.__queues.setdefault(client, deque()).append((jobid, job,
+                                                              cls))
+            self.__cond.notify()
+
+        return jobid
+
+    def __next(self, wait):
+        """Take the next job of the next client, or None if there are no
+        jobs and wait is False.
+
+        """
+
+        with self.__cond:
+            while not self.__queues:
+                if not wait:
+                    return None
+                self.__cond.wait()
+
+            (client, queue) = self.__queues.popitem(last=False)
+            item = queue.popleft()
+
+            # The client goes to the end of the queues
+            if queue:
+                self.__queues[client] = queue
+
+            return item
+
+    def __work(self):
+        while True:
+            try:
+                self.__run(*self.__next(True))
+                self.__expire()
+
+            except Exception as e:
+                logs.error('Error running a job: %s' % e)
+
+    def runNext(self):
+        """Run the next job in the calling thread. Returns its identifier,
+        or None if there are no jobs.
+
+        """
+
+        item = self.__next(False)
+        if item is None:
+            return None
+
+        self.__run(*item)
+        return item[0]
+
+    def __run(self, jobid, job, cls):
+        status = self.__readStatus(jobid)
+        if status is None:
+            return
+
+        status['status'] = RUNNING
+        self.__writeStatus(jobid, **status)
+
+        def rows():
+            for part in job():
+                for row in part:
+                    yield row
+
+                status['lines'] += len(part)
+                self.__writeStatus(jobid, **status)
+
+        try:
+            with open(self.__path(jobid, 'json'), 'w') as fout:
+                for text in wsgicomm.iterJSON(rows(), cls):
+                    fout.write(text)
+                    fout.flush()
+
+            status['status'] = DONE
+
+        except Exception as e:
+            if isinstance(e, (JobError, wsgicomm.WIError)):
+                status['error'] = getattr(e, 'body', str(e))
+            else:
+                status['error'] = 'Internal error: %s' % e
+            status['status'] = FAILED
+
+        status['finished'] = _now()
+        self.__writeStatus(jobid, **status)
+
+    def __readStatus(self, jobid):
+        if not JOBID.match(jobid or ''):
+            return None
+
+        try:
+            with open(self.__path(jobid, 'status')) as fin:
+                return json.load(fin)
+
+        except (IOError, ValueError):
+            return None
+
+    def status(self, jobid):
+        """Return the status of a job as a dictionary, or None if it does
+        not exist.
+
+        A job which is not finished is marked as failed if the process
+        which had it in its queue no longer exists.
+
+        """
+
+        status = self.__readStatus(jobid)
+        if status is None:
+            return None
+
+        if status['status'] in (QUEUED, RUNNING) and \
+                not _alive(status.get('owner')):
+            status['status'] = FAILED
+            status['error'] = 'The job was interrupted'
+            status['finished'] = _now()
+            self.__writeStatus(jobid, **status)
+
+        del status['owner']
+        return status
+
+    def result(self, jobid):
+        """Return an iterator over the blocks of the result of a job which
+        is done, or None if it is not available.
+
+        """
+
+        status = self.status(jobid)
+        if status is None or status['status'] != DONE:
+            return None
+
+        try:
+            fin = open(self.__path(jobid, 'json'), 'rb')
+        except IOError:
+            return None
+
+        def blocks():
+            with fin:
+                while True:
+                    block = fin.read(BLOCKSIZE)
+                    if not block:
+                        break
+                    yield block
+
+        return blocks()
+
+    def __expire(self):
+        """Call expire if the spool was not checked recently."""
+        now = time.time()
+        with self.__cond:
+            if now - self.__expired < EXPIRE_INTERVAL:
+                return
+            self.__expired = now
+
+        self.expire()
+
+    def expire(self):
+        """Remove the files of the jobs not modified within the time to
+        live.
+
+        """
+
+        limit = time.time() - self.ttl
+        for name in os.listdir(self.spool):
+            path = os.path.join(self.spool, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                # Removed by another process
+                pass
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _alive(owner):
+    """Check whether the process owning a job still exists. Processes on
+    other hosts are assumed to exist.
+
+    """
+
+    if owner is None:
+        return False
+
+    (host, pid) = owner
+    if host != HOST or pid == os.getpid():
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+
+    return True
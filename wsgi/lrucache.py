@@ -0,0 +1,84 @@
+"""Cache of responses for the Arclink web interface
+
+Least recently used cache of serialized responses, bounded by the total
+size of the stored strings. The whole content is discarded when the
+version of the data used to build the responses changes.
+
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Least recently used cache of strings bounded by their total size.
+
+    The size of other values is given by the function sizeof, e.g.
+    lambda value: 1 to bound the number of entries. The cache can be shared
+    by several threads.
+
+    """
+
+    def __init__(self, maxsize, sizeof=len):
+        # Maximum total size of the stored values (in bytes for strings)
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+
+        # Version of the data used to build the values
+        self.version = None
+
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def validate(self, version):
+        """Discard all the entries if the version of the data has changed."""
+        with self.__lock:
+            if version != self.version:
+                self.__entries.clear()
+                self.size = 0
+                self.version = version
+
+    def get(self, key):
+        """Return the value stored for key or None if it is not present."""
+        with self.__lock:
+            try:
+                value = self.__entries.pop(key)
+            except KeyError:
+                return None
+
+            # Move it to the end as the most recently used
+            self.__entries[key] = value
+            return value
+
+    def put(self, key, value):
+        """Store a value, discarding the least recently used ones if needed.
+
+        Values larger than the whole cache are not stored.
+
+        """
+
+        size = self.sizeof(value)
+        if size > self.maxsize:
+            return
+
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.size -= self.sizeof(old)
+
+            self.__entries[key] = value
+            self.size += size
+
+            while self.size > self.maxsize:
+                (oldkey, old) = self.__entries.popitem(last=False)
+                self.size -= self.sizeof(old)
+
+    def clear(self):
+        """Discard all the entries."""
+        with self.__lock:
+            self.__entries.clear()
+            self.size = 0
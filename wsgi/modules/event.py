@@ -51,6 +51,7 @@ import urllib2
 
 sys.path.append('..')  # for wsgicomm...
 import wsgicomm
+import geodesy
 
 tempdir = tempfile.gettempdir()
 
@@ -98,14 +99,6 @@ except ImportError:
                 name += "%i" % (int(abs(flon) / 22.5))
                 return name
 
-try:
-    import seiscomp3.Math as Math
-except ImportError:
-    logs.warning("Couldn't import seiscomp3.Math ... do you have the SeisComP libraries installed?")
-    class Math(object):
-        def delazi(self, lat_0, lon_0, lat_1, lon_1):
-            return [_delazi(lat_0, lon_0, lat_1, lon_1), None, None]
-
 class WI_Module(object):
 
     _EventsVersion = "2015.035"
@@ -170,6 +163,7 @@ Service version:
             if description:
                 self._EventServiceCatalog[s] = (description, handler)
         self._EventServicePreferred = config['catalogs']['preferred']
+        self.__catalog = None
         self.registeredonly = wi.getConfigBool('event.catalogs.registeredonly', True)
         logs.info("Only serve registered event services: %s" % (self.registeredonly))
         logs.info("Registered event service(s):")
@@ -278,6 +272,19 @@ Service version:
     def getEventsCatalog(self):
         """Returns text/plain JSON-formatted description list of service names.
 
+        The list depends only on the configuration, so it is built once
+        and the same response is returned afterwards.
+
+        """
+
+        if self.__catalog is None:
+            self.__catalog = wsgicomm.CachedResponse(self.__buildEventsCatalog())
+
+        return self.__catalog
+
+    def __buildEventsCatalog(self):
+        """Build the JSON-formatted description list of service names.
+
         Each service name has a description (string) and a list of
         capabilities describing what resource parameters can be
         handled by that service.
@@ -314,14 +321,7 @@ Service version:
             if k == prefService:
                 d[k]["preferred"] = True
 
-        indent = None
-        tmp = json.dumps(d, indent=indent)
-
-        # DEBUG: Check the output string is loadable.
-        tmp2 = json.loads(tmp)
-        assert len(tmp2) == len(self._EventServiceCatalog)
-
-        return tmp
+        return json.dumps(d)
         ##return json.dumps(self._EventServiceCatalog)
 
     def __str__(self):
@@ -450,40 +450,14 @@ def _delazi(lat_0, lon_0, lat_1, lon_1):
 
     All angles are in *degrees*.
 
-    Position vectors are:
-     (x, y, z) = a*[ cos(lon)*cos(lat), sin(lon)*cos(lat), sin(lat) ]
-    Spherical distance is arccos( v_0 dot v_1 ).
+    Single-pair version of geodesy.delazi(), which should be used
+    directly for many points at once.
 
-    WARNING: Probably inaccurate near 0 and 180 deg distance, where cos(dotp) = 1.
+    >>> round(_delazi(0.0, 0.0, 0.0, 90.0), 6)
+    90.0
 
     """
-    deg2rad = math.pi / 180.0
-    lat_0 = lat_0 * deg2rad
-    lon_0 = lon_0 * deg2rad
-    lat_1 = lat_1 * deg2rad
-    lon_1 = lon_1 * deg2rad
-
-    #x0 = math.cos(lon_0)*math.cos(lat_0)
-    #x1 = math.cos(lon_1)*math.cos(lat_1)
-    #y0 = math.sin(lon_0)*math.cos(lat_0)
-    #y1 = math.sin(lon_1)*math.cos(lat_1)
-    delta_lon = (lon_1 - lon_0) % (2 * math.pi)
-    term_1 = math.cos(lat_0) * math.cos(lat_1) * math.cos(delta_lon)
-    z0 = math.sin(lat_0)
-    z1 = math.sin(lat_1)
-    #dotp = x0 * x1 + y0 * y1 + z0 * z1
-    dotp = term_1 + z0 * z1
-
-    # Need the angle in (0, 180]:
-    if dotp == -1:
-        d = math.pi  # anti-parallel, 180 degrees
-    else:
-        d = math.acos(dotp)
-    #elif (dotp < 0):
-    #    d = math.pi - math.acos(dotp)  # not needed, Python acos does this.
-
-    d = d / deg2rad
-    #print 'TEST', lat_0, lon_0, lat_1, lon_1, dotp, d
+    d = float(geodesy.delazi([lat_0], [lon_0], [lat_1], [lon_1])[0][0][0])
     assert(d >= 0.0)
     assert(d <= 180.0)
     return d
@@ -2329,12 +2303,11 @@ class ESGeofon(EventService):
 
         col = {'lat': 3, 'lon': 4}
         er_new = EventResponse(funny_dialect, self.column_map, self.filter_table, self.options)
-        for ev in er.ed.data:
-            lat = ev[col['lat']]
-            lon = ev[col['lon']]
-            d = Math.delazi(p_lat, p_lon, lat, lon)[0]
-            # Offline?
-            #d = Math().delazi(p_lat, p_lon, lat, lon)
+        dist = geodesy.delazi([p_lat], [p_lon],
+                              [float(ev[col['lat']]) for ev in er.ed.data],
+                              [float(ev[col['lon']]) for ev in er.ed.data])[0]
+        for i, ev in enumerate(er.ed.data):
+            d = float(dist[0][i])
             if d >= circle_params['minradius'] and d <= circle_params['maxradius']:
                 er_new.ed.data.append(ev)
                 print "DEBUG: appending", ev
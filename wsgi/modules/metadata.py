@@ -51,12 +51,21 @@ GNU General Public License for more details.
 #
 ##################################################################
 
+import os
+import sys
+import Queue
 import datetime
 import json
+import threading
+import multiprocessing
 
 import wsgicomm
+import geodesy
+import lrucache
+import codepattern
+import traveltime
+import jobqueue
 import seiscomp3.Seismology
-import seiscomp3.Math as Math
 from seiscomp import logs
 from seiscomp.xmlparser import DateTimeAttr
 
@@ -69,6 +78,40 @@ class MyJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+# Maximum number of requests computed at the same time by the worker
+# processes. The rest are computed by the process which receives them.
+PARALLEL_REQUESTS = 32
+
+# Number of events whose time windows are computed at a time by a job
+JOB_EVENTS = 10
+
+# Module used by every worker process computing time windows
+_worker = None
+
+
+def _initWorker(module):
+    """Prepare a copy of the module in a worker process.
+
+    The inventory is shared with the parent process and never reloaded by
+    the worker, but every worker has its own travel time table and cache of
+    travel times.
+
+    """
+
+    global _worker
+    _worker = module
+    module.parallel = False
+    module.ic.freeze()
+    module.ttt = seiscomp3.Seismology.TravelTimeTable()
+    module.ttcache = traveltime.TravelTimeCache(
+        module.ttt, module.ttcache.cache.maxsize, module.ttcache.resolution,
+        module.ttcache.depthResolution)
+
+
+def _eventWindows(task):
+    return _worker.eventWindows(*task)
+
+
 class WI_Module(object):
     def __init__(self, wi):
         wi.registerAction("/metadata/networktypes", self.networktypes)
@@ -81,12 +124,173 @@ class WI_Module(object):
         wi.registerAction("/metadata/import", self.upload_selection)
         wi.registerAction("/metadata/export", self.download_selection)
         wi.registerAction("/metadata/timewindows", self.timewindows)
+        wi.registerAction("/metadata/timewindows/status", self.jobStatus)
+        wi.registerAction("/metadata/timewindows/result", self.jobResult)
 
         self.max_lines = wi.getConfigInt('js.request.totalLineLimit', 10000)
 
         self.ic = wi.ic
         self.ttt = seiscomp3.Seismology.TravelTimeTable()
 
+        # First arrivals of the phases for every position of the events and
+        # stations, or for the distance and depth rounded to the given
+        # resolutions (in degrees and km) if they are not 0
+        self.ttcache = traveltime.TravelTimeCache(
+            self.ttt, wi.getConfigInt('metadata.traveltimes.size', 100000),
+            wi.getConfigFloat('metadata.traveltimes.resolution', 0),
+            wi.getConfigFloat('metadata.traveltimes.depthResolution', 0))
+
+        # Grid of first arrivals written by update-metadata.py
+        # --traveltimes. Without it, all travel times are computed.
+        try:
+            self.ttgrid = traveltime.load(os.path.join(wi.server_folder,
+                                                       'data',
+                                                       traveltime.GRIDFILE))
+        except IOError:
+            self.ttgrid = None
+        except ValueError, e:
+            logs.error("could not read the grid of travel times: " + str(e))
+            self.ttgrid = None
+
+        # Cache of the responses for the menus of networks, stations and
+        # streams (size in MB)
+        self.cache = lrucache.LRUCache(
+            wi.getConfigInt('metadata.cache.size', 16) * 1024 * 1024)
+
+        # The lists of types and phases never change, so they are
+        # serialized only once
+        self.__nettypes = wsgicomm.CachedResponse(json.dumps(self.ic.nettypes))
+        self.__senstypes = wsgicomm.CachedResponse(json.dumps(self.ic.senstypes))
+        self.__phases = wsgicomm.CachedResponse(json.dumps(self.ic.phases))
+
+        # Processes computing the time windows of requests with at least
+        # parallelPairs (event, stream) pairs. They are started by the first
+        # of these requests (see __getPool) and get a copy of this module.
+        self.pool = None
+        self.parallel = False
+        self.processes = wi.getConfigInt('metadata.timewindows.processes', 0)
+        self.parallelPairs = wi.getConfigInt('metadata.timewindows.pairs',
+                                             100000)
+
+        if self.processes > 0 and self.ic.backend == 'sqlite':
+            logs.error("metadata.timewindows.processes is not used with "
+                       "the sqlite backend")
+
+        elif self.processes > 0:
+            # Number of lines of every request running in the workers
+            self.__lines = multiprocessing.Array('l', PARALLEL_REQUESTS)
+            self.__slots = Queue.Queue()
+            for slot in xrange(PARALLEL_REQUESTS):
+                self.__slots.put(slot)
+
+            # Version of the inventory copied by the workers of the pool
+            self.__poolVersion = None
+            self.__poolLock = threading.Lock()
+            self.parallel = True
+
+        # Threads running the time windows requested with mode=job. Their
+        # status and results are kept in the spool directory for ttl hours.
+        # The clients behind the given proxies are identified by the address
+        # added by the proxy to X-Forwarded-For.
+        self.jobs = None
+        self.jobLines = wi.getConfigInt('metadata.jobs.lines', 1000000)
+        self.proxies = set(wi.getConfigList('metadata.jobs.proxies', []))
+        workers = wi.getConfigInt('metadata.jobs.workers', 0)
+
+        if workers > 0 and self.parallel:
+            # The worker processes cannot be forked from a process running
+            # other threads
+            logs.error("metadata.timewindows.processes is not used with "
+                       "metadata.jobs.workers")
+            self.parallel = False
+
+        if workers > 0:
+            spool = wi.getConfigString('metadata.jobs.spool',
+                                       os.path.join(wi.server_folder, 'data',
+                                                    'jobs'))
+            try:
+                self.jobs = jobqueue.JobQueue(
+                    spool, workers,
+                    wi.getConfigInt('metadata.jobs.ttl', 24) * 3600)
+            except OSError, e:
+                logs.error("could not use the spool directory of jobs: " +
+                           str(e))
+
+    def __menuKey(self, name, params):
+        """Build the key of a response for the menus in the cache.
+
+        The parameters are converted to a canonical form, so that equivalent
+        requests share the same response. None is returned if the response
+        should not be cached, e.g. because the parameters are wrong and the
+        error must be reported.
+
+        """
+
+        try:
+            start = int(params['start']) if 'start' in params else None
+        except (TypeError, ValueError):
+            return None
+
+        try:
+            end = int(params.get('end'))
+        except (TypeError, ValueError):
+            end = None
+
+        # The start year is 1900 by default if the end year is given
+        if start is None and end and 1 <= end <= 9999:
+            start = 1900
+
+        # The end is "now" by default, so the response may change every day
+        today = datetime.date.today() if end is None and start else None
+
+        networktype = params.get('networktype')
+        if networktype == 'all':
+            networktype = None
+
+        network = params.get('network') or None
+        if network == 'all':
+            network = None
+
+        if name == 'networks':
+            station = None
+        else:
+            try:
+                station = params.get('station').split(',')
+                station = None if station[0] == 'all' else \
+                    tuple(sorted(set(station)))
+            except AttributeError:
+                station = None
+
+        # Only the streams are filtered by sensor type
+        sensortype = params.get('sensortype') if name == 'streams' else None
+        if sensortype is not None:
+            sensortype = tuple(sorted(set(sensortype.strip().split(' '))))
+            if sensortype == ('all',):
+                sensortype = None
+
+        return (name, start, end, today, networktype, network, station,
+                sensortype)
+
+    def __cached(self, name, params, method):
+        """Return the response of one of the menus in JSON format.
+
+        Responses are kept in the cache until the inventory changes.
+
+        """
+
+        key = self.__menuKey(name, params)
+        if key is None:
+            return json.dumps(method(params))
+
+        self.cache.validate(self.ic.version)
+
+        result = self.cache.get(key)
+        if result is None:
+            result = json.dumps(method(params))
+            self.cache.put(key, result)
+
+        return result
+
     def networktypes(self, envir, params):
         """Returns the available types of networks.
 
@@ -110,7 +314,7 @@ class WI_Module(object):
 
         """
 
-        return json.dumps(self.ic.nettypes)
+        return self.__nettypes
 
     def sensortypes(self, envir, params):
         """Returns the available sensor types.
@@ -133,7 +337,7 @@ class WI_Module(object):
 
         """
 
-        return json.dumps(self.ic.senstypes)
+        return self.__senstypes
 
     def phases(self, envir, params):
         """Returns the available types of phases.
@@ -150,7 +354,7 @@ class WI_Module(object):
 
         """
 
-        return json.dumps(self.ic.phases)
+        return self.__phases
 
     def getNetworks(self, envir, params):
         """Returns the available networks which pass the filter criteria
@@ -172,7 +376,7 @@ class WI_Module(object):
 
         """
 
-        return json.dumps(self.ic.getNetworks(params))
+        return self.__cached('networks', params, self.ic.getNetworks)
 
     def getStations(self, envir, params):
         """Returns the available stations which pass the filter criteria
@@ -195,7 +399,7 @@ class WI_Module(object):
 
         """
 
-        return json.dumps(self.ic.getStations(params))
+        return self.__cached('stations', params, self.ic.getStations)
 
     def getStreams(self, envir, params):
         """Returns the available streams which pass the filter criteria
@@ -206,9 +410,12 @@ class WI_Module(object):
                networktype={string}
                [network={string}]
                [station={string}]
+               [sensortype={string}]
         Output: list in JSON format. The stream code is considered to be formed
                 by the first two letters, being the third one the orientation.
-                Every item in the list has one column.
+                Every item in the list has one column. The codes are sorted
+                by the number of streams of the selected stations, operating
+                in the period and of the sensor types given.
                 STREAMCODE
 
         Example:
@@ -221,7 +428,7 @@ class WI_Module(object):
 
         """
 
-        return json.dumps(self.ic.getStreams(params))
+        return self.__cached('streams', params, self.ic.getStreams)
 
     def query(self, envir, params):
         """Returns the stations/streams which pass the filter criteria
@@ -232,6 +439,7 @@ class WI_Module(object):
                   [network={string}]
                   [networktype={string}]
                   [station={string}]
+                  [nslc={string}]  # e.g. G*.*.00.BH?
                   [sensortype={string}]
                   [streams={stream1,stream2,...}]
                   [minlat={float}]
@@ -260,13 +468,16 @@ class WI_Module(object):
         if len(result) <= 1:
             raise wsgicomm.WIContentError('No stations were found.', 0)
 
-        return json.dumps(result)
+        return wsgicomm.StreamedResponse(wsgicomm.iterJSON(result))
 
     def upload_selection(self, envir, params):
         """Returns the stations/streams received in the uploaded file
 
         Input: file={file}
 
+        The codes in every line can be lists separated by commas and have
+        the wildcards '?' and '*'.
+
         Output: list in JSON format. Every item in the list has ten columns.
                 ID, NETCODE, STATIONCODE, LATITUDE, LONGITUDE, RESTRICTED,
                 NETCLASS, ARCHIVE, NETOPERATOR, STREAMS.
@@ -294,8 +505,14 @@ class WI_Module(object):
         lines = [(line[0], line[1], line[2] if len(line[2]) else '--', line[3])
                  for line in auxLines if len(line) >= 4]
 
-        # Remove duplicate lines
-        nslcSet = set(lines)
+        # Remove duplicate lines and expand the ones with patterns
+        nslcSet = set()
+        for line in set(lines):
+            if any(codepattern.isPattern(code) for code in line):
+                for (n, s, l, c) in self.ic.getCodesByPattern('.'.join(line)):
+                    nslcSet.add((n, s, l if len(l) else '--', c))
+            else:
+                nslcSet.add(line)
 
         # Create a set of stations to call getQuery
         nsSet = set([(nslc[0], nslc[1]) for nslc in nslcSet])
@@ -311,78 +528,55 @@ class WI_Module(object):
             # Consumes all the stations
             n, s = nsList.pop(0)
 
-            # To make notation shorter
-            ptNets = self.ic.networks
-            ptStats = self.ic.stations
-
-            # Cycle through networks
-            for net in ptNets:
-                # Check if I found the network
-                if n == net[0]:
-                    # A normal network has pointers to first and last child
-                    if((net[1] is not None) and (net[2] is not None)):
-                        list_of_children = range(net[1], net[2])
-                    # A virtual network has a list of children
-                    else:
-                        list_of_children = net[3]
-
-                    # Cycle through children (stations)
-                    for staIdx in list_of_children:
-                        sta = ptStats[staIdx]
-                        # Check if I found the station
-                        if s == sta[4]:
-
-                            # Build key to avoid duplicates due to different
-                            # epochs! See GE.APE
-                            statKey = '%s-%s-%s-%s' % (net[0], net[4],
-                                                       net[5], sta[4])
-                            if statKey not in statsSet:
-                                # Query for ALL the streams in the station
-                                auxParams = {'network': '%s-%s-%s' %
-                                             (net[0], net[4], net[5]),
-                                             'station': '%s-%s-%s-%s' %
-                                             (net[0], net[4], net[5], sta[4])}
-                                partial = self.ic.getQuery(auxParams)
-
-                                # Filter by location and channel
-                                # Remove header
-                                partial = partial[1:]
-                                # Loop through the results
-                                for idx, parSta in enumerate(partial):
-                                    filtStr = list()
-                                    filtStrRestr = list()
-                                    # Loop through all streams (LOC.CH)
-                                    for chIdx, locCh in enumerate(parSta[9]):
-                                        auxLoc, auxCh = locCh.split('.')
-                                        # Take into account the empty location
-                                        # case
-                                        if auxLoc == '':
-                                            auxLoc = '--'
-
-                                        # Check if this stream is among the
-                                        # requested ones
-                                        if ((net[0], sta[4], auxLoc, auxCh)
-                                                in nslcSet):
-                                            # And add it to the filtered
-                                            # streams
-                                            filtStr.append(locCh)
-                                            # With the proper information about
-                                            # restriction
-                                            filtStrRestr.append(
-                                                parSta[10][chIdx])
-
-                                    # Replace the station in the results with a
-                                    # new one with filtered streams
-                                    if len(filtStr):
-                                        partial[idx] = (parSta[0], parSta[1],
-                                                        parSta[2], parSta[3],
-                                                        parSta[4], parSta[5],
-                                                        parSta[6], parSta[7],
-                                                        parSta[8], filtStr,
-                                                        filtStrRestr)
-                                        # Add results
-                                        statsSet.add(statKey)
-                                        stats.append(partial[idx])
+            # Cycle through the epochs of the station in all the networks
+            # with the code
+            for (net, sta) in self.ic.getStationsByCode(n, s):
+                # Build key to avoid duplicates due to different epochs!
+                # See GE.APE
+                statKey = '%s-%s-%s-%s' % (net.code, net.start, net.end,
+                                           sta.code)
+                if statKey not in statsSet:
+                    # Query for ALL the streams in the station
+                    auxParams = {'network': '%s-%s-%s' % (net.code,
+                                                          net.start,
+                                                          net.end),
+                                 'station': statKey}
+                    partial = self.ic.getQuery(auxParams)
+
+                    # Filter by location and channel
+                    # Remove header
+                    partial = partial[1:]
+                    # Loop through the results
+                    for idx, parSta in enumerate(partial):
+                        filtStr = list()
+                        filtStrRestr = list()
+                        # Loop through all streams (LOC.CH)
+                        for chIdx, locCh in enumerate(parSta[9]):
+                            auxLoc, auxCh = locCh.split('.')
+                            # Take into account the empty location case
+                            if auxLoc == '':
+                                auxLoc = '--'
+
+                            # Check if this stream is among the requested
+                            # ones
+                            if (net.code, sta.code, auxLoc,
+                                    auxCh) in nslcSet:
+                                # And add it to the filtered streams
+                                filtStr.append(locCh)
+                                # With the proper information about
+                                # restriction
+                                filtStrRestr.append(parSta[10][chIdx])
+
+                        # Replace the station in the results with a new
+                        # one with filtered streams
+                        if len(filtStr):
+                            partial[idx] = (parSta[0], parSta[1], parSta[2],
+                                            parSta[3], parSta[4], parSta[5],
+                                            parSta[6], parSta[7], parSta[8],
+                                            filtStr, filtStrRestr)
+                            # Add results
+                            statsSet.add(statKey)
+                            stats.append(partial[idx])
 
         # Add header
         stats.insert(0, ('key', 'netcode', 'statcode', 'latitude', 'longitude',
@@ -461,59 +655,96 @@ class WI_Module(object):
                         content_type=content_type)
         return body
 
-    def __timewindows_tw(self, streams, start_time, end_time):
-        result = []
+    def __streamKeys(self, streams, invalid):
+        """Convert the streams of a request to tuples of codes.
+
+        Returns the codes of the streams before the first invalid one and
+        the error message for it (None if all of them are valid). invalid
+        is the beginning of the message for streams which are not lists.
+
+        """
+
+        keys = []
 
         for nscl in streams:
             try:
                 if len(nscl) != 4:
-                    msg = "Invalid stream: " + str(nscl)
-                    raise wsgicomm.WIClientError, msg
+                    return (keys, "Invalid stream: " + str(nscl))
 
-                net = str(nscl[0])
-                sta = str(nscl[1])
-                cha = str(nscl[2])
-                loc = str(nscl[3])
+                keys.append((str(nscl[0]), str(nscl[1]), str(nscl[2]),
+                             str(nscl[3])))
 
             except (TypeError, ValueError):
-                raise wsgicomm.WIClientError, "invalid stream: " + str(nscl)
+                return (keys, invalid + str(nscl))
 
-            streamInfo = self.ic.getStreamInfo(start_time, end_time, net,
-                                               sta, cha, loc)
+        return (keys, None)
 
+    def __timewindows_tw(self, streams, start_time, end_time, maxLines=None):
+        if maxLines is None:
+            maxLines = self.max_lines
+
+        result = []
+
+        (keys, error) = self.__streamKeys(streams, "invalid stream: ")
+        infos = self.ic.getStreamInfoMany([(start_time, end_time)] * len(keys),
+                                          keys)
+
+        for (net, sta, cha, loc), streamInfo in zip(keys, infos):
             if streamInfo:  # stream does exist in this time range
                 result.append((start_time, end_time, net, sta, cha, loc,
                                streamInfo['size']))
 
-                if len(result) > self.max_lines:
+                if len(result) > maxLines:
                     msg = "Maximum request size exceeded"
                     raise wsgicomm.WIClientError, msg
 
+        if error is not None:
+            raise wsgicomm.WIClientError, error
+
         return result
 
-    def __isphase(self, ttphase, phase):
+    def __traveltimes(self, phase, stations, deltas, failed):
+        """Travel times of a phase from events to stations.
+
+        Input: phase={string}          # 'P', 'S' or 'OT'
+               stations={list}         # [(ev_lat, ev_lon, ev_dep, st_lat,
+                                       #   st_lon, st_alt),..]
+               deltas={list}           # distances in degrees
+               failed={set}            # positions of the stations where the
+                                       # computation failed
 
-        # The list of phases P and S has been provided by Joachim per email
-        # on 14.08.2013
-        # The case of P and a distance larger than 120 deg must be checked
-        # outside this function as we do not have this information here.
-        # March/April 2014: Phase "OT" contributed by Carlo Cauzzi, ETHZ.
-        if phase == 'P':
-            if ttphase in ('P', 'Pg', 'Pb', 'Pn', 'Pdif', 'Pdiff'):
-                return True
+        Output: list with the travel time in seconds of every station, or
+                None if the phase was not found
 
-        elif phase == 'S':
-            if ((ttphase in ('S', 'Sg', 'Sb', 'Sn', 'Sdif', 'Sdiff')) or
-                    ttphase.startswith('SKS')):
-                return True
-        elif phase =='OT': # Oh well, it's not a phase but better to be consistent with what we have #Carlo
-            return True
+        The travel times are interpolated from the grid if there is one.
+        The rest are computed, and the positions where that fails are added
+        to failed.
+        """
+
+        traveltime.checkPhase(phase)
 
+        if self.ttgrid is not None:
+            result = self.ttgrid.times(phase, deltas,
+                                       [st[2] for st in stations])
         else:
-            msg = 'Wrong phase received! Only "P", "S" and "OT" are implemented.'
-            raise wsgicomm.WIClientError, msg
+            result = [None] * len(stations)
 
-        return False
+        for i in xrange(len(stations)):
+            if result[i] is not None or i in failed:
+                continue
+
+            try:
+                arrivals = self.ttcache.arrivals(stations[i], deltas[i])
+            except Exception, e:
+                msg = "/metadata/timewindows: exception from " + \
+                    "ttt.compute(): " + str(e)
+                logs.error(msg)
+                failed.add(i)
+                continue
+
+            result[i] = arrivals.time(phase, deltas[i])
+
+        return result
 
     def __timewindows_ev(self, streams, events, startphase, startoffset,
                          endphase, endoffset):
@@ -533,153 +764,280 @@ class WI_Module(object):
         Output: list of start/end times per stream, AND estimated data volume,
                 (start_time, end_time, net, sta, cha, loc, streamInfo['size'])
 
-        NOTE 1: stream is a list of [net, sta, cha, loc] instead of nslc here!
-        NOTE 2: There are many redundant time window computations for multiple
-        streams at the same location
+        NOTE: stream is a list of [net, sta, cha, loc] instead of nslc here!
+        The time window is computed only once for all the streams at the
+        same location.
         """
 
-        result = []
+        (keys, parsed) = self.__parseEvents(streams, events)
 
+        # Large requests are split by streams among the worker processes
+        result = None
+        if (self.parallel and len(keys) > 1 and
+                len(parsed) * len(keys) >= self.parallelPairs):
+            try:
+                slot = self.__slots.get_nowait()
+            except Queue.Empty:
+                slot = None
+
+            if slot is not None:
+                try:
+                    result = self.__parallelWindows(slot, parsed, keys,
+                                                    startphase, startoffset,
+                                                    endphase, endoffset)
+                finally:
+                    self.__slots.put(slot)
+
+        if result is None:
+            result = self.eventWindows(parsed, keys, startphase, startoffset,
+                                       endphase, endoffset)
+
+        if result is None:
+            msg = "Maximum request size exceeded"
+            raise wsgicomm.WIClientError, msg
+
+        return [line for lines in result for line in lines]
+
+    def __parseEvents(self, streams, events):
+        """Check the streams and events of a request.
+
+        Returns the keys of the streams and a list of (lat, lon, depth,
+        time) of the events.
+        """
+
+        (keys, error) = self.__streamKeys(streams, "Invalid stream: ")
+
+        parsed = []
         for ev in events:
             try:
                 if len(ev) != 4:
                     raise wsgicomm.WIClientError, "invalid event: " + str(ev)
 
-                ev_lat = float(ev[0])
-                ev_lon = float(ev[1])
-                ev_dep = float(ev[2])
-                ev_time = DateTimeAttr().fromxml(ev[3])
+                parsed.append((float(ev[0]), float(ev[1]), float(ev[2]),
+                               DateTimeAttr().fromxml(ev[3])))
 
             except (TypeError, ValueError):
                 raise wsgicomm.WIClientError, "invalid event: " + str(ev)
 
-            for nscl in streams:
+            if error is not None:
+                raise wsgicomm.WIClientError, error
+
+        return (keys, parsed)
+
+    def __jobWindows(self, keys, parsed, startphase, startoffset, endphase,
+                     endoffset):
+        """Compute the time windows of a job, a group of events at a time.
+
+        Yields the lines of every group. The number of lines is limited by
+        jobLines instead of max_lines.
+        """
+
+        lines = 0
+        for i in xrange(0, len(parsed), JOB_EVENTS):
+            result = self.eventWindows(parsed[i:i + JOB_EVENTS], keys,
+                                       startphase, startoffset, endphase,
+                                       endoffset,
+                                       maxLines=self.jobLines - lines)
+            if result is None:
+                raise jobqueue.JobError("Maximum request size exceeded")
+
+            result = [line for group in result for line in group]
+            lines += len(result)
+            yield result
+
+    def __parallelWindows(self, slot, parsed, keys, startphase, startoffset,
+                          endphase, endoffset):
+        """Compute the time windows of groups of streams in the worker
+        processes.
+
+        The epochs of every stream are looked up by only one worker. The
+        results are merged in the order of the events and streams. The
+        number of lines computed by all the workers is counted in the given
+        slot of the shared array, so that they stop as soon as it is larger
+        than max_lines. Returns None in that case.
+        """
+
+        size = -(-len(keys) // (4 * self.processes))
+        tasks = [(parsed, keys[i:i + size], startphase, startoffset,
+                  endphase, endoffset, slot)
+                 for i in xrange(0, len(keys), size)]
+
+        # The reference to the pool keeps it alive until all the parts are
+        # received, even if it is replaced meanwhile
+        pool = self.__getPool()
+        self.__lines[slot] = 0
+        parts = pool.imap(_eventWindows, tasks)
+
+        try:
+            result = [[] for ev in parsed]
+            for part in parts:
+                if part is None:
+                    return None
+
+                for (lines, partLines) in zip(result, part):
+                    lines.extend(partLines)
+
+        finally:
+            # Stop the groups not started yet and wait for the rest, so
+            # that the slot can be used again
+            self.__lines[slot] = sys.maxint
+            while True:
                 try:
-                    if len(nscl) != 4:
-                        msg = "Invalid stream: " + str(nscl)
-                        raise wsgicomm.WIClientError, msg
+                    parts.next()
+                except StopIteration:
+                    break
+                except Exception:
+                    # Only the first error of the workers is reported
+                    pass
 
-                    net = str(nscl[0])
-                    sta = str(nscl[1])
-                    cha = str(nscl[2])
-                    loc = str(nscl[3])
+        return result
 
-                except (TypeError, ValueError):
-                    msg = "Invalid stream: " + str(nscl)
-                    raise wsgicomm.WIClientError, msg
+    def __getPool(self):
+        """Return the worker processes, starting them if needed.
 
-                # we don't have actual time window yet, just use ev_time to
-                # get the coordinates
-                streamInfo = self.ic.getStreamInfo(ev_time, ev_time, net, sta,
-                                                   cha, loc)
+        The processes are forked from the one running this module, while
+        the inventory is not being reloaded, and keep its version of the
+        inventory. When the inventory changes, the old processes exit after
+        their tasks and new ones are started. Forking does not work with
+        processes running several threads (e.g. the daemon processes of
+        mod_wsgi with threads > 1), as the workers would inherit the locks
+        held by the other threads.
+        """
 
-                if streamInfo is None:  # stream is not available
-                    continue
+        version = self.ic.version
 
-                st_lat = streamInfo['latitude']
-                st_lon = streamInfo['longitude']
-                st_alt = streamInfo['elevation']
+        with self.__poolLock:
+            if self.pool is None or self.__poolVersion != version:
+                if self.pool is not None:
+                    self.pool.close()
 
-                start_time = None
-                end_time = None
+                (self.__poolVersion, self.pool) = self.ic.whileNotReloading(
+                    lambda: multiprocessing.Pool(self.processes, _initWorker,
+                                                 (self,)))
 
-                # Assumption here is that compute() returns phases sorted by
-                # time. Therefore breaking after the first gives the earliest
-                # phase in the set defined in __isphase().
-                # FIXME: Combine startphase and endphase logic into
-                # function+loop?
+            return self.pool
 
-                # Compute in delta the distance between event and station
-                delta = Math.delazi(ev_lat, ev_lon, st_lat, st_lon)[0]
-                # Threshold distance in degrees at which PKP arrives earlier
-                # than P and friends (see Joachim's email - 14.08.2013)
-                delta_threshold = 120
+    def eventWindows(self, parsed, keys, startphase, startoffset, endphase,
+                     endoffset, slot=None, maxLines=None):
+        """Compute the time windows of some events.
 
-                try:
-                    ttlist = self.ttt.compute(ev_lat, ev_lon, ev_dep, st_lat,
-                                              st_lon, st_alt)
-                except Exception, e:
-                    msg = "/metadata/timewindows: exception from " + \
-                        "ttt.compute(): " + str(e)
-                    logs.error(msg)
-                    continue
+        Input: parsed={list}           # [(lat, lon, depth, time),..]
+               keys={list}             # [(net, sta, cha, loc),..]
+
+        The rest of the parameters are as in __timewindows_ev. Returns a
+        list with the lines of every event, or None if there are more than
+        maxLines (by default max_lines), counting those of all the groups
+        of streams of the same request (in slot) in the worker processes.
+        """
+
+        if maxLines is None:
+            maxLines = self.max_lines
+
+        if slot is not None and self.__lines[slot] > maxLines:
+            return None
+
+        # Streams available at the time of every event. We don't have the
+        # actual time windows yet, just use ev_time to get the coordinates
+        infos = self.ic.getStreamInfoMany(
+            [(ev[3], ev[3]) for ev in parsed for key in keys],
+            keys * len(parsed))
+
+        # Streams available at every event and their locations. The time
+        # window is the same for all the streams at a location.
+        availability = []
+        stations = []
+        deltas = []
+
+        for (pos, (ev_lat, ev_lon, ev_dep, ev_time)) in enumerate(parsed):
+            available = [(key, (streamInfo['latitude'],
+                                streamInfo['longitude'],
+                                streamInfo['elevation']))
+                         for (key, streamInfo) in
+                         zip(keys, infos[pos * len(keys):(pos + 1) * len(keys)])
+                         if streamInfo is not None]
+            availability.append(available)
+
+            if not available:
+                continue
+
+            coords = list(set(coords for (key, coords) in available))
 
+            # Compute the distances between the event and all the locations
+            dist = geodesy.delazi([ev_lat], [ev_lon],
+                                  [c[0] for c in coords],
+                                  [c[1] for c in coords])[0][0]
+
+            stations.extend((ev_lat, ev_lon, ev_dep) + c for c in coords)
+            deltas.extend(float(d) for d in dist)
+
+        # Travel times of both phases from every event to every location
+        failed = set()
+        try:
+            starts = self.__traveltimes(startphase, stations, deltas, failed)
+            ends = self.__traveltimes(endphase, stations, deltas, failed)
+
+        except ValueError, e:
+            logs.error("/metadata/timewindows: " + str(e))
+            return [[] for ev in parsed]
+
+        locations = {}
+        for (i, station) in enumerate(stations):
+            if i in failed:
+                continue
+
+            if starts[i] is None:
+                msg = "/metadata/timewindows: did not find startphase " \
+                    + "'%s' for %s" % (startphase, str(station))
+                logs.error(msg)
+
+            if ends[i] is None:
+                msg = "/metadata/timewindows: did not find endphase " \
+                    + "'%s' for %s" % (endphase, str(station))
+                logs.error(msg)
+
+            if starts[i] is not None and ends[i] is not None:
+                locations[station] = (starts[i], ends[i])
+
+        # Time windows of the streams with both phases
+        windows = []
+        found = []
+        events = []
+
+        for (pos, (ev_lat, ev_lon, ev_dep, ev_time)) in enumerate(parsed):
+            for (key, coords) in availability[pos]:
                 try:
-                    for tt in ttlist:
-                        if (startphase == 'P') and (delta >= delta_threshold):
-                            if (tt.phase.startswith('PKP') or
-                                    tt.phase.startswith('PKiKP')):
-                                start_time = ev_time + \
-                                    datetime.timedelta(seconds=tt.time +
-                                                       startoffset * 60)
-                                break
-
-                        elif ((startphase == 'S') or
-                              ((startphase == 'P') and
-                               (delta < delta_threshold))):
-                            if self.__isphase(tt.phase, startphase):
-                                start_time = ev_time + datetime.timedelta(
-                                    seconds=tt.time + startoffset * 60)
-                                break
-                        elif (startphase == 'OT'):
-                            start_time = ev_time + datetime.timedelta(seconds=startoffset * 60)
-                        else:
-                            msg = 'Wrong startphase received! Only "P", ' + \
-                                '"S" and "OT" are implemented.'
-                            raise wsgicomm.WIClientError, msg
-
-                    for tt in ttlist:
-                        if (endphase == 'P') and (delta >= delta_threshold):
-                            if (tt.phase.startswith('PKP') or
-                                    tt.phase.startswith('PKiKP')):
-                                end_time = ev_time + datetime.timedelta(
-                                    seconds=tt.time + endoffset * 60)
-                                break
-
-                        elif ((endphase == 'S') or
-                              ((endphase == 'P') and
-                               (delta < delta_threshold))):
-                            if self.__isphase(tt.phase, endphase):
-                                end_time = ev_time + datetime.timedelta(
-                                    seconds=tt.time + endoffset * 60)
-                                break
-                        elif (endphase == 'OT'):
-                                end_time = ev_time + datetime.timedelta(seconds=endoffset * 60)
-                        else:
-                            msg = 'Wrong endphase received! Only "P", ' + \
-                                '"S" and "OT" are implemented.'
-                            raise wsgicomm.WIClientError, msg
-
-                except Exception, e:
-                    logs.error("/metadata/timewindows: " + str(e))
+                    (start, end) = locations[(ev_lat, ev_lon, ev_dep) +
+                                             coords]
+                except KeyError:
                     continue
 
-                if start_time is None:
-                    msg = "/metadata/timewindows: did not find startphase " \
-                        + "'%s' for %s" % (startphase, str((ev_lat, ev_lon,
-                                                            ev_dep, st_lat,
-                                                            st_lon, st_alt)))
-                    logs.error(msg)
-
-                if end_time is None:
-                    msg = "/metadata/timewindows: did not find endphase " \
-                        + "'%s' for %s" % (endphase, str((ev_lat, ev_lon,
-                                                          ev_dep, st_lat,
-                                                          st_lon, st_alt)))
-                    logs.error(msg)
-
-                if start_time is not None and end_time is not None:
-                    # retry with actual time window
-                    streamInfo = self.ic.getStreamInfo(start_time, end_time,
-                                                       net, sta, cha, loc)
-
-                    if streamInfo:
-                        result.append((start_time, end_time, net, sta, cha,
-                                       loc, streamInfo['size']))
-
-                        if len(result) > self.max_lines:
-                            msg = "Maximum request size exceeded"
-                            raise wsgicomm.WIClientError, msg
+                windows.append((ev_time + datetime.timedelta(
+                    seconds=start + startoffset * 60),
+                                ev_time + datetime.timedelta(
+                    seconds=end + endoffset * 60)))
+                found.append(key)
+                events.append(pos)
+
+        # retry with actual time windows
+        infos = self.ic.getStreamInfoMany(windows, found)
+
+        result = [[] for ev in parsed]
+        lines = 0
+        for ((start_time, end_time), (net, sta, cha, loc), pos,
+             streamInfo) in zip(windows, found, events, infos):
+            if streamInfo:
+                result[pos].append((start_time, end_time, net, sta, cha, loc,
+                                    streamInfo['size']))
+                lines += 1
+
+                if lines > maxLines:
+                    return None
+
+        if slot is not None:
+            with self.__lines.get_lock():
+                self.__lines[slot] += lines
+                if self.__lines[slot] > maxLines:
+                    return None
 
         return result
 
@@ -698,8 +1056,14 @@ class WI_Module(object):
                start={datetimestring}
                end={datetimestring}
                streams=JSON
+               [mode=job]
            Response:   JSON
 
+        With mode=job, the time windows are computed in the background and
+        the response is the id and status of the job. Its status and result
+        are then available from /metadata/timewindows/status and
+        /metadata/timewindows/result.
+
         """
 
         if 'streams' not in params:
@@ -739,6 +1103,30 @@ class WI_Module(object):
         except ValueError, e:
             raise wsgicomm.WIClientError, str(e)
 
+        if params.get('mode') == 'job':
+            if self.jobs is None:
+                raise wsgicomm.WIClientError, "jobs are not enabled"
+
+            # The request is checked before it is queued
+            if mode == 'tw':
+                (keys, error) = self.__streamKeys(streams, "invalid stream: ")
+                if error is not None:
+                    raise wsgicomm.WIClientError, error
+
+                def job():
+                    yield self.__timewindows_tw(streams, start_time, end_time,
+                                                self.jobLines)
+
+            else:
+                (keys, parsed) = self.__parseEvents(streams, events)
+
+                def job():
+                    return self.__jobWindows(keys, parsed, startphase,
+                                             startoffset, endphase, endoffset)
+
+            jobid = self.jobs.submit(self.__client(envir), job, MyJSONEncoder)
+            return json.dumps({'id': jobid, 'status': jobqueue.QUEUED})
+
         if mode == 'tw':
             result = self.__timewindows_tw(streams, start_time, end_time)
 
@@ -749,8 +1137,66 @@ class WI_Module(object):
         if isinstance(result, tuple):
             return result
 
-        try:
-            return json.dumps(result, cls=MyJSONEncoder, indent=4)
+        return wsgicomm.StreamedResponse(wsgicomm.iterJSON(result,
+                                                           MyJSONEncoder))
 
-        except ValueError, e:
-            raise wsgicomm.WIInternalError, str(e)
+    def __client(self, envir):
+        """Address of the client of a request, used to share the job queue
+        fairly.
+
+        X-Forwarded-For is set by the client, so only the addresses added
+        by the trusted proxies are used. They are read from the end, up to
+        the first one which is not a trusted proxy.
+
+        """
+
+        client = envir.get('REMOTE_ADDR', '')
+        forwarded = envir.get('HTTP_X_FORWARDED_FOR')
+
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.split(',')]
+            while client in self.proxies and hops and hops[-1]:
+                client = hops.pop()
+
+        return client
+
+    def __getJob(self, params):
+        if self.jobs is None:
+            raise wsgicomm.WIClientError, "jobs are not enabled"
+
+        jobid = params.get('id')
+        status = self.jobs.status(jobid)
+        if status is None:
+            raise wsgicomm.WIClientError, "unknown job: " + str(jobid)
+
+        return (jobid, status)
+
+    def jobStatus(self, envir, params):
+        """ <wsgi root>/metadata/timewindows/status?id={jobid}
+        Status of a job of time windows
+           Response:   JSON with the id, status (queued, running, done or
+                       failed), number of lines computed, submission and
+                       end times and error of the job
+
+        """
+
+        (jobid, status) = self.__getJob(params)
+        return json.dumps(status)
+
+    def jobResult(self, envir, params):
+        """ <wsgi root>/metadata/timewindows/result?id={jobid}
+        Result of a job of time windows
+           Response:   JSON, as /metadata/timewindows
+
+        """
+
+        (jobid, status) = self.__getJob(params)
+
+        if status['status'] == jobqueue.FAILED:
+            raise wsgicomm.WIClientError, status['error']
+
+        result = self.jobs.result(jobid)
+        if result is None:
+            raise wsgicomm.WIClientError, "job not finished: " + jobid
+
+        return wsgicomm.StreamedResponse(result)
@@ -0,0 +1,346 @@
+"""Travel times for the Arclink web interface
+
+The time windows related to events start and end at the first arrival of
+the P or S phases at every station. Only the first arrival of every group
+of phases is needed, and it depends mostly on the distance between the
+event and the station and on the depth of the event.
+
+The first arrivals computed are kept in a least recently used cache keyed
+by the distance and the depth, rounded to a given resolution. Stations at
+(almost) the same distance from events at (almost) the same depth share
+the travel times, which are computed only once.
+
+The first arrivals can also be computed in advance on a grid of distances
+and depths (see writeGrid) and saved in a file, which is mapped in memory
+by the web interface. The travel times of many stations are then
+interpolated from the grid all together. The travel time table is only
+used where the grid has no value.
+
+"""
+
+import os
+import math
+import mmap
+import json
+import array
+import struct
+
+import lrucache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = 'WDC3TTG\0'
+VERSION = 1
+
+# Name of the file with the grid in the data directory
+GRIDFILE = 'webinterface-traveltimes.grid'
+
+# Default distances (degrees) and depths (km) of the grid: first, step and
+# number of values
+DISTANCES = (0.0, 0.5, 361)
+DEPTHS = (0.0, 10.0, 71)
+
+# Phases which can be requested
+PHASES = ('OT', 'P', 'S')
+
+# Threshold distance in degrees at which PKP arrives earlier than P and
+# friends (see Joachim's email - 14.08.2013)
+DELTA_THRESHOLD = 120
+
+# The list of phases P and S has been provided by Joachim per email on
+# 14.08.2013
+GROUPS = (
+    ('P', lambda phase: phase in ('P', 'Pg', 'Pb', 'Pn', 'Pdif', 'Pdiff')),
+    ('S', lambda phase: (phase in ('S', 'Sg', 'Sb', 'Sn', 'Sdif', 'Sdiff') or
+                         phase.startswith('SKS'))),
+    ('PKP', lambda phase: (phase.startswith('PKP') or
+                           phase.startswith('PKiKP'))),
+)
+
+
+class Arrivals(object):
+    """First arrival of every group of phases at a station."""
+
+    __slots__ = ('times', 'computed')
+
+    def __init__(self, times, computed):
+        # Travel time (in seconds) of the first phase of every group found
+        self.times = times
+
+        # Whether any phase was computed at all
+        self.computed = computed
+
+    def time(self, phase, delta):
+        """Return the travel time of a phase ('P', 'S' or 'OT', the origin
+        time) to a station at a distance of delta degrees, or None if it
+        does not arrive there.
+
+        """
+
+        # March/April 2014: Phase "OT" contributed by Carlo Cauzzi, ETHZ.
+        if phase == 'OT':
+            return 0.0 if self.computed else None
+
+        if phase == 'P' and delta >= DELTA_THRESHOLD:
+            return self.times.get('PKP')
+
+        if phase in ('P', 'S'):
+            return self.times.get(phase)
+
+        checkPhase(phase)
+
+
+def checkPhase(phase):
+    """Raise ValueError if a phase cannot be requested."""
+    if phase not in PHASES:
+        raise ValueError, 'Wrong phase received! Only "P", "S" and "OT" ' + \
+            'are implemented.'
+
+
+def firstArrivals(ttlist):
+    """Find the first arrival of every group of phases in a list of travel
+    times sorted by time, as returned by TravelTimeTable.compute().
+
+    """
+
+    times = {}
+    for tt in ttlist:
+        for (group, ingroup) in GROUPS:
+            if group not in times and ingroup(tt.phase):
+                times[group] = tt.time
+
+    return Arrivals(times, len(ttlist) > 0)
+
+
+class TravelTimeCache(object):
+    """First arrivals at stations, computed with a travel time table.
+
+    The arrivals are kept for maxsize combinations of event and station.
+    With a resolution of 0, only the exact same positions of the event and
+    the station share them. Otherwise, they are keyed by the distance,
+    rounded to a multiple of resolution (in degrees), and computed for the
+    rounded distance along the equator, as in writeGrid, so that they do
+    not depend on the stations which were asked about first. The depth is
+    rounded in the same way to a multiple of depthResolution (in km) if it
+    is not 0. The elevation of the station is always used as it is.
+
+    """
+
+    def __init__(self, ttt, maxsize, resolution=0, depthResolution=0):
+        self.ttt = ttt
+        self.resolution = resolution
+        self.depthResolution = depthResolution
+        self.cache = lrucache.LRUCache(maxsize, lambda arrivals: 1)
+
+    def arrivals(self, station, delta):
+        """Return the Arrivals of the phases of an event at a station.
+
+        station is a tuple (ev_lat, ev_lon, ev_dep, st_lat, st_lon, st_alt)
+        and delta the distance between them in degrees. The exceptions of
+        the travel time table are passed to the caller.
+
+        """
+
+        (evlat, evlon, depth, stlat, stlon, alt) = station
+
+        if self.depthResolution > 0:
+            depth = round(depth / self.depthResolution) * \
+                self.depthResolution
+
+        if self.resolution > 0:
+            (evlat, evlon, stlat) = (0.0, 0.0, 0.0)
+            stlon = round(delta / self.resolution) * self.resolution
+
+        key = (evlat, evlon, depth, stlat, stlon, alt)
+
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        result = firstArrivals(self.ttt.compute(*key))
+        self.cache.put(key, result)
+        return result
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def writeGrid(filename, ttt, distances=DISTANCES, depths=DEPTHS):
+    """Compute the first arrivals of every group of phases on a grid and
+    save them.
+
+    distances and depths are (first, step, count) tuples. The travel times
+    are computed with the table ttt from events on the equator to stations
+    at sea level along the equator. Phases which do not arrive are stored
+    as NaN. The file is written under a temporary name and then renamed.
+
+    """
+
+    groups = [group for (group, ingroup) in GROUPS]
+    values = dict((group, array.array('d')) for group in groups)
+
+    for j in xrange(depths[2]):
+        depth = depths[0] + j * depths[1]
+        for i in xrange(distances[2]):
+            distance = distances[0] + i * distances[1]
+            arrivals = firstArrivals(ttt.compute(0.0, 0.0, depth, 0.0,
+                                                 distance, 0.0))
+            for group in groups:
+                values[group].append(arrivals.times.get(group, float('nan')))
+
+    toc = {'groups': groups, 'distances': list(distances),
+           'depths': list(depths)}
+    tocstr = json.dumps(toc)
+    header = MAGIC + struct.pack('=II', VERSION, len(tocstr)) + tocstr
+    header += '\0' * (_align(len(header)) - len(header))
+
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as fout:
+        os.chmod(tmpfile, 0o0664)
+        fout.write(header)
+        for group in groups:
+            fout.write(values[group].tostring())
+
+    os.rename(tmpfile, filename)
+
+
+class TravelTimeGrid(object):
+    """First arrivals on a grid of distances and depths, mapped in memory.
+
+    Use load() to open a file written by writeGrid().
+
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as fin:
+            try:
+                self.map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError) as e:
+                raise ValueError('Not a grid of travel times: %s' % e)
+
+        start = len(MAGIC) + 8
+        if len(self.map) < start or self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a grid of travel times')
+
+        version, toclen = struct.unpack('=II', self.map[len(MAGIC):start])
+        if version != VERSION:
+            raise ValueError('Unsupported version of the grid of travel '
+                             'times: %d' % version)
+
+        toc = json.loads(self.map[start:start + toclen])
+        self.groups = toc['groups']
+        self.distances = tuple(toc['distances'])
+        self.depths = tuple(toc['depths'])
+
+        self.base = _align(start + toclen)
+        self.size = self.distances[2] * self.depths[2]
+        if len(self.map) < self.base + 8 * self.size * len(self.groups):
+            raise ValueError('Truncated grid of travel times')
+
+        # One matrix of depths x distances for every group of phases
+        self.values = None
+        if numpy is not None:
+            self.values = numpy.frombuffer(
+                self.map, numpy.float64, self.size * len(self.groups),
+                self.base).reshape(len(self.groups), self.depths[2],
+                                   self.distances[2])
+
+    def __value(self, g, j, i):
+        return struct.unpack_from('=d', self.map, self.base + 8 *
+                                  ((g * self.depths[2] + j) *
+                                   self.distances[2] + i))[0]
+
+    def __interpolate(self, g, x, y):
+        """Bilinear interpolation of a group at the position (x, y) of the
+        grid of distances and depths (in steps).
+
+        """
+
+        if not (0 <= x <= self.distances[2] - 1 and
+                0 <= y <= self.depths[2] - 1):
+            return float('nan')
+
+        i = min(int(x), self.distances[2] - 2)
+        j = min(int(y), self.depths[2] - 2)
+        fx = x - i
+        fy = y - j
+        return ((self.__value(g, j, i) * (1 - fx) +
+                 self.__value(g, j, i + 1) * fx) * (1 - fy) +
+                (self.__value(g, j + 1, i) * (1 - fx) +
+                 self.__value(g, j + 1, i + 1) * fx) * fy)
+
+    def __group(self, group, deltas, depths):
+        """Interpolated travel times of a group of phases, NaN where they
+        are not known.
+
+        """
+
+        g = self.groups.index(group)
+
+        if self.values is None:
+            return [self.__interpolate(g, (d - self.distances[0]) /
+                                       self.distances[1],
+                                       (z - self.depths[0]) / self.depths[1])
+                    for (d, z) in zip(deltas, depths)]
+
+        x = (numpy.asarray(deltas, dtype=float) - self.distances[0]) / \
+            self.distances[1]
+        y = (numpy.asarray(depths, dtype=float) - self.depths[0]) / \
+            self.depths[1]
+        inside = ((x >= 0) & (x <= self.distances[2] - 1) &
+                  (y >= 0) & (y <= self.depths[2] - 1))
+        x = numpy.where(inside, x, 0)
+        y = numpy.where(inside, y, 0)
+
+        i = numpy.minimum(x.astype(int), self.distances[2] - 2)
+        j = numpy.minimum(y.astype(int), self.depths[2] - 2)
+        fx = x - i
+        fy = y - j
+        values = self.values[g]
+        result = ((values[j, i] * (1 - fx) + values[j, i + 1] * fx) *
+                  (1 - fy) +
+                  (values[j + 1, i] * (1 - fx) + values[j + 1, i + 1] * fx) *
+                  fy)
+        result[~inside] = numpy.nan
+        return result
+
+    def times(self, phase, deltas, depths):
+        """Return the travel times of a phase ('P', 'S' or 'OT') to stations
+        at distances deltas (in degrees) from events at the given depths.
+
+        The result is a list with None where the travel time is not known.
+
+        """
+
+        checkPhase(phase)
+
+        if phase == 'OT':
+            return [0.0] * len(deltas)
+
+        if phase == 'S':
+            result = self.__group('S', deltas, depths)
+
+        elif self.values is None:
+            result = [pkp if delta >= DELTA_THRESHOLD else p
+                      for (delta, p, pkp) in
+                      zip(deltas, self.__group('P', deltas, depths),
+                          self.__group('PKP', deltas, depths))]
+
+        else:
+            result = numpy.where(numpy.asarray(deltas) >= DELTA_THRESHOLD,
+                                 self.__group('PKP', deltas, depths),
+                                 self.__group('P', deltas, depths))
+
+        return [None if math.isnan(t) else float(t) for t in result]
+
+
+def load(filename):
+    """Open a grid of travel times."""
+    if not os.path.exists(filename):
+        raise IOError('%s not found' % filename)
+
+    return TravelTimeGrid(filename)
@@ -93,7 +93,11 @@ class WebInterface(object):
 
         # Add inventory cache here, to be accessible to all modules
         inventory = os.path.join(self.server_folder, 'data', 'Arclink-inventory.xml')
-        self.ic = InventoryCache(inventory)
+        self.ic = InventoryCache(inventory,
+                                 self.getConfigString('metadata.backend',
+                                                      'columnar'),
+                                 self.getConfigInt('metadata.segments.size',
+                                                   256) * 1024 * 1024)
 
         # Load all modules in given directory.
         # Modules must contain a class WI_Module, whose __init__() takes
@@ -311,7 +315,14 @@ def application(environ, start_response):
             error_page += '\n' + extra
         return send_plain_response(error.status, error_page, start_response)
 
-    if isinstance(res_string, basestring):
+    if isinstance(res_string, CachedResponse):
+        return send_cached_response(environ, res_string, start_response)
+
+    elif isinstance(res_string, StreamedResponse):
+        status = '200 OK'
+        return send_streamed_response(status, res_string, start_response)
+
+    elif isinstance(res_string, basestring):
         status = '200 OK'
         body = res_string
         return send_plain_response(status, body, start_response)
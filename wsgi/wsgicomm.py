@@ -25,6 +25,10 @@ version. For more information, see http://www.gnu.org/
 
 """
 
+import json
+import hashlib
+import itertools
+
 
 ##################################################################
 #
@@ -88,6 +92,96 @@ class WIServiceError(WIError):
         WIError.__init__(self, "503 Service Unavailable", *args, **kwargs)
 
 
+##################################################################
+#
+# Responses which are built only once
+#
+##################################################################
+
+
+class CachedResponse(str):
+    """Plain text response which does not change between requests.
+
+    The body is serialized only once and kept as a string, together with
+    a strong entity tag computed from its content. The application handler
+    sends the ETag and Cache-Control headers with it and answers with
+    "304 Not Modified" if the client already has the same body.
+
+    Inputs:
+      body       - string, content to send to the client
+      maxage     - integer, seconds the client may use the body without
+                   asking again
+
+    """
+
+    def __new__(cls, body, maxage=3600):
+        self = str.__new__(cls, body)
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.maxage = maxage
+        return self
+
+    def matches(self, environ):
+        """Check if the client sent If-None-Match with the tag of the body."""
+
+        header = environ.get('HTTP_IF_NONE_MATCH')
+        if not header:
+            return False
+
+        for tag in header.split(','):
+            tag = tag.strip()
+            # Weak comparison is used for If-None-Match (RFC 7232)
+            if tag.startswith('W/'):
+                tag = tag[2:]
+
+            if tag == '*' or tag == self.etag:
+                return True
+
+        return False
+
+
+class StreamedResponse(object):
+    """Plain text response sent to the client as it is produced.
+
+    The body is an iterable of strings, which the application handler
+    passes to the WSGI server without joining them, so that the response
+    is never kept in memory as a whole. Errors must be detected before
+    the response is returned, as the status is sent with the first part.
+
+    Inputs:
+      body       - iterable of strings with the parts of the content
+
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def __iter__(self):
+        return iter(self.body)
+
+
+def iterJSON(rows, cls=None, chunksize=1000):
+    """Serialize a sequence of rows as a compact JSON array.
+
+    The rows are encoded in groups of chunksize, and one string is
+    generated for every group. cls is an optional JSONEncoder subclass.
+
+    """
+
+    encoder = (cls or json.JSONEncoder)(separators=(',', ':'))
+    rows = iter(rows)
+    sep = '['
+
+    while True:
+        chunk = list(itertools.islice(rows, chunksize))
+        if not chunk:
+            break
+
+        yield sep + encoder.encode(chunk)[1:-1]
+        sep = ','
+
+    yield '[]' if sep == '[' else ']'
+
+
 ##################################################################
 #
 # Functions to send a response to the client
@@ -141,3 +235,33 @@ def send_file_response(status, body, start_response):
     start_response(status, response_headers)
     return body
 
+def send_cached_response(environ, body, start_response):
+    """Sends a CachedResponse in WSGI style.
+
+    Only the headers are sent if the client already has the same body.
+
+    """
+
+    response_headers = [('ETag', body.etag),
+                        ('Cache-Control', 'public, max-age=%d' % body.maxage)]
+
+    if body.matches(environ):
+        start_response('304 Not Modified', response_headers)
+        return []
+
+    response_headers.extend([('Content-Type', 'text/plain'),
+                             ('Content-Length', str(len(body)))])
+    start_response('200 OK', response_headers)
+    return [ str(body) ]
+
+def send_streamed_response(status, body, start_response):
+    """Sends a StreamedResponse in WSGI style.
+
+    The length of the content is not known in advance, so the server
+    decides how to delimit it (e.g. chunked transfer encoding).
+
+    """
+
+    response_headers = [('Content-Type', 'text/plain')]
+    start_response(status, response_headers)
+    return body